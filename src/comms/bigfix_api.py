@@ -1,31 +1,61 @@
 import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 import xml.etree.ElementTree as Et
 import json
 import threading
 import datetime
 import logging
 import time
+from comms.dashboard_cache import DashboardCache, ShardedDashboardCache, \
+    merge_asset, split_assets
+from comms.dashboard_spool import DashboardSpool
+from comms.dashboard_xml import DashboardPostTemplate, gzip_body
+from comms.fixlet_index import FixletIndex
+from comms.posted_state import DashboardPostedState
 from data.events import VulnerableAppEvent, ImplicatedAppEvent, Host
+from utils.lru_cache import LruCache, MISSING
+from utils.circuit_breaker import CircuitBreaker, CLOSED
+from utils.metrics import Histogram, Gauge, MetricFamily, \
+    DEFAULT_SIZE_BUCKETS
+from utils.retry_queue import RetryQueue
+from utils.shutdown_signal import WakeupSignal, wait_any
+from utils.striped_lock import StripedLock
+from utils.tracing import mark, finish
 from threading import Thread
 
+# seconds to wait for the switchboard to drain before the final cache post
+SHUTDOWN_DRAIN_TIMEOUT = 30
 
-def _bigfix_lock_required(func):
+# max number of sensor ids to resolve in one relevance query
+BESID_QUERY_CHUNK = 200
+
+# server errors worth retrying, the server may just be overloaded
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+# the dashboard cache is split into this many shards (each with a lock)
+DASHBOARD_CACHE_SHARDS = 16
+
+# banned file fixlet updates for the same md5 are serialized on one of these
+FIXLET_LOCK_STRIPES = 64
+
+# channel whose shutdown triggers the final cache post
+CACHE_POST_CHANNEL = 'BigFixCachePost'
+
+# title of our banned file fixlets, followed by the md5
+BANNED_FILE_FIXLET_PREFIX = 'Banned File - md5='
+
+
+class BigFixUnavailableError(Exception):
     """
-    Wrapper for functions requiring the bigfix manager lock
+    BigFix can't take requests right now: it answered with a server error,
+    or the circuit breaker is holding off requests to it.
     """
-    # TODO separate this into function that creates locks by name
-    # TODO need three locks: cache data, dashboard, malware fixlet updates
-    def wrapper(*args, **kwargs):
-        # since this is actually operating on class methods
-        # we still need the self attribute. Feels hacky, but it works
-        self = args[0]
-        self._manager_lock.acquire()
-        try:
-            result = func(*args, **kwargs)
-        finally:
-            self._manager_lock.release()
-        return result
-    return wrapper
+    pass
+
+
+# failures worth trying again later, as opposed to BigFix rejecting the data
+RETRYABLE_ERRORS = (requests.RequestException, BigFixUnavailableError)
 
 
 class BannedFileFixletData(object):
@@ -38,10 +68,19 @@ class BannedFileFixletData(object):
         self.relevance = relevance
 
 
-class BigFixApi:
+class _BesidBatch(object):
+    """
+    Sensor ids collected over a short window, to be resolved to besids
+    with a single relevance query.
+    """
+    def __init__(self):
+        self.sensor_ids = set()
+        self.done = threading.Event()
+        self.besids = dict()
+        self.error = None
 
-    # lock across all instances of this class
-    _manager_lock = threading.RLock()
+
+class BigFixApi:
 
     def __init__(self, fletch_config, switchboard):
         self._switchboard = switchboard
@@ -49,7 +88,6 @@ class BigFixApi:
         self._bigfix_protocol = fletch_config.ibm_bigfix.protocol
         self._auth = (fletch_config.ibm_bigfix.username,
                       fletch_config.ibm_bigfix.password)
-        self._manager_lock = BigFixApi._manager_lock
         self._packaging_interval = fletch_config.ibm_bigfix.packaging_interval
         self._bigfix_ssl_verify = fletch_config.ibm_bigfix.ssl_verify
         self._bigfix_custom_site_name = fletch_config.ibm_bigfix.bigfix_custom_site_name
@@ -60,6 +98,12 @@ class BigFixApi:
         with open(xml_template) as temp_open:
             self._dashboard_data_xml = temp_open.read()
 
+        # dashboard_data_xml cut up for building posts, rebuilt whenever
+        # a dashboard GET replaces it
+        self._dashboard_template = None
+        self._dashboard_template_source = None
+        self._dashboard_gzip = fletch_config.ibm_bigfix.dashboard_gzip
+
         # template for fixlets..
         xml_path = 'src/statics/bigfix_fixlet_template.xml'
         with open(xml_path) as temp_open:
@@ -82,54 +126,640 @@ class BigFixApi:
         # setup the logging
         self.logger = logging.getLogger(__name__)
 
+        # one pooled, keep-alive session for all of our REST calls
+        self._http_timeout = fletch_config.ibm_bigfix.http_timeout
+        self._session = self._build_session(fletch_config.ibm_bigfix)
+        self._request_latency = MetricFamily(
+            Histogram, "request_latency", "seconds a BigFix request took",
+            ("method", "endpoint"))
+
+        # how much each dashboard post and fixlet flush carries
+        self.dashboard_post_assets = Histogram(
+            "dashboard_post_assets", "computers per dashboard post",
+            DEFAULT_SIZE_BUCKETS)
+        self.dashboard_post_cves = Histogram(
+            "dashboard_post_cves", "CVE records per dashboard post",
+            DEFAULT_SIZE_BUCKETS)
+        self.fixlet_flush_md5s = Histogram(
+            "fixlet_flush_md5s", "banned file fixlets updated per flush",
+            DEFAULT_SIZE_BUCKETS)
+
+        # stop sending requests for a while when BigFix keeps failing
+        self._breaker = CircuitBreaker(
+            fletch_config.ibm_bigfix.circuit_breaker_threshold,
+            fletch_config.ibm_bigfix.circuit_breaker_reset)
+        self._breaker_reset = fletch_config.ibm_bigfix.circuit_breaker_reset
+
+        # dashboard data (by besid) and banned file events (by md5) that
+        # couldn't be sent, waiting for a retry
+        self._dashboard_retry = RetryQueue(
+            fletch_config.ibm_bigfix.retry_queue_size, merge_asset,
+            fletch_config.ibm_bigfix.retry_backoff_base,
+            fletch_config.ibm_bigfix.retry_backoff_max)
+        self._dashboard_retry_signal = WakeupSignal()
+        self._fixlet_retry = RetryQueue(
+            fletch_config.ibm_bigfix.retry_queue_size,
+            lambda queued, events: queued + events,
+            fletch_config.ibm_bigfix.retry_backoff_base,
+            fletch_config.ibm_bigfix.retry_backoff_max)
+        self._fixlet_retry_signal = WakeupSignal()
+
+        # sensor id -> besid lookups
+        self._besid_cache = LruCache(
+            fletch_config.ibm_bigfix.besid_cache_size,
+            ttl=fletch_config.ibm_bigfix.besid_cache_ttl)
+        self._besid_cache_negative_ttl = \
+            fletch_config.ibm_bigfix.besid_cache_negative_ttl
+        self._besid_batch_window = \
+            fletch_config.ibm_bigfix.besid_batch_window
+        self._besid_batch_lock = threading.Lock()
+        self._besid_batch = None
+
         # and setup our caching layer
         self._cache_enabled = fletch_config.ibm_bigfix.cache_enabled
-        self._cache = dict()
+        self._cache = ShardedDashboardCache(DASHBOARD_CACHE_SHARDS)
+
+        # the cache is posted early once it grows past either limit, and
+        # posts are split up to stay within them (0 for no limit)
+        self._packaging_max_cves = fletch_config.ibm_bigfix.packaging_max_cves
+        self._packaging_max_bytes = \
+            fletch_config.ibm_bigfix.packaging_max_bytes
+        self._flush_signal = WakeupSignal()
+
+        # wakes the purging loop to fsync the spool in time
+        self._spool_sync_signal = WakeupSignal()
+
+        # write-ahead spool of the cache, replayed here if the last run
+        # didn't get to post everything
+        self._spool = self._open_spool(fletch_config.ibm_bigfix)
+        if self._spool is not None:
+            replayed = self._spool.replay()
+            if replayed:
+                self._cache.merge(replayed)
+                self.logger.info("Replayed {0} spooled assets into the "
+                                 "local cache".format(len(replayed)))
+
+        # what the dashboard already has, so only changes get posted, and
+        # how often (seconds) to post everything again regardless
+        self._posted_state = None
+        if fletch_config.ibm_bigfix.dashboard_delta_posts:
+            self._posted_state = DashboardPostedState(
+                fletch_config.ibm_bigfix.dashboard_state_file,
+                fletch_config.ibm_bigfix.dashboard_state_max_age * 86400)
+            self._posted_state.load()
+        self._full_reconcile_interval = \
+            fletch_config.ibm_bigfix.dashboard_full_reconcile_interval * 3600
+        self._last_full_reconcile = time.time()
+
+        # the get, rebuild and put of a banned file fixlet has to be done
+        # by one thread at a time per md5, or paths can get lost
+        self._fixlet_locks = StripedLock(FIXLET_LOCK_STRIPES)
+
+        # banned file events waiting for the coalescing window, by md5
+        self._fixlet_coalesce_window = \
+            fletch_config.ibm_bigfix.fixlet_coalesce_window
+        self._fixlet_pending_lock = threading.Lock()
+        self._fixlet_pending = dict()
+
+        # md5 -> fixlet id, known paths and content of the fixlets in the
+        # custom site, saves going back to BigFix for every event
+        self._fixlet_index = FixletIndex()
 
         # finally kick off a thread responsible for sync'ing the
         # contents of our cache up to the bigfix server.
         # We make a new channel here so that we can capitalize on the
         # switchboard's built-in shutdown messaging to close our thread
         # when it is required
-        self._cache_post_chan = self._switchboard.channel('BigFixCachePost')
+        self._cache_post_chan = self._switchboard.channel(CACHE_POST_CHANNEL)
 
         # start the listener
-        Thread(target=self._cache_purging_loop,
-               name="bigfix_api_cache_purging_timer").start()
+        self._cache_purging_thread = Thread(
+            target=self._cache_purging_loop,
+            name="bigfix_api_cache_purging_timer")
+        self._cache_purging_thread.start()
+
+        self._fixlet_coalescing_thread = None
+        if self._fixlet_coalesce_window > 0:
+            self._fixlet_coalescing_thread = Thread(
+                target=self._fixlet_coalescing_loop,
+                name="bigfix_api_fixlet_coalescing")
+            self._fixlet_coalescing_thread.start()
+
+        self._fixlet_retry_thread = Thread(
+            target=self._fixlet_retry_loop,
+            name="bigfix_api_fixlet_retry")
+        self._fixlet_retry_thread.start()
+
+        if fletch_config.ibm_bigfix.fixlet_index_preload:
+            Thread(target=self._fixlet_index_load,
+                   name="bigfix_api_fixlet_index_load").start()
+
+        # optionally preload (and keep refreshing) every known sensor
+        if fletch_config.ibm_bigfix.besid_cache_warmup:
+            Thread(target=self._besid_warmup_loop,
+                   name="bigfix_api_besid_warmup").start()
+
+    def _build_session(self, bigfix_config):
+        """
+        Create the shared HTTP session. Connections are kept alive and
+        pooled, and requests are retried with an exponential backoff on
+        connection errors. GETs and PUTs are also retried on server errors.
+        POSTs are only retried if the connection failed, so a fixlet never
+        gets created twice.
+        :param bigfix_config: the ibm-bigfix section of the config
+        :return: a requests Session
+        """
+        retry = Retry(total=bigfix_config.http_retries,
+                      backoff_factor=bigfix_config.http_retry_backoff,
+                      status_forcelist=RETRY_STATUS_CODES,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=bigfix_config.http_pool_size,
+                              pool_maxsize=bigfix_config.http_pool_size,
+                              max_retries=retry)
+
+        session = requests.Session()
+        session.auth = self._auth
+        session.verify = self._bigfix_ssl_verify
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _request(self, method, endpoint, url, **kwargs):
+        """
+        Send a request to BigFix through the shared session, recording how
+        long it took (including retries) per endpoint. Connection errors
+        and server errors count towards opening the circuit breaker.
+        :param method: HTTP method, 'GET', 'POST' or 'PUT'
+        :param endpoint: short name of the api for the latency stats
+        :param url: full URL to request
+        :param kwargs: passed along to requests
+        :return: the requests Response
+        :raises BigFixUnavailableError: if the circuit breaker is open
+        """
+        if not self._breaker.allow():
+            raise BigFixUnavailableError(
+                "Not sending {0} {1}, BigFix is failing".format(
+                    method, endpoint))
+
+        kwargs.setdefault('timeout', self._http_timeout)
+        start = time.time()
+        try:
+            response = self._session.request(method, url, **kwargs)
+        except requests.RequestException:
+            self._breaker_failure()
+            raise
+        finally:
+            self._request_latency.labels(method, endpoint).observe(
+                time.time() - start)
+
+        if response.status_code >= 500:
+            self._breaker_failure()
+        else:
+            self._breaker.success()
+        return response
+
+    def _breaker_failure(self):
+        if self._breaker.failure():
+            self.logger.warning("BigFix keeps failing, holding off requests "
+                                "to it for {0} seconds".format(
+                                    self._breaker_reset))
+
+    def _raise_if_unavailable(self, response, action):
+        """
+        :raises BigFixUnavailableError: if BigFix answered with a server
+                error, so the action can be retried later
+        """
+        if response.status_code >= 500:
+            raise BigFixUnavailableError(
+                "Error in {0} to BigFix: {1}, API status code: {2}".format(
+                    action, response.text, response.status_code))
+
+    def request_latency_stats(self):
+        """
+        :return: dict of 'METHOD endpoint' to latency histogram snapshots
+        """
+        return dict(("{0} {1}".format(*labels), histogram.snapshot())
+                    for labels, histogram in self._request_latency.children())
+
+    def register_metrics(self, registry):
+        """
+        Expose the request latencies, post sizes, and the sizes of the
+        local cache and retry queues in a MetricsRegistry.
+        """
+        registry.register("bigfix_request_latency_seconds",
+                          self._request_latency)
+        registry.register("bigfix_dashboard_post_assets",
+                          self.dashboard_post_assets)
+        registry.register("bigfix_dashboard_post_cves",
+                          self.dashboard_post_cves)
+        registry.register("bigfix_fixlet_flush_md5s", self.fixlet_flush_md5s)
+        registry.register("bigfix_dashboard_cache_assets", Gauge(
+            "dashboard_cache_assets", "computers waiting for the next post",
+            self._cache.__len__))
+        registry.register("bigfix_dashboard_cache_cves", Gauge(
+            "dashboard_cache_cves", "CVE records waiting for the next post",
+            lambda: self._cache.cve_count))
+        registry.register("bigfix_dashboard_cache_bytes", Gauge(
+            "dashboard_cache_bytes", "estimated size of the next post",
+            lambda: self._cache.approx_bytes))
+        registry.register("bigfix_fixlet_pending", Gauge(
+            "fixlet_pending", "md5s waiting for the fixlet coalescing window",
+            lambda: len(self._fixlet_pending)))
+        registry.register("bigfix_retry_queue_items", Gauge(
+            "retry_queue_items", "items waiting for a retry",
+            self._dashboard_retry.__len__), queue="dashboard")
+        registry.register("bigfix_retry_queue_items", Gauge(
+            "retry_queue_items", "items waiting for a retry",
+            self._fixlet_retry.__len__), queue="fixlet")
+        registry.register("bigfix_circuit_breaker_open", Gauge(
+            "circuit_breaker_open",
+            "1 while requests to BigFix are being held off",
+            lambda: int(self._breaker.state != CLOSED)))
+        self._besid_cache.register_metrics(registry, "besids")
+
+    def join(self, timeout=None):
+        """
+        After a switchboard shutdown, wait for the final cache post and
+        fixlet updates to BigFix to finish.
+        :param timeout: max seconds to wait, None waits forever
+        :return: True if the cache posting threads have exited
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        threads = [self._cache_purging_thread, self._fixlet_retry_thread]
+        if self._fixlet_coalescing_thread is not None:
+            threads.append(self._fixlet_coalescing_thread)
+        for thread in threads:
+            thread.join(None if deadline is None
+                        else max(0, deadline - time.time()))
+        return not any(thread.is_alive() for thread in threads)
 
     def _cache_purging_loop(self):
         """
         NOTE: Run this in a separate thread, it is a never ending loop
         unless a service shutdown is issued.
         This function will, on the configured interval, grab the data from
-        the cache and send it over to bigfix.
+        the cache and send it over to bigfix. In between, dashboard data
+        waiting for a retry is posted again when due.
         """
+        next_post = time.time() + self._packaging_interval * 60
+        spool_segment = None
         while self._cache_post_chan.is_running():
 
-            # self.logger.debug("Current channel status: {}".format(
-            #     self._cache_post_chan.is_running()))
-
-            # repeat the sleep here to give us a chance to break the loop
-            for t in range(0, (self._packaging_interval*60/5) + 1):
-                if not self._cache_post_chan.is_running():
-                    break
-                time.sleep(5)
+            # sleep until the next interval, or until the cache is full.
+            # A channel shutdown wakes us up right away so we can do a
+            # final post on the way out. Before that final post, let the
+            # other channels finish delivering events into our cache.
+            timeout = max(0, next_post - time.time())
+            retry_due = self._dashboard_retry.due_in()
+            if retry_due is not None:
+                timeout = min(timeout, retry_due)
+            sync_due = self._spool.sync_due_in() \
+                if self._spool is not None else None
+            if sync_due is not None:
+                timeout = min(timeout, sync_due)
+            wait_any([self._cache_post_chan.shutdown_fileno(),
+                      self._flush_signal.fileno(),
+                      self._dashboard_retry_signal.fileno(),
+                      self._spool_sync_signal.fileno()],
+                     timeout)
+            self._dashboard_retry_signal.clear()
+            self._spool_sync_signal.clear()
+
+            # the last appends of a burst get fsync'd within the interval,
+            # not only at the next post
+            if self._spool is not None and self._spool.sync_due_in() == 0:
+                self._spool.sync()
+            if not self._cache_post_chan.is_running():
+                self._switchboard.join(SHUTDOWN_DRAIN_TIMEOUT)
+            elif self._flush_signal.is_set():
+                self.logger.info("Local cache is full, posting it to BigFix "
+                                 "ahead of the packaging interval.")
+            elif time.time() < next_post:
+                # woken up for a retry (or to schedule one), or to fsync
+                # the spool only
+                queued = self._dashboard_retry.take()
+                if queued:
+                    self.logger.info("Retrying the post of {0} items to "
+                                     "BigFix".format(len(queued)))
+                    self._post_and_compact(queued.values(), spool_segment)
+                continue
+            self._flush_signal.clear()
+            next_post = time.time() + self._packaging_interval * 60
+
+            # send off the cached data, or every now and then all of the
+            # data the dashboard should have. The spool is rotated first,
+            # everything spooled up to here is in the pulled data.
+            if self._spool is not None:
+                spool_segment = self._spool.rotate()
+            cache_output, traces = self._cache_pull_with_traces()
+            if self._full_reconcile_due():
+                cache_output = self._full_dashboard_state(cache_output)
+                self._last_full_reconcile = time.time()
+                self.logger.info("Full reconcile of the BigFix dashboard")
+
+            # anything waiting for a retry goes along in the same post
+            queued = self._dashboard_retry.take(force=True)
+            if queued:
+                consolidated = DashboardCache()
+                consolidated.merge(queued.values())
+                consolidated.merge(cache_output)
+                cache_output = list(consolidated.to_json().values())
 
-            # send off the cached data
-            cache_output = self._cache_pull_and_delete()
             if len(cache_output) > 0:
                 self.logger.info("Posting {} items to BigFix from "
                                  "the local cache.".format(len(cache_output)))
-                self.put_dashboard_data(cache_output)
+                outcome = self._post_and_compact(cache_output, spool_segment)
+                for trace in traces:
+                    trace.finish(outcome)
             else:
                 self.logger.debug("Skipping scheduled BigFix post, no data in "
                                   "the local cache.")
+                if spool_segment is not None:
+                    self._spool.compact(spool_segment)
+
+            if self._posted_state is not None:
+                self._posted_state.compact()
+
+        if len(self._dashboard_retry):
+            self.logger.warning(
+                "Shutting down with {0} items not posted to BigFix{1}".format(
+                    len(self._dashboard_retry),
+                    ", they are kept in the spool for the next start"
+                    if self._spool is not None else ""))
+        if self._spool is not None:
+            self._spool.close()
+        if self._posted_state is not None:
+            self._posted_state.close()
+        self._flush_signal.close()
+        self._dashboard_retry_signal.close()
+        self._spool_sync_signal.close()
+
+    def _post_and_compact(self, assets, spool_segment):
+        """
+        Post assets to the dashboard from the purging loop, whatever fails
+        is left in the retry queue. Once nothing is left waiting, the spool
+        is no longer needed up to spool_segment.
+        :param assets: list of assets in the BigFix format
+        :param spool_segment: last spool segment pulled from, or None
+        :return: how the post went, as a trace stage (see
+                 _post_dashboard_outcome), or "failed" on an unexpected
+                 error
+        """
+        try:
+            outcome = self._post_dashboard_outcome(assets)
+        except Exception as e:
+            self.logger.exception(e)
+            outcome = "failed"
+        posted = outcome == "posted"
+
+        if posted:
+            self._dashboard_retry.succeeded()
+        elif len(self._dashboard_retry):
+            self._dashboard_retry.failed()
+
+        if spool_segment is not None and not len(self._dashboard_retry):
+            self._spool.compact(spool_segment)
+        return outcome
+
+    def _open_spool(self, bigfix_config):
+        """
+        :param bigfix_config: the ibm-bigfix section of the config
+        :return: the DashboardSpool, or None if spooling is off or the
+                 spool directory can't be used
+        """
+        if not bigfix_config.cache_spool_dir or not self._cache_enabled:
+            return None
+        try:
+            return DashboardSpool(bigfix_config.cache_spool_dir,
+                                  bigfix_config.cache_spool_fsync_interval)
+        except (IOError, OSError) as e:
+            self.logger.error("Unable to use the dashboard spool, hits "
+                              "cached until the next post will be lost on "
+                              "a restart: {0}".format(e))
+            return None
+
+    def _full_reconcile_due(self):
+        return self._posted_state is not None and \
+            self._full_reconcile_interval > 0 and \
+            time.time() - self._last_full_reconcile >= \
+            self._full_reconcile_interval
+
+    def _full_dashboard_state(self, assets):
+        """
+        :param assets: assets about to be posted
+        :return: the assets merged with everything posted before
+        """
+        full_state = DashboardCache()
+        full_state.merge(self._posted_state.to_json())
+        full_state.merge(assets)
+        return list(full_state.to_json().values())
+
+    def _post_dashboard_assets(self, assets):
+        """
+        Post assets to the dashboard, see _post_dashboard_outcome.
+        :param assets: list of assets in the BigFix format
+        :return: True if BigFix accepted all of it
+        """
+        return self._post_dashboard_outcome(assets) == "posted"
 
-    def get_besid(self, cb_sensor_id):
+    def _post_dashboard_outcome(self, assets):
+        """
+        Post assets to the dashboard, and remember what was posted. Posts
+        bigger than the packaging limits are split up. Posts that fail
+        because BigFix is unavailable are queued for a retry, posts BigFix
+        rejects are dropped.
+        :param assets: list of assets in the BigFix format
+        :return: "posted" if BigFix accepted all of it, "rejected" if it
+                 turned any of it down, otherwise "retry_queued"
+        """
+        chunks = split_assets(assets, self._packaging_max_cves,
+                              self._packaging_max_bytes)
+        if len(chunks) > 1:
+            self.logger.info("Splitting the BigFix post into {0} "
+                             "posts".format(len(chunks)))
+
+        outcome = "posted"
+        for chunk in chunks:
+            self.dashboard_post_assets.observe(len(chunk))
+            self.dashboard_post_cves.observe(
+                sum(len(asset['cves']) for asset in chunk))
+            try:
+                posted = self.put_dashboard_data(chunk)
+            except RETRYABLE_ERRORS as e:
+                self.logger.warning("Dashboard post to BigFix failed, "
+                                    "queueing it for a retry: {0}".format(e))
+                self._queue_dashboard_retry(chunk)
+                if outcome == "posted":
+                    outcome = "retry_queued"
+                continue
+
+            if not posted:
+                outcome = "rejected"
+            elif self._posted_state is not None:
+                self._posted_state.record(chunk)
+        return outcome
+
+    def _queue_dashboard_retry(self, assets):
+        """
+        Queue assets for another dashboard post, merged with the ones
+        already waiting.
+        """
+        dropped = 0
+        for asset in assets:
+            if not self._dashboard_retry.put(asset['besid'], asset):
+                dropped += 1
+        if dropped:
+            self.logger.error("BigFix retry queue is full, dropped the "
+                              "dashboard data of {0} computers".format(dropped))
+        self._dashboard_retry_signal.set()
+
+    def get_besid(self, cb_sensor_id, bypass_cache=False):
         """
         Grabs the besid from the bigfix console that corresponds to
-        the cb_sensor_id we have.
+        the cb_sensor_id we have. Answers (including 'no such computer')
+        are cached, and concurrent lookups for the same sensor share a
+        single query to the BigFix server.
         :param cb_sensor_id: as you'd guess, the cb id number
+        :param bypass_cache: always query the BigFix server
+        :return: the besid as an int, or None if BigFix has no computer
+                 with this sensor id.
+        """
+        if bypass_cache:
+            return self._query_besid(cb_sensor_id)
+
+        if self._besid_batch_window > 0:
+            loader = self._batched_query_besid
+        else:
+            loader = self._query_besid
+
+        return self._besid_cache.get_or_load(
+            str(cb_sensor_id), loader,
+            none_ttl=self._besid_cache_negative_ttl)
+
+    def get_besids(self, cb_sensor_ids):
+        """
+        Resolve many sensor ids to besids with as few relevance queries as
+        possible (one per BESID_QUERY_CHUNK sensor ids). The answers,
+        including sensors BigFix doesn't know about, are added to the
+        besid cache.
+        :param cb_sensor_ids: iterable of cb sensor id numbers
+        :return: list of (sensor id as str, besid) tuples for the sensors
+                 BigFix knows about.
+        """
+        sensor_ids = sorted(set(str(sensor_id)
+                                for sensor_id in cb_sensor_ids))
+        results = list()
+        for start in range(0, len(sensor_ids), BESID_QUERY_CHUNK):
+            chunk = sensor_ids[start:start + BESID_QUERY_CHUNK]
+            found = self._query_besids(chunk)
+            results.extend(found)
+
+            found_ids = set(sensor_id for sensor_id, _ in found)
+            for sensor_id, besid in found:
+                self._besid_cache.put(sensor_id, besid)
+            for sensor_id in chunk:
+                if sensor_id not in found_ids:
+                    self._besid_cache.put(sensor_id, None,
+                                          self._besid_cache_negative_ttl)
+        return results
+
+    def warm_besid_cache(self):
+        """
+        Load the besid of every BigFix computer reporting a sensor id into
+        the besid cache, with a single relevance query.
+        :return: the number of sensors loaded
+        """
+        found = self._query_besids(None)
+        for sensor_id, besid in found:
+            self._besid_cache.put(sensor_id, besid)
+        self.logger.info("Loaded {0} sensor id to besid mappings from "
+                         "BigFix".format(len(found)))
+        return len(found)
+
+    def _besid_warmup_loop(self):
+        """
+        NOTE: Run this in a separate thread.
+        Warms the besid cache at startup and again before the entries
+        expire, until the service shuts down.
+        """
+        while self._cache_post_chan.is_running():
+            try:
+                self.warm_besid_cache()
+            except Exception as e:
+                self.logger.exception(e)
+
+            # refresh a little ahead of the cache ttl
+            refresh = max((self._besid_cache.ttl or 3600) * 0.9, 1)
+            if self._cache_post_chan.wait_for_shutdown(refresh):
+                break
+
+    def _batched_query_besid(self, cb_sensor_id):
+        """
+        Loader for the besid cache that batches up lookups. The first
+        sensor id missing from the cache opens a batch, waits for the batch
+        window for other lookups to join, then resolves all of them with a
+        single query.
+        :param cb_sensor_id: the cb sensor id number (as str)
+        :return: the besid as an int, or None if not found
+        """
+        with self._besid_batch_lock:
+            batch = self._besid_batch
+            leader = batch is None
+            if leader:
+                batch = self._besid_batch = _BesidBatch()
+            batch.sensor_ids.add(cb_sensor_id)
+
+        if leader:
+            time.sleep(self._besid_batch_window)
+            with self._besid_batch_lock:
+                self._besid_batch = None
+            try:
+                batch.besids = dict(self.get_besids(batch.sensor_ids))
+            except Exception as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.besids.get(cb_sensor_id)
+
+    def _query_besids(self, cb_sensor_ids):
+        """
+        Does the relevance query for get_besids and warm_besid_cache.
+        :param cb_sensor_ids: list of sensor ids (as str) to look up, or
+                              None for every computer with a sensor id.
+        :return: list of (sensor id as str, besid) tuples
+        """
+        sensor_id_property = \
+            'value of result from (bes property "Sensor ID") of it'
+        if cb_sensor_ids is None:
+            condition = 'exists result from (bes property "Sensor ID") of it'
+        else:
+            condition = '{0} is contained by set of ({1})'.format(
+                sensor_id_property,
+                '; '.join('"{0}"'.format(sensor_id)
+                          for sensor_id in cb_sensor_ids))
+        query_string = '({0}, id of it) of bes computers whose ({1})'.format(
+            sensor_id_property, condition)
+
+        req_result = self._request(
+            'GET', 'query', self._bigfix_query_api_url,
+            params={'relevance': query_string, 'output': 'json'},
+            headers={"Accept-Encoding": "gzip"})
+
+        result_json = json.loads(req_result.content)
+        return [(str(answer[0]), int(answer[1]))
+                for answer in result_json["result"]
+                if isinstance(answer, list) and len(answer) == 2]
+
+    def _query_besid(self, cb_sensor_id):
+        """
+        Does the actual relevance query for get_besid.
+        :param cb_sensor_id: the cb sensor id number
+        :return: the besid as an int, or None if not found
         """
 
         # build and send the query
@@ -140,16 +770,24 @@ class BigFixApi:
         payload = {'relevance': query_string}
 
         # need to manually
-        req_result = requests.get(self._bigfix_query_api_url, auth=self._auth,
-                                  verify=self._bigfix_ssl_verify,
-                                  params=payload,
-                                  headers={"Accept-Encoding": "gzip"})
+        req_result = self._request('GET', 'query', self._bigfix_query_api_url,
+                                   params=payload,
+                                   headers={"Accept-Encoding": "gzip"})
 
         # parse the XML answer
         xml_result = Et.fromstring(req_result.text)
-        besid = xml_result.find('Query').find('Result').find('Answer').text
-        # print besid
-        return int(besid)
+        answer = xml_result.find('Query').find('Result').find('Answer')
+        if answer is None or answer.text is None:
+            self.logger.info("No BigFix computer found for sensor id "
+                             "{0}".format(cb_sensor_id))
+            return None
+        return int(answer.text)
+
+    def besid_cache_stats(self):
+        """
+        :return: dict with the size and hit/miss counts of the besid cache
+        """
+        return self._besid_cache.stats()
 
     def get_dashboard_data(self, return_metadata=False):
         """
@@ -160,10 +798,8 @@ class BigFixApi:
         :return: Dashboard data in JSON format
         """
         self.logger.info('Pulling data from the BigFix dashboard')
-        self._dashboard_data_xml = requests.get(self._dashboard_url,
-                                                auth=self._auth,
-                                                verify=self._bigfix_ssl_verify
-                                                ).text
+        self._dashboard_data_xml = self._request(
+            'GET', 'dashboard', self._dashboard_url).text
 
         # parse the XML result, load the value as json, then do what we need
         xml_result = Et.fromstring(self._dashboard_data_xml)
@@ -186,6 +822,8 @@ class BigFixApi:
         BigFix will handle any data merging that is needed.
         :param json_data: JSON data to post. This should be the array of
                           assets that bigfix expects.
+        :return: True if BigFix accepted the post
+        :raises BigFixUnavailableError: if BigFix failed with a server error
         """
 
         # make the weird timestamp-as-name thing
@@ -198,9 +836,6 @@ class BigFixApi:
         time_name_string = "{0}.{1}".format(t_time_string, t_millisecond_str)
         name_string = "{0}.1 - Name".format(time_name_string)
 
-        xml_result = Et.fromstring(self._dashboard_data_xml)
-        xml_result.find('DashboardData').find('Name').text = name_string
-
         # construct the JSON wrapper around our data:
         json_wrapper = {
             'name': name_string,
@@ -213,68 +848,99 @@ class BigFixApi:
         # dump the json to string, save it to the XML value
         # then post the XML.
         data_out = json.dumps(json_wrapper)
-        xml_result.find('DashboardData').find('Value').text = data_out
-        generated_xml = Et.tostring(xml_result)
+        generated_xml = self._get_dashboard_template().render(
+            name_string, data_out)
 
         self.logger.info('Posting data to BigFix dashboard')
-        self.logger.debug("XML post to Dashboard: {0}".format(generated_xml))
-
-        requests.post(self._dashboard_url, auth=self._auth,
-                      verify=self._bigfix_ssl_verify,
-                      data=generated_xml)
+        self.logger.debug("XML post to Dashboard: %s", generated_xml)
+
+        headers = None
+        if self._dashboard_gzip:
+            generated_xml = gzip_body(generated_xml)
+            headers = {"Content-Encoding": "gzip"}
+
+        post_result = self._request('POST', 'dashboard', self._dashboard_url,
+                                    data=generated_xml, headers=headers)
+        self._raise_if_unavailable(post_result, 'dashboard POST')
+        if post_result.status_code != 200:
+            self.logger.warning("Error in dashboard POST to Bigfix: {0},"
+                                " API status code: {1}".format(
+                                    post_result.text,
+                                    post_result.status_code))
+            return False
+        return True
+
+    def _get_dashboard_template(self):
+        """
+        :return: DashboardPostTemplate of the current dashboard XML
+        """
+        source = self._dashboard_data_xml
+        if self._dashboard_template_source is not source:
+            self._dashboard_template = DashboardPostTemplate(source)
+            self._dashboard_template_source = source
+        return self._dashboard_template
 
     # TODO: need a cache purging function on some interval
-    @_bigfix_lock_required
-    def _cache_json_data(self, json_data):
+    def _cache_json_data(self, json_data, trace=None):
         """
         Cache the information that we need to provide to bigfix so that
         we can do it in a single huge push instead of doing a POST
         every time we get data in.
         :param json_data: the data to store. This function expects JUST the
                           'assets' list portion of the BigFix API spec.
+        :param trace: utils.tracing.Trace of the event, if it is traced.
+                      It is kept in the cache with the event's data, to be
+                      finished once the post carrying that data is done.
         """
 
         # this is going to be simple for now. We will merge all incoming
         # entries together so that bigfix can receive them. Their job is to
         # deduplicate / merge our data into their data store.
-        for asset in json_data:
-            if asset['besid'] not in self._cache:
-                self._cache[asset['besid']] = asset
-            else:
-                cached_asset = self._cache[asset['besid']]
-
-                # loop over all cves and ensure that the cve is cached
-                # if the cve already existed, and the new cve now indicates
-                # that it is implicated, set the cached version appropriately
-                for cve in asset['cves']:
-                    cve_found = False
-                    for cached_cve in cached_asset['cves']:
-                        if cve['id'] == cached_cve['id']:
-                            cve_found = True
-                            if cve['implicated'] == 1:
-                                cached_cve['implicated'] = 1
-                    if cve_found is False:
-                        cached_asset['cves'].append(cve)
-
-    @_bigfix_lock_required
+        # Whatever changed the cache goes to the spool, only after it is in
+        # the cache so it can't miss a pull that the spool's rotation saw.
+        changed = self._cache.merge(json_data, trace)
+        if changed and self._spool is not None:
+            try:
+                if self._spool.append(changed):
+                    self._spool_sync_signal.set()
+            except (IOError, OSError) as e:
+                self.logger.error("Unable to spool dashboard data: "
+                                  "{0}".format(e))
+
+        if (self._packaging_max_cves and
+                self._cache.cve_count >= self._packaging_max_cves) or \
+                (self._packaging_max_bytes and
+                 self._cache.approx_bytes >= self._packaging_max_bytes):
+            self._flush_signal.set()
+
     def _cache_pull_and_delete(self, return_type=list()):
         """
         This function grabs the data from the cache and returns it.
-        Nothing fancy here.
+        Each cache shard is swapped out under its own lock, so writers are
+        only held up for the swap, never for the post.
         :param return_type: Defaults to a list, since that is what
                             bigfix wants, but also allows for return of
                             the original dict to make testing easier.
         :return:  json data for the 'assets' array within the BigFix spec
         """
-        temp_data = self._cache
-        self._cache = dict()
-
+        temp_data = self._cache.pull()
         if isinstance(return_type, list):
-            return temp_data.values()
+            return list(temp_data.values())
         elif isinstance(return_type, dict):
             return temp_data
         else:
-            ValueError("Incorrect type requested")
+            raise ValueError("Incorrect type requested")
+
+    def _cache_pull_with_traces(self):
+        """
+        Grab the data from the cache, like _cache_pull_and_delete, along
+        with the traces of the events it came from.
+        :return: tuple of the 'assets' list and the list of Traces
+        """
+        assets, traces = self._cache.pull_with_traces()
+        for trace in traces:
+            trace.mark("packaging")
+        return list(assets.values()), traces
 
     def update_nvd_dashboard_data(self, event, bypass_cache=False):
         """
@@ -313,42 +979,218 @@ class BigFixApi:
                 "implicated": implication_status
             })
 
+        # drop what the dashboard already has
+        assets = [asset]
+        if self._posted_state is not None:
+            assets = self._posted_state.delta(assets)
+            if not assets:
+                self.logger.debug("Dashboard already has the CVEs of "
+                                  "{0}".format(asset['fqdn']))
+                finish(event.trace, "already_posted")
+                return
+
         # send the asset json to the cache
         # unless we are bypassing the cache, then send immediately
         if bypass_cache or self._cache_enabled is False:
-            self.put_dashboard_data([asset])
+            finish(event.trace, self._post_dashboard_outcome(assets))
         else:
-            self._cache_json_data([asset])
+            mark(event.trace, "cached")
+            self._cache_json_data(assets, event.trace)
 
     def process_banned_file_event(self, event):
         """
         The main function for handling of banned files. This will do all the
         work for other functions.
+        With a fixlet coalescing window, the event is only queued here and
+        the fixlet is updated at the end of the window, together with every
+        other event for the same md5.
         :param event: the Banned File Event
         """
         self.logger.debug('Processing Banned File {0}'.format(
             event.process.md5))
-        fixlet_xml_string = self._get_remediation_fixlet(event.process.md5)
+        md5 = event.process.md5.lower()
+
+        if self._fixlet_coalesce_window <= 0:
+            try:
+                with self._fixlet_locks.lock(md5):
+                    self._update_banned_file_fixlet([event])
+                finish(event.trace, "fixlet_updated")
+            except RETRYABLE_ERRORS as e:
+                self._queue_fixlet_retry(md5, [event], e)
+                finish(event.trace, "retry_queued")
+            except Exception:
+                finish(event.trace, "failed")
+                raise
+            return
+
+        with self._fixlet_pending_lock:
+            self._fixlet_pending.setdefault(md5, list()).append(event)
+
+    def _fixlet_coalescing_loop(self):
+        """
+        NOTE: Run this in a separate thread, it is a never ending loop
+        unless a service shutdown is issued.
+        Every coalescing window, updates the fixlet of each md5 that had
+        banned file events queued, once per md5.
+        """
+        while self._cache_post_chan.is_running():
+            if self._cache_post_chan.wait_for_shutdown(
+                    self._fixlet_coalesce_window):
+                self._switchboard.join(SHUTDOWN_DRAIN_TIMEOUT)
+            self._flush_banned_file_events()
 
-        # if were weren't able to find an existing fixlet, setup
-        # the banned file data object ourselves
-        if fixlet_xml_string is None:
-            self.logger.debug('No existing fixlet, creating new one.')
-            banned_file_data = BannedFileFixletData(md5=event.process.md5)
+    def _flush_banned_file_events(self):
+        """
+        Update the fixlets for all of the queued banned file events.
+        :return: the number of md5s updated
+        """
+        with self._fixlet_pending_lock:
+            pending = self._fixlet_pending
+            self._fixlet_pending = dict()
+
+        if pending:
+            self.fixlet_flush_md5s.observe(len(pending))
+        for md5, events in pending.items():
+            self.logger.debug('Updating fixlet of {0} with {1} banned file '
+                              'events'.format(md5, len(events)))
+            self._mark_traces(events, "coalescing")
+            try:
+                with self._fixlet_locks.lock(md5):
+                    self._update_banned_file_fixlet(events)
+                self._finish_traces(events, "fixlet_updated")
+            except RETRYABLE_ERRORS as e:
+                self._queue_fixlet_retry(md5, events, e)
+                self._finish_traces(events, "retry_queued")
+            except Exception as e:
+                self.logger.exception(e)
+                self._finish_traces(events, "failed")
+        return len(pending)
+
+    @staticmethod
+    def _mark_traces(events, stage):
+        for event in events:
+            mark(event.trace, stage)
+
+    @staticmethod
+    def _finish_traces(events, stage):
+        for event in events:
+            finish(event.trace, stage)
+
+    def _queue_fixlet_retry(self, md5, events, error):
+        """
+        Queue banned file events whose fixlet update failed for a retry,
+        together with any already waiting for the same md5.
+        """
+        if self._fixlet_retry.put(md5, events):
+            self.logger.warning("Fixlet update of {0} failed, queueing it "
+                                "for a retry: {1}".format(md5, error))
+            self._fixlet_retry_signal.set()
         else:
-            self.logger.debug('Found existing fixlet, unpacking..')
-            banned_file_data = self._unpack_remediation_fixlet(
-                fixlet_xml_string)
-
-        # if we have no updates to do, this will be set to None
-        banned_file_data = self._build_fixlet_commands(event, banned_file_data)
+            self.logger.error("BigFix retry queue is full, dropped the "
+                              "fixlet update of {0}: {1}".format(md5, error))
 
-        if banned_file_data is not None:
+    def _fixlet_retry_loop(self):
+        """
+        NOTE: Run this in a separate thread, it is a never ending loop
+        unless a service shutdown is issued.
+        Retries the fixlet updates that failed, whenever the retry queue is
+        due, and one last time on the way out.
+        """
+        while self._cache_post_chan.is_running():
+            wait_any([self._cache_post_chan.shutdown_fileno(),
+                      self._fixlet_retry_signal.fileno()],
+                     self._fixlet_retry.due_in())
+            self._fixlet_retry_signal.clear()
+            self._retry_banned_file_fixlets(
+                force=not self._cache_post_chan.is_running())
+
+        if len(self._fixlet_retry):
+            self.logger.warning("Shutting down with {0} banned file fixlets "
+                                "not updated in BigFix".format(
+                                    len(self._fixlet_retry)))
+        self._fixlet_retry_signal.close()
+
+    def _retry_banned_file_fixlets(self, force=False):
+        """
+        Update the fixlets waiting for a retry, if it is due. The ones that
+        fail again go back in the queue.
+        :param force: retry even if it isn't due yet
+        :return: the number of md5s tried
+        """
+        pending = self._fixlet_retry.take(force)
+        failed = False
+        for md5, events in pending.items():
+            try:
+                with self._fixlet_locks.lock(md5):
+                    self._update_banned_file_fixlet(events)
+            except RETRYABLE_ERRORS as e:
+                self._queue_fixlet_retry(md5, events, e)
+                failed = True
+            except Exception as e:
+                self.logger.exception(e)
+
+        if failed:
+            self._fixlet_retry.failed()
+        elif pending:
+            self._fixlet_retry.succeeded()
+        return len(pending)
+
+    def _update_banned_file_fixlet(self, events):
+        """
+        Get, rebuild and put the fixlet for one banned md5, adding the paths
+        of all of the events. The fixlet is fetched and sent at most once.
+        The caller holds the fixlet lock of the md5.
+        :param events: list of Banned File Events, all with the same md5
+        """
+        md5 = events[0].process.md5
+        indexed = self._fixlet_index.get(md5)
+
+        if indexed is not None:
+            # paths the fixlet already deletes need no work at all
+            events = [event for event in events
+                      if event.process.file_path not in indexed.paths]
+            if not events:
+                self.logger.debug('Fixlet not updated, path already present.')
+                return
+            fixlet_id = indexed.fixlet_id
+            banned_file_data = indexed.data
+        else:
+            fixlet_id = self._get_remediation_fixlet_id(md5)
+            fixlet_xml_string = self._get_remediation_fixlet(md5, fixlet_id)
+
+            # if were weren't able to find an existing fixlet, setup
+            # the banned file data object ourselves
+            if fixlet_xml_string is None:
+                self.logger.debug('No existing fixlet, creating new one.')
+                banned_file_data = BannedFileFixletData(md5=md5)
+            else:
+                self.logger.debug('Found existing fixlet, unpacking..')
+                banned_file_data = self._unpack_remediation_fixlet(
+                    fixlet_xml_string)
+                self._fixlet_index.put(md5, fixlet_id, banned_file_data)
+
+        # each event with a new path builds on the data of the one before,
+        # events with nothing to add give back None
+        updated = False
+        for event in events:
+            new_data = self._build_fixlet_commands(event, banned_file_data)
+            if new_data is not None:
+                banned_file_data = new_data
+                updated = True
+
+        if updated:
             self.logger.debug('Sending fixlet to BigFix.')
-            self._put_remediation_fixlet(
+            fixlet_id = self._put_remediation_fixlet(
                 self._build_remediation_fixlet(banned_file_data),
-                banned_file_data
+                banned_file_data,
+                fixlet_id
             )
+
+            # don't trust the index for this md5 if the update failed
+            if fixlet_id is None:
+                self._fixlet_index.discard(md5)
+            else:
+                self._fixlet_index.put(md5, fixlet_id, banned_file_data)
         else:
             self.logger.debug('Fixlet not updated, path already present.')
 
@@ -361,7 +1203,7 @@ class BigFixApi:
         fixlet_xml = Et.fromstring(self._fixlet_creation_template)
         current_time = datetime.datetime.utcnow()
         fixlet_xml.find('Fixlet').find('Title').text = \
-            'Banned File - md5={0}'.format(banned_file_data.md5)
+            BANNED_FILE_FIXLET_PREFIX + banned_file_data.md5
         fixlet_xml.find('Fixlet').find('Relevance').text = \
             banned_file_data.relevance
         fixlet_xml.find('Fixlet').find('SourceReleaseDate').text = \
@@ -397,10 +1239,8 @@ class BigFixApi:
             ' as lowercase contains "{1}" as lowercase)'.format(
                 self._bigfix_custom_site_name, md5)
 
-        req_result = requests.get(
-            self._bigfix_query_api_url,
-            auth=self._auth,
-            verify=self._bigfix_ssl_verify,
+        req_result = self._request(
+            'GET', 'query', self._bigfix_query_api_url,
             params={'relevance': query_string, 'output': 'json'},
             headers={"Accept-Encoding": "gzip"})
 
@@ -413,13 +1253,16 @@ class BigFixApi:
 
     # TODO build a delete fixlet function, would be helpful for testing
 
-    def _get_remediation_fixlet(self, md5):
+    def _get_remediation_fixlet(self, md5, fixlet_id=MISSING):
         """
         Grabs the XML of an existing fixlet from the BigFix server.
         :param md5: the md5 of the banned file to grab the fixlet of
+        :param fixlet_id: id of the fixlet if already looked up (None if
+                          there is no fixlet), saves another query
         :return: returns the XML as as string or, None, is fixlet doesn't exist
         """
-        fixlet_id = self._get_remediation_fixlet_id(md5)
+        if fixlet_id is MISSING:
+            fixlet_id = self._get_remediation_fixlet_id(md5)
 
         if fixlet_id is None:
             return None
@@ -430,9 +1273,8 @@ class BigFixApi:
             rest_query = "{0}/{1}".format(
                 self._bigfix_fixlet_api_url,
                 fixlet_id)
-            req_result = requests.get(rest_query,
-                                      auth=self._auth,
-                                      verify=self._bigfix_ssl_verify)
+            req_result = self._request('GET', 'fixlet', rest_query)
+            self._raise_if_unavailable(req_result, 'fixlet GET')
 
             if req_result.status_code != 200:
                 self.logger.warning(
@@ -444,39 +1286,104 @@ class BigFixApi:
             else:
                 return req_result.content
 
-    def _put_remediation_fixlet(self, xml_string, banned_file_data):
+    def _put_remediation_fixlet(self, xml_string, banned_file_data,
+                                fixlet_id=MISSING):
         """
         Send our newly created/updated fixlet up to the bigfix server.
         :param xml_string:  XML (as str) of the fixlet
         :param banned_file_data:
+        :param fixlet_id: id of the fixlet to update if already looked up,
+                          None to create a new fixlet
+        :return: id of the updated or created fixlet, None if that failed
+        :raises BigFixUnavailableError: if BigFix failed with a server error
         """
-
-        fixlet_id = self._get_remediation_fixlet_id(banned_file_data.md5)
+        if fixlet_id is MISSING:
+            fixlet_id = self._get_remediation_fixlet_id(banned_file_data.md5)
 
         # if no existing fixlet found, just make a new one
         if fixlet_id is None:
-            put_result = requests.post(self._bigfix_fixlets_api_url,
-                                       auth=self._auth,
-                                       verify=self._bigfix_ssl_verify,
+            put_result = self._request('POST', 'fixlets',
+                                       self._bigfix_fixlets_api_url,
                                        data=xml_string)
+            self._raise_if_unavailable(put_result, 'fixlet POST')
 
             if put_result.status_code != 200:
                 self.logger.warning(
                     "Error in fixlet POST to Bigfix: {0},"
                     " API status code: {1}".format(
                         put_result.text, put_result.status_code))
+                return None
+            return self._created_fixlet_id(put_result.content)
 
         # otherwise, update the existing one
         else:
             url = '{0}/{1}'.format(self._bigfix_fixlet_api_url, fixlet_id)
-            put_result = requests.put(url,
-                                      auth=self._auth,
-                                      verify=self._bigfix_ssl_verify,
-                                      data=xml_string)
+            put_result = self._request('PUT', 'fixlet', url,
+                                       data=xml_string)
+            self._raise_if_unavailable(put_result, 'fixlet PUT')
             if put_result.status_code != 200:
                 self.logger.warn("Error in fixlet PUT to Bigfix: {0},"
                                  " API status code: {1}".format(
                                   put_result.text, put_result.status_code))
+                return None
+            return fixlet_id
+
+    def _created_fixlet_id(self, xml):
+        """
+        :param xml: BigFix answer to a fixlet POST
+        :return: the id of the new fixlet, or None if it isn't in there
+        """
+        try:
+            fixlet_id = Et.fromstring(xml).find('Fixlet').find('ID').text
+            return int(fixlet_id)
+        except (Et.ParseError, AttributeError, TypeError, ValueError):
+            self.logger.debug("No fixlet id in the fixlet POST answer")
+            return None
+
+    def load_fixlet_index(self):
+        """
+        Index every banned file fixlet in the custom site: one query for
+        their ids, then one GET each for their content. md5s indexed by
+        fixlet updates in the meantime are left alone.
+        :return: the number of fixlets indexed
+        """
+        query_string = \
+            '(id of it, name of it) of bes fixlets whose (name of site of' \
+            ' it = "{0}" AND name of it starts with "{1}")'.format(
+                self._bigfix_custom_site_name, BANNED_FILE_FIXLET_PREFIX)
+
+        req_result = self._request(
+            'GET', 'query', self._bigfix_query_api_url,
+            params={'relevance': query_string, 'output': 'json'},
+            headers={"Accept-Encoding": "gzip"})
+
+        loaded = 0
+        for answer in json.loads(req_result.content)["result"]:
+            fixlet_id, name = answer[0], answer[1]
+            md5 = name[len(BANNED_FILE_FIXLET_PREFIX):]
+            with self._fixlet_locks.lock(md5.lower()):
+                if self._fixlet_index.get(md5) is not None:
+                    continue
+                xml = self._get_remediation_fixlet(md5, fixlet_id)
+                if xml is None:
+                    continue
+                self._fixlet_index.put(
+                    md5, fixlet_id, self._unpack_remediation_fixlet(xml),
+                    replace=False)
+                loaded += 1
+        return loaded
+
+    def _fixlet_index_load(self):
+        """
+        NOTE: Run this in a separate thread.
+        Loads the fixlet index at startup.
+        """
+        try:
+            loaded = self.load_fixlet_index()
+            self.logger.info("Indexed {0} banned file fixlets from "
+                             "BigFix".format(loaded))
+        except Exception as e:
+            self.logger.exception(e)
 
     def _build_fixlet_commands(self, event, banned_file_data):
         # if we are updating an existing fixlet, then the functions
@@ -0,0 +1,186 @@
+"""
+Runs the Cb Response API lookups on a small, fixed pool of threads so the
+number of requests hitting the Cb server at once stays bounded no matter
+how many switchboard workers are asking. Requests beyond that wait in a
+queue, which smooths out bursts of feed/watchlist hits.
+"""
+import logging
+import time
+from threading import Thread, Event, Lock
+from Queue import Queue, Full
+
+from utils.metrics import Counter, Histogram, Gauge
+
+DEFAULT_MAX_CONCURRENT = 4
+DEFAULT_TIMEOUT = 30
+DEFAULT_QUEUE_SIZE = 1000
+
+# queued once per worker to stop the pool
+_SHUTDOWN = object()
+
+
+class CbRequestTimeout(Exception):
+    """
+    Raised when a Cb API request didn't finish within the timeout, time
+    spent waiting in the queue included.
+    """
+    pass
+
+
+class CbRequestRejected(Exception):
+    """
+    Raised when a request is submitted to an executor that has been shut
+    down, or the queue stayed full for the whole timeout.
+    """
+    pass
+
+
+class _Request(object):
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.queued_at = time.time()
+        self.done = Event()
+        self.abandoned = False
+        self.result = None
+        self.error = None
+
+
+class CbRequestExecutor(object):
+
+    def __init__(self, max_concurrent=DEFAULT_MAX_CONCURRENT,
+                 timeout=DEFAULT_TIMEOUT, queue_size=DEFAULT_QUEUE_SIZE):
+        """
+        :param max_concurrent: number of requests allowed in flight
+        :param timeout: seconds a caller waits for its result, including
+                        time spent queued. None to wait forever.
+        :param queue_size: max requests waiting for a free slot, callers
+                           block while it is full. 0 for unbounded.
+        """
+        self.logger = logging.getLogger(__name__)
+        self._timeout = timeout
+        self._queue = Queue(maxsize=queue_size)
+        self._lock = Lock()
+        self._running = True
+
+        self.queue_wait = Histogram(
+            "queue_wait", "seconds a request waited for a free slot")
+        self.request_latency = Histogram(
+            "request_latency", "seconds a Cb API request took")
+        self.timeouts = Counter(
+            "timeouts", "requests the caller gave up waiting on")
+        self.errors = Counter("errors", "requests that raised an error")
+
+        self._workers = list()
+        for i in range(max(1, max_concurrent)):
+            worker = Thread(target=self._worker_loop,
+                            name="cb-request-{0}".format(i))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def call(self, func, *args, **kwargs):
+        """
+        Run func(*args, **kwargs) on the pool and wait for its result.
+        Exceptions raised by func are raised here.
+        :raises CbRequestTimeout: no result within the timeout
+        :raises CbRequestRejected: the executor is shut down
+        """
+        if not self._running:
+            raise CbRequestRejected("Cb request executor is shut down")
+
+        request = _Request(func, args, kwargs)
+        try:
+            self._queue.put(request, timeout=self._timeout)
+        except Full:
+            self.timeouts.increment()
+            raise CbRequestRejected("Cb request queue stayed full")
+
+        remaining = None
+        if self._timeout is not None:
+            remaining = max(0, request.queued_at + self._timeout - time.time())
+
+        if not request.done.wait(remaining):
+            # the worker may still be running it, make sure it doesn't
+            # bother if it hasn't started yet
+            request.abandoned = True
+            self.timeouts.increment()
+            raise CbRequestTimeout(
+                "Cb request {0} timed out after {1}s".format(
+                    getattr(func, '__name__', func), self._timeout))
+
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _worker_loop(self):
+        while True:
+            request = self._queue.get()
+            if request is _SHUTDOWN:
+                return
+
+            started = time.time()
+            self.queue_wait.observe(started - request.queued_at)
+            if request.abandoned:
+                continue
+
+            try:
+                request.result = request.func(*request.args,
+                                              **request.kwargs)
+            except Exception as e:
+                self.errors.increment()
+                request.error = e
+            finally:
+                self.request_latency.observe(time.time() - started)
+                request.done.set()
+
+    def shutdown(self):
+        """
+        Stop accepting requests, the workers exit once the queue is drained.
+        """
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+        for _ in self._workers:
+            self._queue.put(_SHUTDOWN)
+
+    def join(self, timeout=None):
+        """
+        Wait for the workers to exit after shutdown().
+        :param timeout: seconds to wait in total, None to wait forever
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        for worker in self._workers:
+            if deadline is None:
+                worker.join()
+            else:
+                worker.join(max(0, deadline - time.time()))
+
+    def register_metrics(self, registry):
+        """
+        Expose the request counters, latencies and queue depth in a
+        MetricsRegistry.
+        """
+        registry.register("cb_api_request_latency_seconds",
+                          self.request_latency)
+        registry.register("cb_api_queue_wait_seconds", self.queue_wait)
+        registry.register("cb_api_timeouts_total", self.timeouts)
+        registry.register("cb_api_errors_total", self.errors)
+        registry.register("cb_api_queue_depth", Gauge(
+            "queue_depth", "Cb API requests waiting for a free slot",
+            self._queue.qsize))
+
+    def metrics(self):
+        """
+        :return: dict with the queue depth and the request counters and
+                 latency snapshots
+        """
+        return {
+            "queue_depth": self._queue.qsize(),
+            "timeouts": self.timeouts.value,
+            "errors": self.errors.value,
+            "queue_wait": self.queue_wait.snapshot(),
+            "request_latency": self.request_latency.snapshot(),
+        }
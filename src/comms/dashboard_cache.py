@@ -0,0 +1,244 @@
+"""
+The local cache of vulnerable and implicated applications waiting to be
+posted to the BigFix dashboard. Assets are kept indexed by besid, and
+their CVEs by CVE id, so that merging an event in is a couple of dict
+lookups no matter how many CVEs a host already has. The BigFix 'assets'
+list is only built when the cache is pulled for a post.
+"""
+from utils.striped_lock import StripedLock
+
+# rough serialized size (in bytes) of an asset and of a CVE record, not
+# counting their values: '{"fqdn": "", "besid": , "cves": []}, ' and
+# '{"id": "", "risk": , "implicated": 0}, '
+ASSET_OVERHEAD = 40
+CVE_OVERHEAD = 40
+
+
+def asset_size(asset):
+    """
+    :return: estimated size of the asset in a post, without its CVEs
+    """
+    return ASSET_OVERHEAD + len(str(asset.get('fqdn'))) + \
+        len(str(asset['besid']))
+
+
+def cve_size(cve):
+    """
+    :return: estimated size of a CVE record in a post
+    """
+    return CVE_OVERHEAD + len(str(cve['id'])) + len(str(cve.get('risk')))
+
+
+def split_assets(assets, max_cves=0, max_bytes=0):
+    """
+    Split assets into chunks that can each be posted on their own. An
+    asset with more CVEs than fit in one chunk is spread over several,
+    BigFix merges them back together.
+    :param assets: list of assets in the BigFix format
+    :param max_cves: max CVE records per chunk, 0 for no limit
+    :param max_bytes: max estimated size per chunk, 0 for no limit
+    :return: list of asset lists
+    """
+    chunks = list()
+    chunk, chunk_cves, chunk_bytes = list(), 0, 0
+
+    for asset in assets:
+        header = asset_size(asset)
+        current = None
+        for cve in asset['cves']:
+            size = cve_size(cve)
+            added = size if current is not None else size + header
+            full = chunk_cves > 0 and (
+                (max_cves and chunk_cves + 1 > max_cves) or
+                (max_bytes and chunk_bytes + added > max_bytes))
+            if full:
+                chunks.append(chunk)
+                chunk, chunk_cves, chunk_bytes = list(), 0, 0
+                current = None
+                added = size + header
+
+            if current is None:
+                current = dict(asset)
+                current['cves'] = list()
+                chunk.append(current)
+            current['cves'].append(cve)
+            chunk_cves += 1
+            chunk_bytes += added
+
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def merge_asset(queued, asset):
+    """
+    Merge two versions of the same asset, the way the cache would.
+    :return: the merged asset, in the BigFix format
+    """
+    cache = DashboardCache()
+    cache.merge([queued, asset])
+    return cache.to_json()[asset['besid']]
+
+
+class _CachedAsset(object):
+    """
+    One asset in the cache, its CVE records indexed by CVE id.
+    """
+    __slots__ = ('fields', 'cves')
+
+    def __init__(self, asset):
+        # everything but the cves (fqdn, besid, ...) is kept as is
+        self.fields = dict((key, value) for key, value in asset.items()
+                           if key != 'cves')
+        self.cves = dict()
+
+    def to_json(self):
+        asset = dict(self.fields)
+        asset['cves'] = list(self.cves.values())
+        return asset
+
+
+class DashboardCache(object):
+    """
+    besid -> asset, CVE id -> CVE record. Not thread safe, the caller
+    holds the lock while merging. To post the cache, swap in a new one and
+    flatten the old one with to_json outside of the lock.
+    """
+
+    def __init__(self):
+        self._assets = dict()
+        self._cve_count = 0
+        self._approx_bytes = 0
+
+        # traces (utils.tracing) of the events merged in, if traced
+        self.traces = list()
+
+    def __len__(self):
+        return len(self._assets)
+
+    @property
+    def cve_count(self):
+        """
+        :return: number of (asset, CVE) records held
+        """
+        return self._cve_count
+
+    @property
+    def approx_bytes(self):
+        """
+        :return: estimated size of the cache once serialized for a post
+        """
+        return self._approx_bytes
+
+    def merge(self, assets):
+        """
+        Merge assets, in the format of the BigFix 'assets' list, into the
+        cache. New CVEs are added to the asset, a CVE we already have is
+        only ever upgraded to implicated, never back.
+        :param assets: list of asset dicts with fqdn, besid and cves
+        :return: list of assets with just the CVEs that changed the cache
+        """
+        changed = list()
+        for asset in assets:
+            cached_asset = self._assets.get(asset['besid'])
+            if cached_asset is None:
+                cached_asset = self._assets[asset['besid']] = \
+                    _CachedAsset(asset)
+                self._approx_bytes += asset_size(asset)
+
+            cves = cached_asset.cves
+            changed_cves = list()
+            for cve in asset['cves']:
+                cached_cve = cves.get(cve['id'])
+                if cached_cve is None:
+                    cves[cve['id']] = dict(cve)
+                    self._cve_count += 1
+                    self._approx_bytes += cve_size(cve)
+                    changed_cves.append(cve)
+                elif cve['implicated'] == 1 and cached_cve['implicated'] != 1:
+                    cached_cve['implicated'] = 1
+                    changed_cves.append(cve)
+
+            if changed_cves:
+                changed_asset = dict(cached_asset.fields)
+                changed_asset['cves'] = changed_cves
+                changed.append(changed_asset)
+        return changed
+
+    def to_json(self):
+        """
+        :return: dict of besid -> asset, each asset in the format of the
+                 BigFix 'assets' list
+        """
+        return dict((besid, cached_asset.to_json())
+                    for besid, cached_asset in self._assets.items())
+
+
+class ShardedDashboardCache(object):
+    """
+    Thread safe dashboard cache, split into shards by besid each with its
+    own lock, so events for different hosts don't wait on each other.
+    """
+
+    def __init__(self, shards):
+        """
+        :param shards: number of shards (and locks) to split the cache into
+        """
+        self._locks = StripedLock(shards)
+        self._shards = [DashboardCache() for _ in range(len(self._locks))]
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards)
+
+    @property
+    def cve_count(self):
+        return sum(shard.cve_count for shard in self._shards)
+
+    @property
+    def approx_bytes(self):
+        return sum(shard.approx_bytes for shard in self._shards)
+
+    def merge(self, assets, trace=None):
+        """
+        Merge assets, in the format of the BigFix 'assets' list, into the
+        shard each of them belongs to.
+        :param trace: trace of the event the assets came from, kept with
+                      the last asset (under the same lock) so it is pulled
+                      along with the event's data
+        :return: list of assets with just the CVEs that changed the cache
+        """
+        changed = list()
+        for position, asset in enumerate(assets):
+            index = self._locks.index(asset['besid'])
+            with self._locks.lock_at(index):
+                changed.extend(self._shards[index].merge([asset]))
+                if trace is not None and position == len(assets) - 1:
+                    self._shards[index].traces.append(trace)
+        return changed
+
+    def pull(self):
+        """
+        Empty the cache. Each shard is swapped for an empty one under its
+        lock, the old shards are flattened once all the locks are released.
+        :return: dict of besid -> asset, each asset in the BigFix format
+        """
+        return self.pull_with_traces()[0]
+
+    def pull_with_traces(self):
+        """
+        Empty the cache, like pull().
+        :return: tuple of the dict of besid -> asset, and the list of the
+                 traces of the events whose data was pulled
+        """
+        pulled = list()
+        for index in range(len(self._shards)):
+            with self._locks.lock_at(index):
+                pulled.append(self._shards[index])
+                self._shards[index] = DashboardCache()
+
+        assets = dict()
+        traces = list()
+        for shard in pulled:
+            assets.update(shard.to_json())
+            traces.extend(shard.traces)
+        return assets, traces
@@ -0,0 +1,177 @@
+"""
+Write-ahead spool for the BigFix dashboard cache, so that the hits
+collected between two posts survive a crash or restart.
+
+Every asset merged into the cache is appended as a JSON line to the
+current segment file in the spool directory. Each append is handed to
+the OS straight away (so it survives the connector dying), but only
+fsync'd once every fsync_interval seconds (so it survives the host
+dying, minus at most that much). Appends that come in between are
+fsync'd by the next append after the interval, or by whoever owns the
+spool calling sync() once sync_due_in() says so.
+
+When the cache is pulled for a post the spool is rotated to a new
+segment, and once BigFix accepted the post the older segments are
+deleted. On startup whatever segments are left are replayed into the
+cache.
+"""
+import json
+import logging
+import os
+import time
+from threading import Lock
+
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".jsonl"
+
+
+class DashboardSpool(object):
+
+    def __init__(self, spool_dir, fsync_interval=1.0):
+        """
+        :param spool_dir: directory for the segment files, created if
+                          missing
+        :param fsync_interval: max seconds between fsyncs, 0 to fsync
+                               every append
+        """
+        self.logger = logging.getLogger(__name__)
+        self._dir = spool_dir
+        self._fsync_interval = fsync_interval
+        self._lock = Lock()
+
+        if not os.path.isdir(self._dir):
+            os.makedirs(self._dir)
+
+        existing = self._segments()
+        self._segment = existing[-1] + 1 if existing else 0
+        self._file = None
+        self._dirty = False
+        self._last_fsync = 0
+
+    def _path(self, segment):
+        return os.path.join(self._dir, "{0}{1:010d}{2}".format(
+            SEGMENT_PREFIX, segment, SEGMENT_SUFFIX))
+
+    def _segments(self):
+        """
+        :return: sorted numbers of the segment files in the spool
+        """
+        segments = list()
+        for name in os.listdir(self._dir):
+            if name.startswith(SEGMENT_PREFIX) and \
+                    name.endswith(SEGMENT_SUFFIX):
+                try:
+                    segments.append(int(
+                        name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+                except ValueError:
+                    continue
+        return sorted(segments)
+
+    def replay(self):
+        """
+        Read back the segments left over from before this start.
+        A line cut short by a crash is skipped.
+        :return: list of the spooled assets, oldest first
+        """
+        assets = list()
+        for segment in self._segments():
+            if segment >= self._segment:
+                continue
+            with open(self._path(segment), "r") as segment_file:
+                for line in segment_file:
+                    try:
+                        assets.append(json.loads(line))
+                    except ValueError:
+                        self.logger.warning(
+                            "Skipping damaged line in dashboard spool "
+                            "segment {0}".format(segment))
+        return assets
+
+    def append(self, assets):
+        """
+        Spool assets that were just merged into the cache.
+        :param assets: list of assets in the BigFix format
+        :return: True if this append left the spool waiting for an fsync,
+                 when it wasn't before. The owner then has to call sync()
+                 in sync_due_in() seconds.
+        """
+        data = "".join(json.dumps(asset) + "\n" for asset in assets)
+        with self._lock:
+            if self._file is None:
+                self._file = open(self._path(self._segment), "a")
+            self._file.write(data)
+            self._file.flush()
+            was_dirty = self._dirty
+            self._dirty = True
+
+            if time.time() - self._last_fsync >= self._fsync_interval:
+                self._fsync()
+            return self._dirty and not was_dirty
+
+    def _fsync(self):
+        """
+        Called with the lock held.
+        """
+        if self._file is not None and self._dirty:
+            os.fsync(self._file.fileno())
+            self._dirty = False
+        self._last_fsync = time.time()
+
+    def sync_due_in(self):
+        """
+        :return: seconds until the appends waiting for an fsync are due
+                 one (0 if they are), None if nothing is waiting
+        """
+        with self._lock:
+            if not self._dirty:
+                return None
+            return max(0, self._last_fsync + self._fsync_interval -
+                       time.time())
+
+    def sync(self):
+        """
+        fsync whatever was appended since the last one.
+        """
+        with self._lock:
+            self._fsync()
+
+    def rotate(self):
+        """
+        Start a new segment, to be called right before the cache is pulled.
+        :return: the number of the last segment holding pulled data, to
+                 hand to compact once the post went through
+        """
+        with self._lock:
+            self._fsync()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            segment = self._segment
+            self._segment += 1
+            return segment
+
+    def compact(self, upto):
+        """
+        Delete the segments up to and including upto, their data has been
+        posted to BigFix.
+        """
+        removed = 0
+        for segment in self._segments():
+            if segment > upto:
+                break
+            try:
+                os.remove(self._path(segment))
+                removed += 1
+            except OSError as e:
+                self.logger.error("Unable to remove dashboard spool segment "
+                                  "{0}: {1}".format(segment, e))
+        if removed:
+            self.logger.debug("Removed {0} posted dashboard spool "
+                              "segments".format(removed))
+
+    def close(self):
+        with self._lock:
+            self._fsync()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
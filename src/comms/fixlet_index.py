@@ -0,0 +1,72 @@
+"""
+Local index of the banned file fixlets in the BigFix custom site, by md5.
+Holds the fixlet id, the paths the fixlet already deletes and the fixlet
+content, so a banned file event for a known path needs no call to BigFix
+at all and a new path only needs the PUT.
+"""
+import re
+from threading import Lock
+
+# the paths a banned file fixlet deletes, see
+# BigFixApi._build_fixlet_commands for the actionscript we generate
+_DELETE_PATH = re.compile(r'^\s*delete "(.*)"\s*$', re.MULTILINE)
+
+
+def fixlet_paths(actionscript):
+    """
+    :param actionscript: actionscript of a banned file fixlet
+    :return: set of the file paths it deletes
+    """
+    return set(_DELETE_PATH.findall(actionscript or ""))
+
+
+class IndexedFixlet(object):
+    __slots__ = ('fixlet_id', 'paths', 'data')
+
+    def __init__(self, fixlet_id, data):
+        """
+        :param fixlet_id: id of the fixlet in the custom site
+        :param data: BannedFileFixletData of the fixlet as last sent
+        """
+        self.fixlet_id = fixlet_id
+        self.data = data
+        self.paths = fixlet_paths(data.actionscript)
+
+
+class FixletIndex(object):
+
+    def __init__(self):
+        self._lock = Lock()
+        self._fixlets = dict()
+
+    def __len__(self):
+        return len(self._fixlets)
+
+    def get(self, md5):
+        """
+        :return: the IndexedFixlet of the md5, or None if not indexed
+        """
+        return self._fixlets.get(md5.lower())
+
+    def put(self, md5, fixlet_id, data, replace=True):
+        """
+        Index the content of a fixlet, as fetched or after a successful
+        PUT/POST.
+        :param replace: False to leave an existing entry alone, for
+                        loading the index while updates are going on
+        :return: the IndexedFixlet now in the index
+        """
+        entry = IndexedFixlet(fixlet_id, data)
+        with self._lock:
+            if replace:
+                self._fixlets[md5.lower()] = entry
+                return entry
+            return self._fixlets.setdefault(md5.lower(), entry)
+
+    def discard(self, md5):
+        """
+        Forget an md5, e.g. after a failed update left the fixlet on the
+        server in an unknown state.
+        """
+        with self._lock:
+            self._fixlets.pop(md5.lower(), None)
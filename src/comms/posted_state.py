@@ -0,0 +1,269 @@
+"""
+What the BigFix dashboard already has from us: for every asset, the CVEs
+posted and whether each was posted as implicated. Incoming hits are
+checked against it so that only new CVEs and upgrades to implicated are
+posted, instead of the same hits every interval for as long as the
+vulnerable process keeps launching.
+
+The state carries over restarts in two files: a JSON snapshot, and next
+to it a journal the changes recorded since are appended to, one asset per
+line. Recording a post only costs an append of what changed. Once the
+journal has grown about as big as the state itself, compact() rewrites
+the snapshot atomically and empties the journal. The journal isn't
+fsync'd, if the host dies before a compaction the last changes are just
+posted again.
+
+Assets no hits came in for within max_age are dropped at compaction, so
+decommissioned computers don't stay in the full reconcile posts forever.
+"""
+import json
+import logging
+import time
+from threading import Lock
+
+from utils.atomic_file import atomic_write
+
+# suffix of the journal file, next to the snapshot
+JOURNAL_SUFFIX = ".journal"
+
+# the journal is compacted once it has this many lines, or as many lines
+# as there are assets in the state if that is more
+COMPACT_MIN_RECORDS = 1000
+
+
+class DashboardPostedState(object):
+
+    def __init__(self, path, max_age=0):
+        """
+        :param path: file the state is saved to, None to keep it in memory
+        :param max_age: seconds an asset is kept after the last hit for
+                        it, 0 to keep every asset forever
+        """
+        self.logger = logging.getLogger(__name__)
+        self._path = path
+        self._journal_path = None if path is None else path + JOURNAL_SUFFIX
+        self._max_age = max_age
+        self._lock = Lock()
+
+        # besid -> {cve id -> implicated}
+        self._assets = dict()
+
+        # besid -> fqdn, needed to post the full state again
+        self._fqdns = dict()
+
+        # cve id -> risk, same
+        self._risks = dict()
+
+        # besid -> time of the last hit for the asset
+        self._seen = dict()
+
+        # the journal file and how many lines it has, only touched with
+        # the file lock held. Taken before the state lock, never after.
+        self._file_lock = Lock()
+        self._journal = None
+        self._journal_records = 0
+
+    def __len__(self):
+        return len(self._assets)
+
+    def load(self):
+        """
+        Read back the saved state, the snapshot and then the journal.
+        Missing files mean nothing was posted.
+        :return: True if a saved state was found
+        """
+        if self._path is None:
+            return False
+
+        found = False
+        try:
+            with open(self._path, "r") as state_file:
+                state = json.load(state_file)
+        except IOError:
+            state = None
+        except ValueError as e:
+            self.logger.error("Ignoring unreadable dashboard state {0}: "
+                              "{1}".format(self._path, e))
+            state = None
+
+        now = time.time()
+        with self._lock:
+            if state is not None:
+                found = True
+                for asset in state["assets"]:
+                    self._merge(asset, asset.get("seen", now))
+
+            try:
+                with open(self._journal_path, "r") as journal_file:
+                    for line in journal_file:
+                        self._journal_records += 1
+                        try:
+                            asset = json.loads(line)
+                        except ValueError:
+                            self.logger.warning(
+                                "Skipping damaged line in dashboard state "
+                                "journal {0}".format(self._journal_path))
+                            continue
+                        self._merge(asset, asset.get("seen", now))
+                        found = True
+            except IOError:
+                pass
+        return found
+
+    def delta(self, assets):
+        """
+        Strip everything the dashboard already has out of the assets.
+        :param assets: list of assets in the BigFix format
+        :return: list of the assets with only their new CVEs and CVEs now
+                 implicated that were posted as not. Assets left without
+                 CVEs are dropped.
+        """
+        delta = list()
+        now = time.time()
+        with self._lock:
+            for asset in assets:
+                posted = self._assets.get(asset["besid"])
+                if posted is None:
+                    delta.append(asset)
+                    continue
+
+                # the asset is still around, keep it
+                self._seen[asset["besid"]] = now
+                cves = [cve for cve in asset["cves"]
+                        if cve["implicated"] > posted.get(cve["id"], -1)]
+                if len(cves) == len(asset["cves"]):
+                    delta.append(asset)
+                elif cves:
+                    changed = dict(asset)
+                    changed["cves"] = cves
+                    delta.append(changed)
+        return delta
+
+    def record(self, assets):
+        """
+        Remember that the assets were posted, and journal what changed.
+        :param assets: list of assets in the BigFix format
+        """
+        now = time.time()
+        changes = list()
+        with self._lock:
+            for asset in assets:
+                cves = self._merge(asset, now)
+                if cves:
+                    changes.append({"fqdn": asset["fqdn"],
+                                    "besid": asset["besid"],
+                                    "seen": now, "cves": cves})
+        if changes:
+            self._append_journal(changes)
+
+    def _merge(self, asset, seen):
+        """
+        Called with the lock held.
+        :return: list of the CVEs of the asset that changed the state
+        """
+        besid = asset["besid"]
+        self._fqdns[besid] = asset["fqdn"]
+        self._seen[besid] = max(seen, self._seen.get(besid, seen))
+        posted = self._assets.setdefault(besid, dict())
+        changed = list()
+        for cve in asset["cves"]:
+            if cve["implicated"] > posted.get(cve["id"], -1) or \
+                    self._risks.get(cve["id"]) != cve["risk"]:
+                changed.append(cve)
+            if cve["implicated"] > posted.get(cve["id"], -1):
+                posted[cve["id"]] = cve["implicated"]
+            self._risks[cve["id"]] = cve["risk"]
+        return changed
+
+    def _append_journal(self, changes):
+        if self._journal_path is None:
+            return
+        data = "".join(json.dumps(change) + "\n" for change in changes)
+        with self._file_lock:
+            try:
+                if self._journal is None:
+                    self._journal = open(self._journal_path, "a")
+                self._journal.write(data)
+                self._journal.flush()
+                self._journal_records += len(changes)
+            except (IOError, OSError) as e:
+                self.logger.error("Unable to journal the dashboard state to "
+                                  "{0}: {1}".format(self._journal_path, e))
+
+    def to_json(self):
+        """
+        :return: list of every asset posted so far, in the BigFix format,
+                 for a full reconcile of the dashboard
+        """
+        with self._lock:
+            return self._to_json()
+
+    def _to_json(self, with_seen=False):
+        assets = list()
+        for besid, cves in self._assets.items():
+            asset = {"fqdn": self._fqdns[besid], "besid": besid,
+                     "cves": [{"id": cve_id, "risk": self._risks[cve_id],
+                               "implicated": implicated}
+                              for cve_id, implicated in cves.items()]}
+            if with_seen:
+                asset["seen"] = self._seen[besid]
+            assets.append(asset)
+        return assets
+
+    def compact(self, force=False):
+        """
+        Drop the assets older than max_age, and once the journal has grown
+        big enough fold it into a new snapshot. Meant to be called now and
+        then, e.g. once per packaging interval.
+        :param force: fold in the journal if it has anything at all
+        """
+        with self._file_lock:
+            with self._lock:
+                pruned = self._prune()
+                due = pruned or self._journal_records >= \
+                    max(COMPACT_MIN_RECORDS, len(self._assets)) or \
+                    (force and self._journal_records)
+                if self._path is None or not due:
+                    return
+                snapshot = self._to_json(with_seen=True)
+
+            try:
+                atomic_write(self._path, json.dumps({"assets": snapshot}))
+                if self._journal is not None:
+                    self._journal.close()
+                    self._journal = None
+                open(self._journal_path, "w").close()
+                self._journal_records = 0
+            except (IOError, OSError) as e:
+                self.logger.error("Unable to save the dashboard state to "
+                                  "{0}: {1}".format(self._path, e))
+
+    def _prune(self):
+        """
+        Called with the lock held.
+        :return: number of assets dropped for being older than max_age
+        """
+        if self._max_age <= 0:
+            return 0
+        oldest = time.time() - self._max_age
+        expired = [besid for besid, seen in self._seen.items()
+                   if seen < oldest]
+        for besid in expired:
+            del self._assets[besid]
+            del self._fqdns[besid]
+            del self._seen[besid]
+        if expired:
+            self.logger.info("Dropped {0} computers without hits for {1:g} "
+                             "days from the dashboard state".format(
+                                 len(expired), self._max_age / 86400.0))
+        return len(expired)
+
+    def close(self):
+        """
+        Compact whatever was journaled, and close the journal.
+        """
+        self.compact(force=True)
+        with self._file_lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
@@ -64,6 +64,10 @@ class Event(object):
     def __init__(self):
         self.host = Host()
 
+        # utils.tracing.Trace of the forwarder event this came from, if it
+        # was sampled for tracing
+        self.trace = None
+
 
 class VulnerableAppEvent(Event):
     """
@@ -1,6 +1,28 @@
-from threading import Thread, RLock
-from Queue import Queue, Empty as QEmpty
+from threading import Thread, RLock, Condition
+from Queue import Queue
+from collections import deque
 import logging
+import time
+
+from utils.metrics import Counter, Histogram, Gauge
+from utils.shutdown_signal import ShutdownSignal
+
+# What to do when a subscriber's queue is full and a new message arrives
+BACKPRESSURE_BLOCK = "block"               # sender waits for room
+BACKPRESSURE_DROP_OLDEST = "drop_oldest"   # discard the oldest queued message
+BACKPRESSURE_DROP_NEWEST = "drop_newest"   # discard the incoming message
+BACKPRESSURE_POLICIES = (BACKPRESSURE_BLOCK,
+                         BACKPRESSURE_DROP_OLDEST,
+                         BACKPRESSURE_DROP_NEWEST)
+
+# channel defaults, can be overridden through the Switchboard
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_QUEUE_DEPTH = 10000   # per subscriber, 0 means unbounded
+DEFAULT_BACKPRESSURE = BACKPRESSURE_BLOCK
+
+
+# queued once per worker to tell it to exit
+_SHUTDOWN = object()
 
 
 class CallBackData(object):
@@ -11,36 +33,99 @@ class CallBackData(object):
     def __init__(self, args, kwargs):
         self.args = args
         self.kwargs = kwargs
+        self.enqueued_at = time.time()
+
+
+class Subscription(object):
+    """
+    A registered callback along with the messages waiting to be
+    delivered to it.
+    """
+    def __init__(self, target_id, callback, max_queue_depth, backpressure):
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(
+                "Unknown backpressure policy {0}".format(backpressure))
+
+        self.target_id = target_id
+        self.callback = callback
+        self.max_queue_depth = max_queue_depth
+        self.backpressure = backpressure
+        self.pending = deque()
+        self.active = True
+
+    def is_full(self):
+        return 0 < self.max_queue_depth <= len(self.pending)
 
 
 class Channel(object):
     """
     A message channel. Supports receiving messages and sending to
     registered listeners.
+
+    Every subscriber gets its own bounded queue of messages. A fixed pool
+    of worker threads per channel delivers the queued messages to the
+    subscribers' callbacks.
     """
 
-    def __init__(self, name):
+    def __init__(self, name, workers=DEFAULT_WORKERS,
+                 max_queue_depth=DEFAULT_MAX_QUEUE_DEPTH,
+                 backpressure=DEFAULT_BACKPRESSURE):
+        """
+        :param name: name of the channel
+        :param workers: number of threads delivering messages
+        :param max_queue_depth: default limit of queued messages for each
+                                subscriber, 0 for no limit
+        :param backpressure: default policy for full subscriber queues
+        """
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(
+                "Unknown backpressure policy {0}".format(backpressure))
 
         # manager-style locking, only for non-async vars
         self._lock = RLock()
+        self._space_available = Condition(self._lock)
         self._callbacks = dict()
         self._callback_subscribe_id_counter = 1000
         self._shutdown_flag = False   # used to shutdown daemon threads
+        self._shutdown_signal = ShutdownSignal()
         self._name = name
-
-        # no manager lock required
-        self._queue = Queue()
+        self._max_queue_depth = max_queue_depth
+        self._backpressure = backpressure
+        self._in_flight = 0
+
+        # no manager lock required.
+        # holds one entry per queued message, naming the subscription the
+        # message is waiting in. Workers pull from here.
+        self._ready = Queue()
         self.logger = logging.getLogger(__name__)
 
-        # kick out our transmit_message thread.
-        Thread(target=self._transmit_message,
-               name="Chan-{0}-Transmit".format(self._name)).start()
+        # metrics
+        self.messages_dispatched = Counter(
+            "messages_dispatched", "messages delivered to a callback")
+        self.messages_dropped = Counter(
+            "messages_dropped", "messages dropped due to full queues")
+        self.dispatch_latency = Histogram(
+            "dispatch_latency", "seconds between send and callback start")
+
+        # kick out our worker pool
+        self._workers = list()
+        for worker_number in range(workers):
+            worker = Thread(
+                target=self._transmit_message,
+                name="Chan-{0}-TX-{1}".format(self._name, worker_number))
+            worker.start()
+            self._workers.append(worker)
 
     def _transmit_message(self):
         """
         Responsible for calling out to recipients with the data
-        required. NOTE that we create a new thread here to perform
-        the callback with.
+        required. Each call pulls a single queued message and runs the
+        subscriber's callback with it in this thread.
+
+        Workers sleep on the ready queue until there is something to do.
+        On shutdown, one _SHUTDOWN marker per worker is queued behind the
+        messages already waiting, so everything queued gets delivered
+        before the workers exit.
 
         IMPORTANT: this function infinitely loops. Call it as the
         target of a thread.
@@ -49,34 +134,33 @@ class Channel(object):
         prevent the message transmissions from dying.
         """
         while True:
+            subscription = self._ready.get()
+            if subscription is _SHUTDOWN:
+                break
+
+            self._lock.acquire()
             try:
-                callback_data = self._queue.get(timeout=1)
+                # the message may have been dropped or unsubscribed
+                if not subscription.pending:
+                    continue
+                callback_data = subscription.pending.popleft()
+                self._in_flight += 1
+                self._space_available.notify_all()
+            finally:
+                self._lock.release()
 
-                # since we have real data (Empty would have been
-                # raised otherwise), process it.
+            self.dispatch_latency.observe(
+                time.time() - callback_data.enqueued_at)
+            try:
+                subscription.callback(*callback_data.args,
+                                      **callback_data.kwargs)
+            except Exception as e:
+                self.logger.exception(e)
+            finally:
                 self._lock.acquire()
-                try:
-                    for target_id in self._callbacks:
-                        target = self._callbacks[target_id]
-                        thread_name = "Chan-{0}-TX-{1}".format(self._name,
-                                                               target_id)
-                        Thread(target=target,
-                               name=thread_name,
-                               args=callback_data.args,
-                               kwargs=callback_data.kwargs,
-                               ).start()
-                except Exception as e:
-                    self.logger.exception(e)
+                self._in_flight -= 1
                 self._lock.release()
-                self._queue.task_done()
-
-            except QEmpty as e:
-                pass
-
-            # check to see if we should shutdown
-            # also check if we timed out or have real data
-            if self._shutdown_flag is True:
-                break
+                self.messages_dispatched.increment()
 
     def _get_unique_subscription_id(self):
         """
@@ -92,10 +176,54 @@ class Channel(object):
     def shutdown(self):
         """
         Shutdown the channel, clean up whatever is running.
+        Messages already queued are still delivered, use join() to wait
+        for that to finish. Does not block.
         """
         self._lock.acquire()
-        self._shutdown_flag = True
-        self._lock.release()
+        try:
+            if self._shutdown_flag:
+                return
+            self._shutdown_flag = True
+            self._space_available.notify_all()
+            for _ in self._workers:
+                self._ready.put(_SHUTDOWN)
+        finally:
+            self._lock.release()
+        self._shutdown_signal.set()
+
+    def join(self, timeout=None):
+        """
+        Wait for the worker threads to drain the queue and exit after a
+        shutdown. Once they have, the shutdown signal is closed.
+        :param timeout: max seconds to wait in total, None waits forever
+        :return: True if all workers have exited
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        for worker in self._workers:
+            if deadline is None:
+                worker.join()
+            else:
+                worker.join(max(0, deadline - time.time()))
+        if any(worker.is_alive() for worker in self._workers):
+            return False
+        self._shutdown_signal.close()
+        return True
+
+    def wait_for_shutdown(self, timeout=None):
+        """
+        Sleep until the channel is shutdown, or the timeout passes.
+        Lets other services tie their own loops to the channel's life.
+        :param timeout: in seconds, None to wait forever
+        :return: True if the channel has been shutdown
+        """
+        return self._shutdown_signal.wait(timeout)
+
+    def shutdown_fileno(self):
+        """
+        :return: a file descriptor that becomes readable once the channel
+                 is shutdown, to wait on it along with other things
+        """
+        return self._shutdown_signal.fileno()
 
     def is_running(self):
         """
@@ -110,33 +238,154 @@ class Channel(object):
         Add message to the queue. Accepts any
         arguments that the sender wishes. This will be passed along
         as arguments to the callback function.
+
+        If a subscriber's queue is full, its backpressure policy decides
+        whether this call blocks or a message is dropped.
+        WARNING: do not send to a channel from one of its own callbacks when
+        using the blocking policy, it can deadlock once the queue is full.
         """
         self.logger.debug("Channel {0} received message {1}".format(
             self._name, (args, kwargs)))
-        self._queue.put(CallBackData(args, kwargs))
+        callback_data = CallBackData(args, kwargs)
 
-    def register_callback(self, callback):
+        self._lock.acquire()
+        try:
+            if self._shutdown_flag:
+                self.logger.debug("Channel {0} is shutdown, dropping "
+                                  "message".format(self._name))
+                return
+            for subscription in list(self._callbacks.values()):
+                self._enqueue(subscription, callback_data)
+        finally:
+            self._lock.release()
+
+    def _enqueue(self, subscription, callback_data):
+        """
+        Place a message in a subscriber's queue, applying its backpressure
+        policy. Must be called with the channel lock held.
+        """
+        if subscription.is_full():
+            if subscription.backpressure == BACKPRESSURE_DROP_NEWEST:
+                self.messages_dropped.increment()
+                return
+
+            elif subscription.backpressure == BACKPRESSURE_DROP_OLDEST:
+                # swap the message out, the number of queued
+                # messages (and ready entries) stays the same.
+                subscription.pending.popleft()
+                subscription.pending.append(callback_data)
+                self.messages_dropped.increment()
+                return
+
+            else:
+                while subscription.is_full() and subscription.active \
+                        and not self._shutdown_flag:
+                    self._space_available.wait()
+                if not subscription.active or self._shutdown_flag:
+                    return
+
+        subscription.pending.append(callback_data)
+        self._ready.put(subscription)
+
+    def register_callback(self, callback, max_queue_depth=None,
+                          backpressure=None):
         """
         Adds a function pointer for callbacks
         :param callback: the function
+        :param max_queue_depth: limit of messages queued for this callback,
+                                defaults to the channel setting
+        :param backpressure: policy for when the queue is full, defaults to
+                             the channel setting
         :return: the numeric id needed for un-subscription
         """
+        if max_queue_depth is None:
+            max_queue_depth = self._max_queue_depth
+        if backpressure is None:
+            backpressure = self._backpressure
+
         self._lock.acquire()
-        target_id = self._get_unique_subscription_id()
-        self._callbacks[target_id] = callback
-        self.logger.debug("Registered function {0} for callback on"
-                           "channel {1}".format(callback, self._name))
-        self._lock.release()
+        try:
+            target_id = self._get_unique_subscription_id()
+            self._callbacks[target_id] = Subscription(
+                target_id, callback, max_queue_depth, backpressure)
+            self.logger.debug("Registered function {0} for callback on"
+                              "channel {1}".format(callback, self._name))
+        finally:
+            self._lock.release()
         return target_id
 
     def remove_callback(self, target_id):
         """
-        Removes a specified callback from the listener list
+        Removes a specified callback from the listener list.
+        Messages still queued for it are discarded.
         :param target_id: the callback's unique target id
         """
         self._lock.acquire()
-        del self._callbacks[target_id]
-        self._lock.release()
+        try:
+            subscription = self._callbacks.pop(target_id)
+            subscription.active = False
+            subscription.pending.clear()
+            self._space_available.notify_all()
+        finally:
+            self._lock.release()
+
+    def queue_depth(self):
+        """
+        :return: number of messages waiting to be delivered, summed over
+                 all subscribers
+        """
+        self._lock.acquire()
+        try:
+            return sum(len(subscription.pending)
+                       for subscription in self._callbacks.values())
+        finally:
+            self._lock.release()
+
+    def in_flight(self):
+        """
+        :return: number of callbacks running right now
+        """
+        return self._in_flight
+
+    def register_metrics(self, registry):
+        """
+        Expose the channel's counters and queue depth in a MetricsRegistry,
+        labelled with the channel name.
+        """
+        registry.register("switchboard_messages_dispatched_total",
+                          self.messages_dispatched, channel=self._name)
+        registry.register("switchboard_messages_dropped_total",
+                          self.messages_dropped, channel=self._name)
+        registry.register("switchboard_dispatch_latency_seconds",
+                          self.dispatch_latency, channel=self._name)
+        registry.register("switchboard_queue_depth", Gauge(
+            "queue_depth", "messages waiting to be delivered",
+            self.queue_depth), channel=self._name)
+        registry.register("switchboard_in_flight", Gauge(
+            "in_flight", "callbacks running", self.in_flight),
+            channel=self._name)
+
+    def metrics(self):
+        """
+        :return: dict with the current queue depth (all subscribers),
+                 number of callbacks running, message counts and the
+                 dispatch latency histogram snapshot.
+        """
+        self._lock.acquire()
+        try:
+            queue_depth = sum(len(subscription.pending)
+                              for subscription in self._callbacks.values())
+            in_flight = self._in_flight
+        finally:
+            self._lock.release()
+
+        return {
+            "queue_depth": queue_depth,
+            "in_flight": in_flight,
+            "dispatched": self.messages_dispatched.value,
+            "dropped": self.messages_dropped.value,
+            "dispatch_latency": self.dispatch_latency.snapshot(),
+        }
 
 
 class Switchboard(object):
@@ -148,33 +397,92 @@ class Switchboard(object):
     Specification of the function calls are the responsibility of the
     """
 
-    def __init__(self):
+    def __init__(self, workers=DEFAULT_WORKERS,
+                 max_queue_depth=DEFAULT_MAX_QUEUE_DEPTH,
+                 backpressure=DEFAULT_BACKPRESSURE):
+        """
+        :param workers: default worker threads for each channel
+        :param max_queue_depth: default subscriber queue limit
+        :param backpressure: default policy for full subscriber queues
+        """
         self._channels = {}
-
-    def channel(self, name):
+        self._registry = None
+        self._channel_defaults = {
+            'workers': workers,
+            'max_queue_depth': max_queue_depth,
+            'backpressure': backpressure,
+        }
+
+    def channel(self, name, **channel_options):
         """
         Create a new message channel to send messages to. If it already
         exists, it will simply return the one that is already made.
         This will not add any listeners! You must do that separately.
         :param name: Name for the channel
+        :param channel_options: overrides for workers, max_queue_depth and
+                                backpressure. Only used on creation.
         """
         if name not in self._channels:
-            self._channels[name] = Channel(name)
+            options = dict(self._channel_defaults)
+            options.update(channel_options)
+            self._channels[name] = Channel(name, **options)
+            if self._registry is not None:
+                self._channels[name].register_metrics(self._registry)
         return self._channels[name]
 
-    def shutdown(self):
+    def register_metrics(self, registry):
         """
-        Performs a shutdown. Tells each channel to clean up and go away
+        Expose the metrics of every channel in a MetricsRegistry, including
+        the channels created from now on.
         """
-        for chan_id in self._channels:
-            chan = self._channels[chan_id]
-            chan.shutdown()
-
-
-
-
-
+        self._registry = registry
+        for chan in self._channels.values():
+            chan.register_metrics(registry)
 
+    def metrics(self):
+        """
+        :return: dict of channel name to the channel's metrics
+        """
+        return dict((name, chan.metrics())
+                    for name, chan in self._channels.items())
 
+    def shutdown(self, order=(), timeout=None):
+        """
+        Performs a shutdown. Tells each channel to clean up and go away.
+
+        A shutdown channel drops what is sent to it, so the channels named
+        in order are shut down one at a time, each only once the ones
+        before it have delivered their queued messages. What those pass
+        on downstream still gets delivered. The other channels are shut
+        down after them. Only blocks when order is given.
+        :param order: channel names in pipeline order, upstream first
+        :param timeout: max seconds to wait for those channels to drain in
+                        total, None waits forever
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        for name in order:
+            chan = self._channels.get(name)
+            if chan is None:
+                continue
+            chan.shutdown()
+            chan.join(None if deadline is None
+                      else max(0, deadline - time.time()))
 
+        for chan_id in self._channels:
+            chan = self._channels[chan_id]
+            chan.shutdown()
 
+    def join(self, timeout=None):
+        """
+        Wait for every channel to finish delivering its queued messages
+        after a shutdown.
+        :param timeout: max seconds to wait in total, None waits forever
+        :return: True if all channels have finished
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        finished = True
+        for chan in list(self._channels.values()):
+            remaining = None if deadline is None \
+                else max(0, deadline - time.time())
+            finished = chan.join(remaining) and finished
+        return finished
@@ -1,5 +1,6 @@
 import logging
 from comms.bigfix_api import BigFixApi
+from utils.tracing import mark
 
 
 class EgressBigFix(object):
@@ -23,9 +24,11 @@ class EgressBigFix(object):
     def _handle_message(self, event):
         # print("Handling Egress through BigFix")
         self.logger.debug("Dispatching Dashboard Update")
+        mark(event.trace, "egress_queue")
         self._api.update_nvd_dashboard_data(event)
 
     def _handle_banned_file_events(self, event):
         self.logger.debug("Dispatching Banned File Fixlet Update")
+        mark(event.trace, "egress_queue")
         self._api.process_banned_file_event(event)
 
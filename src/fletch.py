@@ -1,12 +1,13 @@
 import logging
 import argparse
 import sys
+import threading
 from time import sleep
 
 from cbapi import CbEnterpriseResponseAPI
 from cbapi.response.models import Watchlist
 
-from comms.bigfix_api import BigFixApi
+from comms.bigfix_api import BigFixApi, CACHE_POST_CHANNEL
 from data.switchboard import Switchboard
 from egress.bigfix import EgressBigFix
 from fletch_config import Config
@@ -15,6 +16,8 @@ from ingress.cbforwarder.cb_event_handler import CbEventHandler
 from ingress.cbforwarder.cb_event_listener import CbEventListener
 from ingress.cbforwarder.s3_event_listener import S3EventListener
 from utils.loggy import Loggy
+from utils.metrics import MetricsRegistry, Gauge
+from utils.metrics_server import MetricsServer
 from fletch_init import auto_create_vulnerability_watchlist
 
 
@@ -64,7 +67,10 @@ class CbBigFixIntegrator(object):
             self._config.vulnerable_app_feeds)
 
         # establish our services
-        self._sb = Switchboard()
+        self._sb = Switchboard(
+            workers=self._config.switchboard_workers,
+            max_queue_depth=self._config.switchboard_max_queue_depth,
+            backpressure=self._config.switchboard_backpressure)
         self._bigfix_api = BigFixApi(self._config, self._sb)
         if self._config.event_source == "cb-event-forwarder":
             self._cb_listener = CbEventListener(self._config, self._sb)
@@ -78,6 +84,9 @@ class CbBigFixIntegrator(object):
                                           self._bigfix_api)
         self._bf_egress = EgressBigFix(self._config, self._sb,
                                        self._bigfix_api)
+        self._metrics_server = None
+        if self._config.metrics_port:
+            self._metrics_server = self._serve_metrics()
         self.logger.debug("All Services Up")
 
         try:
@@ -86,10 +95,37 @@ class CbBigFixIntegrator(object):
 
         # TODO handle shutdown signals here
         except KeyboardInterrupt:
+            # drain the channels in pipeline order, so the events still
+            # queued make it all the way to BigFix
             self._cb_listener.shutdown()
-            self._sb.shutdown()
+            self._sb.shutdown(order=("sb_incoming_cb_events",
+                                     self._config.sb_feed_hit_events,
+                                     self._config.sb_banned_file_events,
+                                     CACHE_POST_CHANNEL),
+                              timeout=30)
+            self._sb.join(timeout=30)
+            self._cb_handler.shutdown()
+            self._cb_handler.join(timeout=30)
+            self._bigfix_api.join(timeout=30)
+            if self._metrics_server is not None:
+                self._metrics_server.shutdown()
             print("Goodbye")
 
+    def _serve_metrics(self):
+        """
+        Gather the metrics of all of the services and serve them over HTTP.
+        """
+        registry = MetricsRegistry()
+        self._sb.register_metrics(registry)
+        self._bigfix_api.register_metrics(registry)
+        self._cb_listener.register_metrics(registry)
+        self._cb_handler.register_metrics(registry)
+        registry.register("threads_active", Gauge(
+            "threads_active", "threads running in the connector",
+            threading.active_count))
+        return MetricsServer(registry, self._config.metrics_port,
+                             self._config.metrics_address)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Cb Response, IBM Bigfix Integration Connector.')
     parser.add_argument('-c', '--config', metavar='c', nargs='?',
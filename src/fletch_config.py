@@ -8,6 +8,15 @@ import ConfigParser
 import json
 from utils.loggy import Loggy
 
+# default file recording what has been posted to the BigFix dashboard, under
+# /var/lib as it has to survive reboots
+DASHBOARD_STATE_FILE = \
+    "/var/lib/cb/integrations/cb-response-bigfix-connector/dashboard-posted"
+
+# default directory of the dashboard cache spool
+DASHBOARD_SPOOL_DIR = \
+    "/var/lib/cb/integrations/cb-response-bigfix-connector/dashboard-spool"
+
 
 class FletchCriticalError(Exception):
     """
@@ -54,6 +63,19 @@ class CbEventListener(object):
         # name of channel to ship received JSON messages to
         self.sb_incoming_cb_events = "sb_incoming_cb_events"
 
+        # size (in bytes) of the chunks read off the forwarder socket
+        self.read_buffer_size = 65536
+
+        # "threads" (a thread per forwarder connection) or "selector" (all
+        # connections served from one thread)
+        self.ingest_mode = "threads"
+
+        # selector mode only: pause reading while the incoming channel has
+        # more than the high watermark of events queued, until it drains
+        # to the low watermark. 0 turns flow control off.
+        self.flow_control_high_watermark = 5000
+        self.flow_control_low_watermark = 1000
+
         # TODO defaults init
 
         # load in the items from the config file
@@ -62,6 +84,11 @@ class CbEventListener(object):
 
         # cast to int.. port to communicate with the cb-event-forwarder
         self.listen_port = int(self.listen_port)
+        self.read_buffer_size = int(self.read_buffer_size)
+        self.ingest_mode = self.ingest_mode.lower()
+        self.flow_control_high_watermark = \
+            int(self.flow_control_high_watermark)
+        self.flow_control_low_watermark = int(self.flow_control_low_watermark)
 
 
 class S3EventListener(object):
@@ -72,9 +99,20 @@ class S3EventListener(object):
         # name of channel to ship received JSON messages to
         self.sb_incoming_cb_events = "sb_incoming_cb_events"
 
+        # only keys under this prefix are listed (the forwarder's
+        # object_prefix setting, if used)
+        self.key_prefix = ""
+
+        # number of objects read at once, and the size of each read
+        self.workers = 4
+        self.read_buffer_size = 65536
+
         for x in load_file_section('s3-event-listener', config_file_path):
             self.__dict__[x[0]] = x[1]
 
+        self.workers = int(self.workers)
+        self.read_buffer_size = int(self.read_buffer_size)
+
 
 class CbComms(object):
     """
@@ -90,6 +128,11 @@ class CbComms(object):
         # must always end in a forward slash
         self.url = ''
 
+        # bounds on the API requests made against the server
+        self.api_max_concurrent = 4
+        self.api_timeout = 30
+        self.api_queue_size = 1000
+
         # load in the items from the config file
         for x in load_file_section('cb-enterprise-response', config_file_path):
             self.__dict__[x[0]] = x[1]
@@ -97,6 +140,10 @@ class CbComms(object):
         # correct type to boolean
         self.ssl_verify = str2bool(self.ssl_verify)
 
+        self.api_max_concurrent = int(self.api_max_concurrent)
+        self.api_timeout = float(self.api_timeout)
+        self.api_queue_size = int(self.api_queue_size)
+
 
 class IbmBigfix(object):
     """
@@ -110,12 +157,97 @@ class IbmBigfix(object):
         # TODO defaults init
         self.bigfix_custom_site_name = 'Carbon Black'
 
+        # sensor id -> besid lookup cache. TTLs in seconds.
+        self.besid_cache_size = 10000
+        self.besid_cache_ttl = 3600
+        self.besid_cache_negative_ttl = 300
+
+        # window (in seconds) for batching besid lookups into one query,
+        # and whether to preload every sensor's besid at startup.
+        self.besid_batch_window = 0.05
+        self.besid_cache_warmup = False
+
+        # banned file events for the same md5 are collected for this many
+        # seconds and sent as one fixlet update. 0 updates on every event.
+        self.fixlet_coalesce_window = 5
+
+        # index the banned file fixlets of the custom site at startup
+        self.fixlet_index_preload = True
+
+        # post the cache early once it holds this many asset/CVE records or
+        # is estimated at this many bytes, and never post more than that
+        # at once. 0 for no limit.
+        self.packaging_max_cves = 50000
+        self.packaging_max_bytes = 4194304
+
+        # spool the dashboard cache to disk (empty to keep it in memory
+        # only), fsync'ing it at most every so many seconds
+        self.cache_spool_dir = DASHBOARD_SPOOL_DIR
+        self.cache_spool_fsync_interval = 1.0
+
+        # gzip compress dashboard posts, the BigFix server must accept
+        # Content-Encoding: gzip request bodies
+        self.dashboard_gzip = False
+
+        # only post dashboard changes, keeping track of what was posted in
+        # the state file, and post everything every so many hours (0 never).
+        # Computers without hits for max_age days are forgotten (0 never).
+        self.dashboard_delta_posts = True
+        self.dashboard_state_file = DASHBOARD_STATE_FILE
+        self.dashboard_full_reconcile_interval = 24
+        self.dashboard_state_max_age = 30
+
+        # dashboard posts and fixlet updates that fail while BigFix is
+        # unavailable are retried, after backoff_base seconds at first and
+        # doubling up to backoff_max. Up to retry_queue_size computers and
+        # as many md5s are kept waiting.
+        self.retry_queue_size = 10000
+        self.retry_backoff_base = 5
+        self.retry_backoff_max = 300
+
+        # after this many failed requests in a row, stop sending requests
+        # to BigFix for circuit_breaker_reset seconds. 0 never stops.
+        self.circuit_breaker_threshold = 5
+        self.circuit_breaker_reset = 60
+
+        # HTTP connection pooling, timeout (seconds) and retries
+        self.http_pool_size = 10
+        self.http_timeout = 30
+        self.http_retries = 3
+        self.http_retry_backoff = 0.5
+
         # load in the items from the config file
         for x in load_file_section('ibm-bigfix', config_file_path):
             self.__dict__[x[0]] = x[1]
 
         # correct type to an integer
         self.packaging_interval = int(self.packaging_interval)
+        self.besid_cache_size = int(self.besid_cache_size)
+        self.besid_cache_ttl = int(self.besid_cache_ttl)
+        self.besid_cache_negative_ttl = int(self.besid_cache_negative_ttl)
+        self.besid_batch_window = float(self.besid_batch_window)
+        self.besid_cache_warmup = str2bool(str(self.besid_cache_warmup))
+        self.http_pool_size = int(self.http_pool_size)
+        self.http_timeout = float(self.http_timeout)
+        self.http_retries = int(self.http_retries)
+        self.http_retry_backoff = float(self.http_retry_backoff)
+        self.fixlet_coalesce_window = float(self.fixlet_coalesce_window)
+        self.fixlet_index_preload = str2bool(str(self.fixlet_index_preload))
+        self.packaging_max_cves = int(self.packaging_max_cves)
+        self.packaging_max_bytes = int(self.packaging_max_bytes)
+        self.cache_spool_fsync_interval = \
+            float(self.cache_spool_fsync_interval)
+        self.dashboard_gzip = str2bool(str(self.dashboard_gzip))
+        self.dashboard_delta_posts = \
+            str2bool(str(self.dashboard_delta_posts))
+        self.dashboard_full_reconcile_interval = \
+            float(self.dashboard_full_reconcile_interval)
+        self.dashboard_state_max_age = float(self.dashboard_state_max_age)
+        self.retry_queue_size = int(self.retry_queue_size)
+        self.retry_backoff_base = float(self.retry_backoff_base)
+        self.retry_backoff_max = float(self.retry_backoff_max)
+        self.circuit_breaker_threshold = int(self.circuit_breaker_threshold)
+        self.circuit_breaker_reset = float(self.circuit_breaker_reset)
 
         # correct type to boolean
         self.cache_enabled = str2bool(self.cache_enabled)
@@ -145,6 +277,24 @@ class Config(object):
         self.log_level = "DEBUG"
         self.vuln_watchlist_name = 'BigFix Integration Vulnerability Watchlist'
         self.event_source = "cb-event-forwarder"
+        self.event_prefilter = True
+
+        # Cb process document caching for the implication parent hunt
+        self.process_cache_size = 10000
+        self.process_cache_ttl = 600
+
+        # Switchboard channel dispatching
+        self.switchboard_workers = 4
+        self.switchboard_max_queue_depth = 10000
+        self.switchboard_backpressure = "block"
+
+        # metrics endpoint, off unless a port is given
+        self.metrics_port = 0
+        self.metrics_address = "127.0.0.1"
+
+        # per-event tracing, off unless a sample rate is given
+        self.trace_sample_rate = 0.0
+        self.trace_latency_budget = 900
 
         # load in the items from the config file
         # TODO clean this up to read values individually and specify defaults
@@ -156,6 +306,21 @@ class Config(object):
         self.send_implicated_app_info = bool(self.send_implicated_app_info)
         self.send_banned_file_info = bool(self.send_banned_file_info)
 
+        # skip decoding forwarder lines that can't be of a type we handle
+        self.event_prefilter = str2bool(str(self.event_prefilter))
+
+        self.process_cache_size = int(self.process_cache_size)
+        self.process_cache_ttl = int(self.process_cache_ttl)
+
+        # switchboard worker pool sizing
+        self.switchboard_workers = int(self.switchboard_workers)
+        self.switchboard_max_queue_depth = \
+            int(self.switchboard_max_queue_depth)
+
+        self.metrics_port = int(self.metrics_port)
+        self.trace_sample_rate = float(self.trace_sample_rate)
+        self.trace_latency_budget = float(self.trace_latency_budget)
+
         # handle log level assignment
         if self.log_level == "DEBUG":
             self.log_level = Loggy.DEBUG
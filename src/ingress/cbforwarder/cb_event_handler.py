@@ -5,6 +5,41 @@ from cbapi.response.models import Process as cbapiProcess
 import data.events as events
 import logging
 
+from comms.cb_request_executor import CbRequestExecutor, CbRequestTimeout
+from utils.lru_cache import LruCache, MISSING
+from utils.tracing import mark, finish
+
+
+def _split_unique_id(full_unique_id):
+    """
+    Separate a Cb process unique id into the id and segment parts.
+    :param full_unique_id: '<process id>-<segment id>'
+    :return: tuple of (process id, segment id as int), converting to int
+             drops the extra 0's
+    """
+    id_split = full_unique_id.split("-")
+    return "-".join(id_split[0:-1]), int(id_split[-1])
+
+
+class _ProcessSummary(object):
+    """
+    The parts of a Cb Response process document needed to hunt for
+    vulnerable parent processes. Kept small since these are cached.
+    """
+    def __init__(self, process_json, threat_hits):
+        self.unique_id = process_json['unique_id']
+        self.segment_id = process_json.get('segment_id')
+        self.key = "{0}-{1}".format(*_split_unique_id(self.unique_id))
+        self.parent_unique_id = process_json.get('parent_unique_id')
+        self.hostname = process_json.get('hostname')
+        self.sensor_id = process_json.get('sensor_id')
+        self.md5 = process_json.get('process_md5')
+        self.path = process_json.get('path')
+        self.name = process_json.get('process_name')
+
+        # tuples of (feed name, score, cve) that passed the min scores
+        self.threat_hits = threat_hits
+
 
 class CbEventHandler(object):
 
@@ -34,6 +69,13 @@ class CbEventHandler(object):
             ssl_verify=fletch_config.cb_comms.ssl_verify
         )
 
+        # all Cb API lookups go through here, bounding how many are in
+        # flight against the Cb server at once
+        self._cb_executor = CbRequestExecutor(
+            max_concurrent=fletch_config.cb_comms.api_max_concurrent,
+            timeout=fletch_config.cb_comms.api_timeout,
+            queue_size=fletch_config.cb_comms.api_queue_size)
+
         # grab our risk settings
         self._nvd_risk = fletch_config.risk_phase2_nvd
         self._iocs_nvd_risk = fletch_config.risk_phase2_nvd_and_iocs
@@ -55,18 +97,30 @@ class CbEventHandler(object):
         self.send_implicated_app_info = fletch_config.send_implicated_app_info
         self.send_banned_file_info = fletch_config.send_banned_file_info
 
+        # process tree caches for the implication parent hunt
+        self._process_cache = LruCache(
+            fletch_config.process_cache_size,
+            ttl=fletch_config.process_cache_ttl)
+        self._resolved_ancestors = LruCache(
+            fletch_config.process_cache_size,
+            ttl=fletch_config.process_cache_ttl)
+
         # register our callback
         self._switchboard.channel(
             "sb_incoming_cb_events"
         ).register_callback(self.handle_incoming_event)
 
-    def handle_incoming_event(self, json_object):
+    def handle_incoming_event(self, json_object, trace=None):
         """
         This function is designed to be a callback by a switchboard channel
         We'll handle the data sent in by the CbEventListener class.
         :param json_object:  JSON from the cb-event-forwarder
+        :param trace: utils.tracing.Trace if the event is traced
         """
+        mark(trace, "incoming_queue")
 
+        # traces of events that go no further end here
+        forwarded = False
         try:
             # watch for feed events so we can inspect processes
             if json_object['type'] == 'feed.storage.hit.process':
@@ -75,7 +129,8 @@ class CbEventHandler(object):
                 if self.send_banned_file_info:
                     if json_object['feed_name'] in self.banned_file_feed:
                         self.logger.debug("Dispatching Process Banned Event")
-                        self._process_banned_files(json_object)
+                        forwarded = self._process_banned_files(
+                            json_object, trace)
 
             # Observe for watchlist hits that we should process
             elif json_object['type'] == 'watchlist.storage.hit.process':
@@ -85,19 +140,38 @@ class CbEventHandler(object):
                     if json_object['watchlist_name'] == \
                             self.vuln_watchlist_name:
                         self.logger.debug("Dispatching Vulnerable App Event")
-                        self._process_vuln_hit(json_object)
+                        forwarded = self._process_vuln_hit(
+                            json_object, trace)
 
                 # match on implication watchlists:
                 if self.send_implicated_app_info:
                     if json_object['watchlist_name'] in \
                             self.implication_watchlists:
                         self.logger.debug("Dispatching Implication Event")
-                        self._process_watchlist_hit(json_object)
+                        forwarded = self._process_watchlist_hit(
+                            json_object, trace) or forwarded
 
         except Exception as e:
             self.logger.exception(e)
 
-    def _process_vuln_hit(self, json_object):
+        if not forwarded:
+            finish(trace, "dropped")
+
+    def _lookup_besid(self, cb_sensor_id):
+        """
+        Find the BigFix computer id for a sensor.
+        :param cb_sensor_id: the Cb Response sensor id
+        :return: the besid as an int, or None if BigFix doesn't know
+                 about this sensor (the event can't be sent along).
+        """
+        besid = self._bigfix_api.get_besid(cb_sensor_id)
+        if besid is None:
+            self.logger.info("Dropping event for sensor {0}, no matching "
+                             "BigFix computer".format(cb_sensor_id))
+            return None
+        return int(besid)
+
+    def _process_vuln_hit(self, json_object, trace=None):
         """
         Note: this function was rewritten from processing feed hit events
         into processing watchlist events as part of adapting to the discovery
@@ -110,11 +184,16 @@ class CbEventHandler(object):
         stream for output processing.
 
         :param json_object: JSON received from cb-event-forwarder
+        :param trace: utils.tracing.Trace if the event is traced
+        :return: True if the event was sent along
         """
 
         event = events.VulnerableAppEvent()
+        event.trace = trace
         process_id = json_object['process_id']
-        process_doc = self._cb.select(cbapiProcess, process_id)
+        process_doc = self._cb_executor.call(self._fetch_process_doc,
+                                             process_id)
+        mark(trace, "cb_lookup")
 
         # host information
         event.host.name = process_doc.hostname
@@ -122,8 +201,10 @@ class CbEventHandler(object):
 
         # TODO: we probably shouldn't be looking up bes id's here. Leave that
         # TODO: up to the bigfix later on in the processing chain.
-        event.host.bigfix_id = int(self._bigfix_api.get_besid(
-            event.host.cb_sensor_id))
+        event.host.bigfix_id = self._lookup_besid(event.host.cb_sensor_id)
+        if event.host.bigfix_id is None:
+            return False
+        mark(trace, "besid_lookup")
 
         # process information, or at least, whatever we can fill in
         event.vuln_process.guid = process_id
@@ -165,8 +246,9 @@ class CbEventHandler(object):
                     event.threat_intel.hits.append(th)
 
         self._core_event_chan.send(event)
+        return True
 
-    def _process_watchlist_hit(self, json_object):
+    def _process_watchlist_hit(self, json_object, trace=None):
         """
         NOTE: This function processes IMPLICATION watchlists hits.
         When we notice a watchlist hit come over the wire, process the data
@@ -175,151 +257,259 @@ class CbEventHandler(object):
         object with additional data so bigfix can show a higher priority
         for whatever vulnerability it was.
         :param json_object: JSON received from cb-event-forwarder
+        :param trace: utils.tracing.Trace if the event is traced
+        :return: True if the event was sent along
         """
         self.logger.debug("Saw implication feed hit for process: {}".format(
             json_object["process_id"]
         ))
 
-        # for some reason all feeds have alliance as a prefix..
-        # since the configuration takes in just the feed name we need to
-        # prepend this prefix so that we can do a string match.
-        feed_prefix = "alliance_score_"
-
         # separate the id and segment ids out
         # unfortunately this some stuffed into a 'doc' entry.
         # warn if we have more than one since we don't account for it
         if len(json_object['docs']) != 1:
             self.logger.warning("More than one 'doc' received??")
 
-        id_split = json_object["docs"][0]["unique_id"].split("-")
-        unique_id = "-".join(id_split[0:-1])
-        segment_id = int(id_split[-1])  # convert to int to drop extra 0's
+        unique_id, segment_id = _split_unique_id(
+            json_object["docs"][0]["unique_id"])
 
-        process_json = self._old_cbapi.process_events(
-                            unique_id, str(segment_id))["process"]
-
-        # since we will be re-writing the process_json every loop
-        # let's save the start point so we can come back to it later
-        implicating_process_json = process_json
+        implicating_process = self._get_process_summary(
+            unique_id, str(segment_id))
 
         # start parent hunting
-        while "parent_unique_id" in process_json:
+        vuln_process = self._find_vulnerable_ancestor(implicating_process)
+        if vuln_process is None:
+            return False
+        mark(trace, "cb_lookup")
+
+        event = events.ImplicatedAppEvent()
+        event.trace = trace
 
-            # some helping data structure for all the data we are
-            # about to process. This is a pain because of how we need to
-            # get feed hit information out of the cb api documents
-            all_threat_hits = list()
+        # host information
+        event.host.name = implicating_process.hostname
+        event.host.cb_sensor_id = implicating_process.sensor_id
+        event.host.bigfix_id = self._lookup_besid(
+            implicating_process.sensor_id)
+        if event.host.bigfix_id is None:
+            return False
+        mark(trace, "besid_lookup")
+
+        event.implicating_watchlist_name = \
+            json_object['watchlist_name']
+
+        # TODO add in rest of implicating process information
+        event.implicating_process.guid = implicating_process.unique_id
+
+        # TODO add in implicating process threat intel
+
+        # the vulnerable process information
+        event.vuln_process.md5 = vuln_process.md5
+        event.vuln_process.guid = vuln_process.unique_id
+        event.vuln_process.file_path = vuln_process.path
+        event.vuln_process.name = vuln_process.name
+        event.vuln_process.cb_analyze_link = "{0}/{1}/{2}".format(
+            self._cb_url, event.vuln_process.guid,
+            vuln_process.segment_id)
+
+        # the vulnerable process threat info, each event gets its own
+        # hit objects since the summary is shared through the cache.
+        for feed_name, score, cve in vuln_process.threat_hits:
+            th = events.ThreatIntelHit()
+            th.feed_name = feed_name
+            th.score = score
+            th.cve = cve
+            event.threat_intel.hits.append(th)
+
+        self.logger.info(
+            'Found Vulnerable Process {} from Implication {}'.format(
+                event.vuln_process.guid, event.implicating_process.guid
+            ))
+        self._core_event_chan.send(event)
+        return True
+
+    def _find_vulnerable_ancestor(self, process):
+        """
+        Walk up the process tree, starting at (and including) the given
+        process, until we find one with vulnerability feed hits.
+        Processes on one host tend to share their ancestors, so the answer
+        is remembered for every process we walked through. A later walk
+        reaching any of them stops right there.
+        :param process: _ProcessSummary to start at
+        :return: _ProcessSummary of the vulnerable process, or None
+        """
+        visited = list()
+        found = None
+        definitive = True
+
+        while process.parent_unique_id is not None:
+
+            # has a previous walk already been through here?
+            resolved = self._resolved_ancestors.get(process.key, MISSING)
+            if resolved is not MISSING:
+                self.logger.debug("Process {0} already resolved".format(
+                    process.key))
+                found = resolved
+                break
+
+            visited.append(process.key)
 
             # check to see if we have come across something with registered
             # NVD hits.  If so, we stop processing here and toss the result
             # over to the queue for posting to bigfix.
-            for feed in self.vuln_feeds_entries:
-                feed_name = feed[0]  # name of feed
-                feed_min_score = feed[1]  # min score to proceed with match
-
-                full_feed_key = feed_prefix + feed_name
-
-                # check whether the key exists
-                if full_feed_key in process_json:
-
-                    # collect all the information on this feed's hits
-                    for hit in process_json['alliance_hits']:
-                        hit_contents = process_json['alliance_hits'][hit]
-                        hit_feed_name = hit_contents['feedinfo']['name']
-                        if hit_feed_name.lower() == feed_name.lower():
-                            for report in hit_contents['hits']:
-                                report_value = hit_contents['hits'][report]
-
-                                th = events.ThreatIntelHit()
-                                th.feed_name = hit_feed_name.lower()
-                                th.score = float(report_value['score'])/10
-
-                                # again, assumed title format:
-                                # Expected title format:  CVE<id> description
-                                th.cve = report_value['title'].split(' ')[0]
-
-                                # get rid of the 'CVE' part of the title,
-                                # just want the id.
-                                th.cve = th.cve[4:]
-
-                                # only add it to the list if the score is high
-                                if feed_min_score < report_value['score']:
-                                    all_threat_hits.append(th)
-
-            # Inspect to see if we have any entries in the hit list that
-            # are relevant to this process.
-            if len(all_threat_hits) > 0:
-
-                event = events.ImplicatedAppEvent()
-
-                # host information
-                event.host.name = implicating_process_json['hostname']
-                event.host.cb_sensor_id = implicating_process_json['sensor_id']
-                event.host.bigfix_id = int(self._bigfix_api.get_besid(
-                    implicating_process_json['sensor_id']))
-
-                event.implicating_watchlist_name = \
-                    json_object['watchlist_name']
-
-                # TODO add in rest of implicating process information
-                event.implicating_process.guid = \
-                    implicating_process_json["unique_id"]
-
-                # TODO add in implicating process threat intel
-
-                # the vulnerable process information
-                event.vuln_process.md5 = process_json['process_md5']
-                event.vuln_process.guid = process_json['unique_id']
-                event.vuln_process.file_path = process_json['path']
-                event.vuln_process.name = process_json['process_name']
-                event.vuln_process.cb_analyze_link = "{0}/{1}/{2}".format(
-                    self._cb_url, event.vuln_process.guid,
-                    process_json["segment_id"])
-
-                # the vulnerable process threat info, we can just take our
-                # list and stick it right into a threat intel report
-                event.threat_intel.hits = all_threat_hits
-                self.logger.info(
-                    'Found Vulnerable Process {} from Implication {}'.format(
-                        event.vuln_process.guid, event.implicating_process.guid
-                    ))
-
-                # send our message and escape the while loop
-                self._core_event_chan.send(event)
+            if process.threat_hits:
+                found = process
                 break
 
             # if no relevant hits, then we need to grab the parent process
             # and keep going up the chain.
-            else:
-
-                # separate the id and segment ids out
-                parent_id_split = \
-                    process_json["parent_unique_id"].split("-")
-                parent_id = "-".join(parent_id_split[0:-1])
-                parent_segment = int(parent_id_split[-1])  # convert: drop 0's
-
-                self.logger.debug("Chasing id-segment: {0} - {1}".format(
-                    parent_id, parent_segment))
-
-                # grab the parent process and do the loop over again
-                try:
-                    process_json = \
-                        self._old_cbapi.process_events(
-                            parent_id, parent_segment)["process"]
-                except HTTPError:
-                    self.logger.info("Stopping the process hunt, can't find "
-                                      "the parent process")
-                    break  # stop the search
-
-    def _process_banned_files(self, json_object):
+            parent_id, parent_segment = _split_unique_id(
+                process.parent_unique_id)
+
+            self.logger.debug("Chasing id-segment: {0} - {1}".format(
+                parent_id, parent_segment))
+
+            # grab the parent process and do the loop over again
+            try:
+                process = self._get_process_summary(parent_id,
+                                                    parent_segment)
+            except HTTPError:
+                self.logger.info("Stopping the process hunt, can't find "
+                                 "the parent process")
+                definitive = False
+                break  # stop the search
+            except CbRequestTimeout as e:
+                self.logger.warning("Stopping the process hunt: {0}".format(
+                    e))
+                definitive = False
+                break
+
+        # only remember complete walks, a failed lookup may be temporary
+        if definitive:
+            for key in visited:
+                self._resolved_ancestors.put(key, found)
+
+        return found
+
+    def _get_process_summary(self, unique_id, segment_id):
+        """
+        Grab the parts of a process document we need for the parent
+        hunt, through the process summary cache.
+        :param unique_id: the process unique id, without the segment
+        :param segment_id: the segment id
+        :return: _ProcessSummary
+        """
+        key = "{0}-{1}".format(unique_id, int(segment_id))
+        return self._process_cache.get_or_load(
+            key, lambda _: self._load_process_summary(unique_id, segment_id))
+
+    def _load_process_summary(self, unique_id, segment_id):
+        """
+        Fetch the process document from Cb Response and boil it down to
+        a _ProcessSummary, including the vulnerability feed hits that
+        pass the configured minimum scores.
+        """
+        process_json = self._cb_executor.call(
+            self._old_cbapi.process_events, unique_id, segment_id)["process"]
+
+        # for some reason all feeds have alliance as a prefix..
+        # since the configuration takes in just the feed name we need to
+        # prepend this prefix so that we can do a string match.
+        feed_prefix = "alliance_score_"
+
+        # some helping data structure for all the data we are
+        # about to process. This is a pain because of how we need to
+        # get feed hit information out of the cb api documents
+        all_threat_hits = list()
+
+        for feed in self.vuln_feeds_entries:
+            feed_name = feed[0]  # name of feed
+            feed_min_score = feed[1]  # min score to proceed with match
+
+            full_feed_key = feed_prefix + feed_name
+
+            # check whether the key exists
+            if full_feed_key in process_json:
+
+                # collect all the information on this feed's hits
+                for hit in process_json['alliance_hits']:
+                    hit_contents = process_json['alliance_hits'][hit]
+                    hit_feed_name = hit_contents['feedinfo']['name']
+                    if hit_feed_name.lower() == feed_name.lower():
+                        for report in hit_contents['hits']:
+                            report_value = hit_contents['hits'][report]
+
+                            # again, assumed title format:
+                            # Expected title format:  CVE<id> description
+                            # get rid of the 'CVE' part of the title,
+                            # just want the id.
+                            cve = report_value['title'].split(' ')[0][4:]
+
+                            # only add it to the list if the score is high
+                            if feed_min_score < report_value['score']:
+                                all_threat_hits.append((
+                                    hit_feed_name.lower(),
+                                    float(report_value['score'])/10,
+                                    cve))
+
+        return _ProcessSummary(process_json, all_threat_hits)
+
+    def _fetch_process_doc(self, process_id):
+        """
+        select() is lazy, the document is only fetched on first attribute
+        access. Force that here so it happens on the executor.
+        """
+        process_doc = self._cb.select(cbapiProcess, process_id)
+        process_doc.refresh()
+        return process_doc
+
+    def cb_request_metrics(self):
+        """
+        :return: dict of queue depth, queue wait and latency metrics for
+                 the Cb API requests
+        """
+        return self._cb_executor.metrics()
+
+    def shutdown(self):
+        """
+        Stop the Cb API request executor, queued requests still finish.
+        """
+        self._cb_executor.shutdown()
+
+    def join(self, timeout=None):
+        self._cb_executor.join(timeout)
+
+    def register_metrics(self, registry):
+        """
+        Expose the Cb API request metrics and the process cache stats in a
+        MetricsRegistry.
+        """
+        self._cb_executor.register_metrics(registry)
+        self._process_cache.register_metrics(registry, "process_summaries")
+        self._resolved_ancestors.register_metrics(registry,
+                                                  "resolved_ancestors")
+
+    def process_cache_stats(self):
+        """
+        :return: dict with the stats of the process summary cache and the
+                 resolved vulnerable ancestor cache
+        """
+        return {
+            "process_summaries": self._process_cache.stats(),
+            "resolved_ancestors": self._resolved_ancestors.stats(),
+        }
+
+    def _process_banned_files(self, json_object, trace=None):
         """
         For every banned file that is detected as attempted to execute,
         we need to inform BigFix of it's presence. This will be done
         through the creation/update of a fixlet within the bigfix server.
         :param json_object:  the json from the cb-event-forwarder
+        :param trace: utils.tracing.Trace if the event is traced
+        :return: True if the event was sent along
         """
 
         ban_event = events.BannedFileEvent()
+        ban_event.trace = trace
         ban_event.host.name = json_object["hostname"]
 
         # assuming only a single doc again here
@@ -328,8 +518,11 @@ class CbEventHandler(object):
 
         # TODO: we probably shouldn't be looking up bes id's here. Leave that
         # TODO: up to the bigfix later on in the processing chain.
-        ban_event.host.bigfix_id = int(self._bigfix_api.get_besid(
-            json_object['sensor_id']))
+        ban_event.host.bigfix_id = self._lookup_besid(
+            json_object['sensor_id'])
+        if ban_event.host.bigfix_id is None:
+            return False
+        mark(trace, "besid_lookup")
 
         # TODO correct test case, it wasn't properly checking os type
         ban_event.host.cb_sensor_id = json_object['sensor_id']
@@ -343,3 +536,4 @@ class CbEventHandler(object):
         #    self._cb_url, ban_event.process.guid, json_object["segment_id"])
 
         self._banned_file_chan.send(ban_event)
+        return True
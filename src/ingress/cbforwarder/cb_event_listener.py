@@ -13,13 +13,36 @@ Overall data path:
 From the core event stream the output plugins can do whatever they'd like
 to the data and ship it to where it needs to go.
 """
+import errno
 import logging
-from json import loads as json_loads
-from socket import socket, timeout
-from socket import AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR
-from select import epoll, EPOLLIN
+from socket import socket, error as socket_error
+from socket import AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR, SOMAXCONN
+from select import epoll, EPOLLIN, poll, POLLIN, error as select_error
 from threading import Thread
 
+from ingress.cbforwarder.event_filter import EventTypeFilter
+from ingress.cbforwarder.line_reader import SocketLineReader
+from utils.metrics import Counter
+from utils.shutdown_signal import ShutdownSignal
+from utils.tracing import Tracer
+
+# ingest modes, picked with ingest_mode in [cb-event-forwarder]
+INGEST_MODE_THREADS = "threads"
+INGEST_MODE_SELECTOR = "selector"
+
+# while reading is paused, how often (seconds) the queue depth is rechecked
+FLOW_CONTROL_RECHECK = 0.05
+
+_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+# accept() errors that only concern the one connection
+_ACCEPT_SKIP = (errno.ECONNABORTED, errno.EPROTO)
+
+# after any other accept() error, e.g. out of file descriptors (EMFILE,
+# ENFILE), wait this many seconds before accepting again. The pending
+# connection keeps the listening socket readable, so no waiting would spin.
+ACCEPT_BACKOFF = 0.1
+
 
 class CbEventListener(object):
     """
@@ -40,28 +63,64 @@ class CbEventListener(object):
         :param switchboard: Reference to the message switchboard instance
         """
         self._listen_port = fletch_config.cb_event_listener.listen_port
+        self._read_buffer_size = \
+            fletch_config.cb_event_listener.read_buffer_size
         self._switchboard = switchboard
-        self._shutdown = False
+        self._shutdown = ShutdownSignal()
         self.logger = logging.getLogger(__name__)
 
+        # only lines of the types we handle get fully decoded
+        self._event_filter = EventTypeFilter(
+            enabled=fletch_config.event_prefilter)
+
+        # a sample of the events get traced through the pipeline
+        self._tracer = Tracer(fletch_config.trace_sample_rate,
+                              fletch_config.trace_latency_budget)
+
         # create our channels in the switchboard
         self._incoming_chan = self._switchboard.channel(
             fletch_config.cb_event_listener.sb_incoming_cb_events)
 
+        # selector mode stops reading from the forwarders while the
+        # incoming channel is backed up past the high watermark, and picks
+        # back up once it has drained to the low watermark.
+        self._high_watermark = \
+            fletch_config.cb_event_listener.flow_control_high_watermark
+        self._low_watermark = \
+            fletch_config.cb_event_listener.flow_control_low_watermark
+        self.reads_paused = Counter(
+            "reads_paused", "times reading was paused by flow control")
+
         # start the listener
-        Thread(target=self._open_listening_socket,
-               name="cb_event_listener_server").start()
+        ingest_mode = fletch_config.cb_event_listener.ingest_mode
+        if ingest_mode == INGEST_MODE_SELECTOR:
+            target = self._selector_loop
+        elif ingest_mode == INGEST_MODE_THREADS:
+            target = self._open_listening_socket
+        else:
+            raise ValueError("Unknown ingest_mode {0}".format(ingest_mode))
+
+        Thread(target=target, name="cb_event_listener_server").start()
 
     def shutdown(self):
-        self._shutdown = True
+        """
+        Stop accepting connections and close the open ones. The listening
+        thread and the connection handlers wake up right away.
+        """
+        self._shutdown.set()
 
-    def _open_listening_socket(self):
+    def register_metrics(self, registry):
         """
-        Start listening. For every received connection we spawn another thread
-        to handle the data transfer.
+        Expose the forwarder line counters in a MetricsRegistry.
+        """
+        self._event_filter.register_metrics(registry)
+        self._tracer.register_metrics(registry)
+        registry.register("forwarder_reads_paused_total", self.reads_paused)
 
-        IMPORTANT: This will never return until a shutdown is called.
-        Start this function as a target of a thread.
+    def _bind_server_socket(self, backlog=5):
+        """
+        :param backlog: connections the kernel queues up for accept()
+        :return: a TCP socket listening on the configured port
         """
 
         # open a TCP socket
@@ -73,25 +132,42 @@ class CbEventListener(object):
         server_socket.bind(('0.0.0.0', self._listen_port))
 
         # become a server socket
-        server_socket.listen(5)
+        server_socket.listen(backlog)
+        return server_socket
 
-        # use epoll for waiting on connects but allowing timeouts to
-        # check for shutdown status
+    def _open_listening_socket(self):
+        """
+        Start listening. For every received connection we spawn another thread
+        to handle the data transfer.
+
+        IMPORTANT: This will never return until a shutdown is called.
+        Start this function as a target of a thread.
+        """
+        server_socket = self._bind_server_socket()
+
+        # use epoll for waiting on connects, with the shutdown signal
+        # registered as well so that a shutdown wakes us up immediately.
         epoll_instance = epoll()
         epoll_instance.register(server_socket.fileno(), EPOLLIN)
+        epoll_instance.register(self._shutdown.fileno(), EPOLLIN)
 
-        while not self._shutdown:
+        while not self._shutdown.is_set():
             # accept connections from outside
-            # we use epoll here to sit and wait for a client to connect,
-            # but we are still able to use a timeout for checking to see
-            # if we should be shutting down.
-            poll_data = epoll_instance.poll(timeout=1)
-            for event in poll_data:
+            # we use epoll here to sit and wait for a client to connect
+            # (or for the shutdown signal).
+            try:
+                poll_data = epoll_instance.poll()
+            except IOError:
+                continue  # interrupted system call
+            for fd, event in poll_data:
+                if fd != server_socket.fileno():
+                    continue
                 (client_socket, address) = server_socket.accept()
                 Thread(target=self._connection_handler,
                        name="cb_event_listener_server_thread_handler",
                        args=(client_socket, address)).start()
 
+        epoll_instance.close()
         server_socket.close()
 
     def _connection_handler(self, client_socket, address):
@@ -103,51 +179,181 @@ class CbEventListener(object):
         Highly recommend this is within its own thread.
         """
 
-        # ensure we timeout to check in and see if we should shutdown
-        # our connection and close down operations.
-        client_socket.settimeout(1)
+        # sleep until there is data to read or we are shutting down.
+        poller = poll()
+        poller.register(client_socket.fileno(), POLLIN)
+        poller.register(self._shutdown.fileno(), POLLIN)
 
-        connection_alive = True
         self.logger.info("Opening Connection With %s", address)
 
-        # this is a hack way to read data from the socket and
-        # turn it into a JSON object without over-reading data.
-        # TODO: refactor this into a better handler
-        while connection_alive is True and self._shutdown is False:
-            try:
-                json_string = list()
-                char = ''
-                while char != '\n' and connection_alive is True:
-                    char = client_socket.recv(1)
-                    if not char:
-                        connection_alive = False
-                        self.logger.info("Closing Connection With %s",
-                                         address)
-                    else:
-                        json_string.append(char)
-
-                json_object = json_loads("".join(json_string))
-
-                # TODO test case of sending watchlist hit through here
-                accepted_message_types = [
-                    "feed.storage.hit.process",
-                    "watchlist.storage.hit.process"
-                ]
-
-                # assume keys are present, fetch what we need
-                # (errors will be caught anyhow by the try-except wrapper)
-                if json_object["type"] in accepted_message_types:
-                    self.logger.debug("Received message of type: {0}".format(
-                        json_object['type']
-                    ))
-                    self._incoming_chan.send(json_object)
+        # pull the data off the wire in large chunks and split it into
+        # the newline delimited JSON documents the forwarder sends us.
+        reader = SocketLineReader(client_socket, self._read_buffer_size)
 
-                else:
-                    self.logger.debug("Skipping unrelated object: {0}".format(
-                        json_object["type"]))
+        while not reader.closed and not self._shutdown.is_set():
+            try:
+                ready = [fd for fd, event in poller.poll()]
+                if client_socket.fileno() not in ready:
+                    continue
+                lines = reader.read_lines()
 
-            except timeout:
-                pass
+            except select_error:
+                continue  # interrupted system call
 
             except Exception as e:
                 self.logger.exception(e)
+                break
+
+            for json_string in lines:
+                self._process_line(json_string)
+
+        self.logger.info("Closing Connection With %s", address)
+        self.logger.info("Forwarder lines so far: %s",
+                         self._event_filter.stats())
+        client_socket.close()
+
+    def _selector_loop(self):
+        """
+        Alternative to _open_listening_socket: all of the forwarder
+        connections are served from this one thread. epoll tells us which
+        sockets have data, each gets a single (non-blocking) read per
+        wakeup so that one busy forwarder can't starve the rest.
+
+        IMPORTANT: This will never return until a shutdown is called.
+        Start this function as a target of a thread.
+        """
+        # accepts wait their turn behind the reads, so allow for a
+        # burst of forwarders (re)connecting at once
+        server_socket = self._bind_server_socket(SOMAXCONN)
+        server_socket.setblocking(False)
+        server_fd = server_socket.fileno()
+
+        epoll_instance = epoll()
+        epoll_instance.register(server_fd, EPOLLIN)
+        epoll_instance.register(self._shutdown.fileno(), EPOLLIN)
+
+        # fd -> (socket, address, reader)
+        connections = dict()
+        paused = False
+
+        while not self._shutdown.is_set():
+            paused = self._flow_control(epoll_instance, connections, paused)
+
+            try:
+                poll_data = epoll_instance.poll(
+                    FLOW_CONTROL_RECHECK if paused else -1)
+            except IOError:
+                continue  # interrupted system call
+
+            for fd, event in poll_data:
+                if fd == server_fd:
+                    self._accept_connections(server_socket, epoll_instance,
+                                             connections, paused)
+                elif fd in connections:
+                    self._read_connection(fd, epoll_instance, connections)
+
+        for fd in list(connections):
+            self._close_connection(fd, epoll_instance, connections)
+        epoll_instance.close()
+        server_socket.close()
+        self._shutdown.close()
+
+    def _flow_control(self, epoll_instance, connections, paused):
+        """
+        Stop listening for data when the incoming channel is backed up, the
+        forwarders then block on TCP until we start reading again.
+        :return: whether reading is now paused
+        """
+        if self._high_watermark <= 0:
+            return False
+
+        depth = self._incoming_chan.queue_depth()
+        if not paused and depth >= self._high_watermark:
+            self.logger.info("Pausing forwarder reads, {0} events "
+                             "queued".format(depth))
+            self.reads_paused.increment()
+            for fd in connections:
+                epoll_instance.modify(fd, 0)
+            return True
+
+        if paused and depth <= self._low_watermark:
+            self.logger.info("Resuming forwarder reads")
+            for fd in connections:
+                epoll_instance.modify(fd, EPOLLIN)
+            return False
+
+        return paused
+
+    def _accept_connections(self, server_socket, epoll_instance,
+                            connections, paused):
+        while True:
+            try:
+                client_socket, address = server_socket.accept()
+            except socket_error as e:
+                if e.errno in _WOULD_BLOCK:
+                    return
+                if e.errno in _ACCEPT_SKIP:
+                    self.logger.info("Forwarder connection aborted before "
+                                     "it was accepted")
+                    continue
+                self.logger.error("Unable to accept forwarder connection: "
+                                  "{0}".format(e))
+                self._shutdown.wait(ACCEPT_BACKOFF)
+                return
+
+            self.logger.info("Opening Connection With %s", address)
+            client_socket.setblocking(False)
+            connections[client_socket.fileno()] = (
+                client_socket, address,
+                SocketLineReader(client_socket, self._read_buffer_size))
+            epoll_instance.register(client_socket.fileno(),
+                                    0 if paused else EPOLLIN)
+
+    def _read_connection(self, fd, epoll_instance, connections):
+        client_socket, address, reader = connections[fd]
+        try:
+            lines = reader.read_lines()
+        except socket_error as e:
+            if e.errno in _WOULD_BLOCK:
+                return
+            self.logger.exception(e)
+            self._close_connection(fd, epoll_instance, connections)
+            return
+
+        for json_string in lines:
+            self._process_line(json_string)
+
+        if reader.closed:
+            self._close_connection(fd, epoll_instance, connections)
+
+    def _close_connection(self, fd, epoll_instance, connections):
+        client_socket, address, reader = connections.pop(fd)
+        epoll_instance.unregister(fd)
+        self.logger.info("Closing Connection With %s", address)
+        self.logger.info("Forwarder lines so far: %s",
+                         self._event_filter.stats())
+        client_socket.close()
+
+    def _process_line(self, json_string):
+        """
+        Parses a single JSON document from the forwarder and sends it along
+        to the incoming channel if it is of a type we care about. Lines of
+        other types are dropped by the pre-filter without being decoded.
+        :param json_string: the raw JSON line
+        """
+        try:
+            json_object = self._event_filter.parse(json_string)
+
+            if json_object is not None:
+                self.logger.debug("Received message of type: {0}".format(
+                    json_object['type']
+                ))
+                # only traced events carry a trace along
+                trace = self._tracer.start(json_object['type'])
+                if trace is None:
+                    self._incoming_chan.send(json_object)
+                else:
+                    self._incoming_chan.send(json_object, trace=trace)
+
+        except Exception as e:
+            self.logger.exception(e)
@@ -0,0 +1,131 @@
+"""
+Cheap pre-filtering of cb-event-forwarder lines. The vast majority of the
+forwarder stream is raw sensor events (procstart, netconn, modload..) that
+we throw away. Rather than fully decoding every line only to look at the
+'type' key, we look at the raw text first and only decode candidates.
+"""
+import re
+from json import loads as json_loads
+
+from utils.metrics import Counter, MetricFamily
+
+ACCEPTED_MESSAGE_TYPES = (
+    "feed.storage.hit.process",
+    "watchlist.storage.hit.process"
+)
+
+# matches a plainly written (no escape sequences) "type" key and value
+_PLAIN_TYPE_PATTERN = re.compile(r'"type"\s*:\s*"([^"\\]*)"')
+
+# the forwarder only has a few dozen event types, anything past this many
+# is counted under 'other' so odd lines can't blow up the metrics
+MAX_COUNTED_TYPES = 100
+
+
+class EventTypeFilter(object):
+    """
+    Decides which forwarder lines are worth decoding and decodes them.
+
+    A line is only skipped without decoding when it does not contain any of
+    the accepted type strings AND a plainly written "type" value can be
+    found in it. Anything we can't be sure about (no "type" key found,
+    unusual formatting, escaped strings) falls back to a full decode and an
+    exact comparison of the 'type' key.
+    """
+
+    def __init__(self, accepted_types=ACCEPTED_MESSAGE_TYPES, enabled=True):
+        """
+        :param accepted_types: the event types to pass along
+        :param enabled: when False, every line is decoded (no pre-filter)
+        """
+        self._accepted_types = frozenset(accepted_types)
+        self._enabled = enabled
+
+        self.lines_skipped = Counter(
+            "lines_skipped", "forwarder lines dropped without decoding")
+        self.lines_parsed = Counter(
+            "lines_parsed", "forwarder lines fully decoded")
+        self.lines_accepted = Counter(
+            "lines_accepted", "forwarder lines of an accepted type")
+        self.events_by_type = MetricFamily(
+            Counter, "events_by_type",
+            "forwarder events by type, accepted or skipped",
+            ("type", "outcome"), max_children=MAX_COUNTED_TYPES)
+
+    def is_candidate(self, json_string):
+        """
+        Inspects the raw line to see whether it could be an accepted type.
+        :param json_string: the raw JSON line
+        :return: False only if the line is certainly of an unwanted type
+        """
+        return self._skipped_type(json_string) is None
+
+    def _skipped_type(self, json_string):
+        """
+        :return: the type of the line if it is certainly an unwanted one,
+                 otherwise None
+        """
+        if not self._enabled:
+            return None
+
+        for accepted_type in self._accepted_types:
+            if accepted_type in json_string:
+                return None
+
+        # fallback: if we can't find a plain type value, decode it to be safe
+        match = _PLAIN_TYPE_PATTERN.search(json_string)
+        if match is None:
+            return None
+
+        return match.group(1)
+
+    def parse(self, json_string):
+        """
+        Decodes the line if it is (or could be) one we want.
+        :param json_string: the raw JSON line
+        :return: the decoded JSON object if it is of an accepted type,
+                 otherwise None. Lines that decode to anything but an
+                 object are skipped too.
+        """
+        skipped_type = self._skipped_type(json_string)
+        if skipped_type is not None:
+            self.lines_skipped.increment()
+            self.events_by_type.labels(skipped_type, "skipped").increment()
+            return None
+
+        self.lines_parsed.increment()
+        json_object = json_loads(json_string)
+
+        event_type = json_object.get("type") \
+            if isinstance(json_object, dict) else None
+        if event_type in self._accepted_types:
+            self.lines_accepted.increment()
+            self.events_by_type.labels(event_type, "accepted").increment()
+            return json_object
+        if not isinstance(event_type, basestring):
+            event_type = str(event_type)
+        self.events_by_type.labels(event_type, "skipped").increment()
+        return None
+
+    def register_metrics(self, registry, **labels):
+        """
+        Expose the line counters in a MetricsRegistry.
+        """
+        registry.register("forwarder_lines_skipped_total",
+                          self.lines_skipped, **labels)
+        registry.register("forwarder_lines_parsed_total",
+                          self.lines_parsed, **labels)
+        registry.register("forwarder_lines_accepted_total",
+                          self.lines_accepted, **labels)
+        registry.register("forwarder_events_total",
+                          self.events_by_type, **labels)
+
+    def stats(self):
+        """
+        :return: dict of the current counter values
+        """
+        return {
+            "skipped": self.lines_skipped.value,
+            "parsed": self.lines_parsed.value,
+            "accepted": self.lines_accepted.value,
+        }
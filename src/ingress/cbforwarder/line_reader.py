@@ -0,0 +1,98 @@
+"""
+Helpers for pulling newline delimited JSON documents off of the
+cb-event-forwarder stream. Data is read off the wire in large chunks and
+split into lines here, instead of reading the socket one byte at a time.
+"""
+
+# default size of the chunk we pull off of the socket with every read
+DEFAULT_BUFFER_SIZE = 65536
+
+
+class LineFramer(object):
+    """
+    Splits an arbitrary sequence of byte chunks into complete lines.
+    Anything after the last newline of a chunk is carried over and
+    prepended to the next chunk we receive.
+    """
+
+    def __init__(self):
+        self._partial = list()
+
+    def feed(self, data):
+        """
+        Add a chunk of data to the framer.
+        :param data: raw bytes (as str) received from the stream
+        :return: list of the complete lines found, newlines stripped.
+                 Blank lines are dropped.
+        """
+        last_newline = data.rfind('\n')
+
+        # no newline at all, just hold on to it until we see one
+        if last_newline == -1:
+            if data:
+                self._partial.append(data)
+            return []
+
+        if self._partial:
+            self._partial.append(data[:last_newline])
+            complete = "".join(self._partial)
+            self._partial = list()
+        else:
+            complete = data[:last_newline]
+
+        remainder = data[last_newline + 1:]
+        if remainder:
+            self._partial.append(remainder)
+
+        return [line for line in complete.split('\n') if line.strip()]
+
+    def flush(self):
+        """
+        Grab whatever partial line is left over. Used once the stream
+        has been closed, since the last document may not have a newline.
+        :return: the left over line, or None if there is nothing left.
+        """
+        remainder = "".join(self._partial)
+        self._partial = list()
+        if remainder.strip():
+            return remainder
+        return None
+
+    def pending_bytes(self):
+        """
+        :return: number of bytes being held waiting for a newline
+        """
+        return sum(len(chunk) for chunk in self._partial)
+
+
+class SocketLineReader(object):
+    """
+    Reads complete lines off of a socket. Uses a single reusable buffer
+    with recv_into so that each read is one syscall for up to
+    buffer_size bytes of data.
+    """
+
+    def __init__(self, client_socket, buffer_size=DEFAULT_BUFFER_SIZE):
+        self._socket = client_socket
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._framer = LineFramer()
+        self.closed = False
+
+    def read_lines(self):
+        """
+        Performs a single read on the socket and returns the lines that
+        it completed. Socket errors (including timeouts) are raised to
+        the caller just like a regular recv.
+        Once the other side closes the connection, the closed attribute is
+        set and any trailing line without a newline is returned.
+        :return: list of complete lines (as str)
+        """
+        nbytes = self._socket.recv_into(self._buffer)
+
+        if nbytes == 0:
+            self.closed = True
+            remainder = self._framer.flush()
+            return [remainder] if remainder is not None else []
+
+        return self._framer.feed(self._view[:nbytes].tobytes())
@@ -0,0 +1,161 @@
+"""
+Durable record of which forwarder files on S3 have been processed, so a
+restart picks up right where the last run stopped.
+
+Two files are kept in the state directory:
+
+ - the checkpoint: the last key such that it and every key before it
+   are processed, plus the newest last modified time seen. Rewritten
+   through a temp file and rename, so it is always either the old or the
+   new version, never half written.
+ - the processed key log: keys after the checkpoint that finished early,
+   since files are read in parallel and don't complete in order. Keys are
+   appended as they finish, and the log is compacted once most of it is
+   behind the checkpoint.
+"""
+import json
+import logging
+import os
+from threading import Lock
+
+from dateutil import parser
+
+from utils.atomic_file import atomic_write
+
+CHECKPOINT_FILE_NAME = "s3-checkpoint"
+PROCESSED_LOG_FILE_NAME = "s3-processed-keys"
+
+# compact the processed key log once it has this many stale entries
+DEFAULT_COMPACT_THRESHOLD = 1000
+
+
+class S3Checkpoint(object):
+
+    def __init__(self, state_dir, compact_threshold=DEFAULT_COMPACT_THRESHOLD):
+        """
+        :param state_dir: directory the checkpoint files live in
+        :param compact_threshold: stale processed log entries allowed
+                                  before it is rewritten
+        """
+        self.logger = logging.getLogger(__name__)
+        self._checkpoint_path = os.path.join(state_dir, CHECKPOINT_FILE_NAME)
+        self._log_path = os.path.join(state_dir, PROCESSED_LOG_FILE_NAME)
+        self._compact_threshold = compact_threshold
+        self._lock = Lock()
+
+        self.last_key = None
+        self.last_modified = None
+
+        # keys after last_key that are already processed
+        self._processed = set()
+        self._log_entries = 0
+        self._log_file = None
+
+    def load(self):
+        """
+        Read back the checkpoint and processed key log. Missing files just
+        mean nothing was processed yet.
+        :return: True if a checkpoint was found
+        """
+        found = False
+        try:
+            with open(self._checkpoint_path, "r") as checkpoint_file:
+                state = json.load(checkpoint_file)
+            self.last_key = state.get("last_key")
+            if state.get("last_modified"):
+                self.last_modified = parser.parse(state["last_modified"])
+            found = True
+        except IOError:
+            pass
+        except ValueError as e:
+            self.logger.error("Ignoring unreadable S3 checkpoint {0}: "
+                              "{1}".format(self._checkpoint_path, e))
+
+        try:
+            with open(self._log_path, "r") as log_file:
+                for line in log_file:
+                    key = line.rstrip("\n")
+                    self._log_entries += 1
+                    if key and not self._behind_checkpoint(key):
+                        self._processed.add(key)
+        except IOError:
+            pass
+
+        return found
+
+    def _behind_checkpoint(self, key):
+        return self.last_key is not None and key <= self.last_key
+
+    def is_processed(self, key):
+        """
+        :return: True if the object was processed, by this run or a
+                 previous one
+        """
+        with self._lock:
+            return self._behind_checkpoint(key) or key in self._processed
+
+    def mark_processed(self, key):
+        """
+        Durably record that one object is fully processed.
+        """
+        with self._lock:
+            if self._log_file is None:
+                self._log_file = open(self._log_path, "a")
+            self._log_file.write(key + "\n")
+            self._log_file.flush()
+            os.fsync(self._log_file.fileno())
+            self._log_entries += 1
+            self._processed.add(key)
+
+    def commit(self, last_key, last_modified):
+        """
+        Move the checkpoint up to last_key, everything up to and including
+        it is processed.
+        """
+        with self._lock:
+            self.last_key = last_key
+            if last_modified is not None and (
+                    self.last_modified is None or
+                    last_modified > self.last_modified):
+                self.last_modified = last_modified
+
+            atomic_write(self._checkpoint_path, json.dumps({
+                "last_key": self.last_key,
+                "last_modified": self.last_modified.isoformat()
+                if self.last_modified is not None else None,
+            }))
+
+            self._processed = set(key for key in self._processed
+                                  if not self._behind_checkpoint(key))
+            if self._log_entries - len(self._processed) >= \
+                    self._compact_threshold:
+                self._compact()
+
+    def _compact(self):
+        """
+        Rewrite the processed key log with only the keys still ahead of
+        the checkpoint. Called with the lock held, after the checkpoint is
+        written so the dropped keys are covered by it.
+        """
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+
+        atomic_write(self._log_path,
+                     "".join(key + "\n" for key in sorted(self._processed)))
+        self.logger.debug("Compacted S3 processed key log from {0} to {1} "
+                          "entries".format(self._log_entries,
+                                           len(self._processed)))
+        self._log_entries = len(self._processed)
+
+    def pending_count(self):
+        """
+        :return: number of processed keys held ahead of the checkpoint
+        """
+        return len(self._processed)
+
+    def close(self):
+        with self._lock:
+            if self._log_file is not None:
+                self._log_file.close()
+                self._log_file = None
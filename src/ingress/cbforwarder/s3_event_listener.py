@@ -16,32 +16,103 @@ to the data and ship it to where it needs to go.
 """
 
 import logging
-from threading import Thread
+import os
+import socket
+from collections import deque
+from itertools import islice
+from threading import Thread, Lock
+from Queue import Queue
 import boto3
-from json import loads as json_loads
-import time
+from botocore.exceptions import BotoCoreError, ClientError
 from datetime import datetime
 from dateutil.tz import tzutc
 from dateutil import parser
 
+from ingress.cbforwarder.event_filter import EventTypeFilter
+from ingress.cbforwarder.s3_checkpoint import S3Checkpoint
+from ingress.cbforwarder.s3_object_reader import iter_object_lines
+from utils.metrics import Counter, Gauge
+from utils.shutdown_signal import ShutdownSignal
+from utils.tracing import Tracer
+
 
 S3_STATE_FILE = "/var/run/cb/integrations/cb-response-bigfix-connector/s3-last-modified"
 
+# the checkpoint files are kept next to the (older) last modified state file
+S3_STATE_DIR = os.path.dirname(S3_STATE_FILE)
+
+# errors reading a forwarder file that are worth trying again: throttling,
+# connection resets, timeouts
+OBJECT_READ_ERRORS = (BotoCoreError, ClientError, IOError, socket.error)
+
+# a file that fails to be read is tried this many times in a row, starting
+# OBJECT_RETRY_DELAY seconds apart and doubling, then left out of the
+# checkpoint for the next poll to try again. After failing this many polls
+# it is skipped for good.
+OBJECT_READ_ATTEMPTS = 3
+OBJECT_RETRY_DELAY = 1.0
+OBJECT_MAX_FAILED_POLLS = 5
+
+# seconds between polls of the bucket, a failed poll is tried again then
+S3_POLL_INTERVAL = 60
+
+
+class _ObjectProgress(object):
+    """
+    An object handed to the worker pool, tracked until it is done so that
+    the saved progress never moves past an object still being read.
+    """
+    def __init__(self, key, last_modified):
+        self.key = key
+        self.last_modified = last_modified
+        self.done = False
+
+        # lines already sent along, skipped when the file is read again
+        self.lines_read = 0
+
 
 class S3EventListener(object):
     def __init__(self, fletch_config, switchboard):
         """
         Establishes an interface to pull events from the Cb Response Event Forwarder via S3.
-        Does not remove the files on the S3 bucket; instead we track the most recent last modified
-        date that we've processed, and use that as a trigger
+        Does not remove the files on the S3 bucket; instead we track the key of the last file
+        we've processed. The forwarder names its files by time, so listing from just after
+        that key only returns the new files.
         """
         self._s3_bucket_name = fletch_config.s3_event_listener.bucket_name
         self._s3_profile_name = fletch_config.s3_event_listener.profile_name
+        self._key_prefix = fletch_config.s3_event_listener.key_prefix
+        self._read_buffer_size = fletch_config.s3_event_listener.read_buffer_size
         self._switchboard = switchboard
-        self._shutdown = False
+        self._shutdown = ShutdownSignal()
         self.logger = logging.getLogger(__name__)
 
         self._last_modified = datetime(2001, 1, 1, tzinfo=tzutc())
+        self._last_key = None
+        self._checkpoint = S3Checkpoint(S3_STATE_DIR)
+
+        # objects in listing order that were handed to the workers, the
+        # progress only advances over the ones at the front that are done
+        self._progress_lock = Lock()
+        self._in_progress = deque()
+
+        # key -> (polls failed, lines read) of the files that failed to be
+        # read, tried again on the next poll from where they broke off
+        self._object_failures = dict()
+
+        # only lines of the types we handle get fully decoded
+        self._event_filter = EventTypeFilter(
+            enabled=fletch_config.event_prefilter)
+        self.objects_read = Counter(
+            "objects_read", "forwarder files read off S3")
+        self.objects_failed = Counter(
+            "objects_failed", "forwarder files that failed to be read")
+        self.polls_failed = Counter(
+            "polls_failed", "polls of the bucket that failed")
+
+        # a sample of the events get traced through the pipeline
+        self._tracer = Tracer(fletch_config.trace_sample_rate,
+                              fletch_config.trace_latency_budget)
 
         # create our channels in the switchboard
         self._incoming_chan = self._switchboard.channel("sb_incoming_cb_events")
@@ -50,48 +121,282 @@ class S3EventListener(object):
         # Connect to S3
         #
         session = boto3.Session(profile_name=self._s3_profile_name)
-        s3 = session.resource('s3')
-        self._bucket = s3.Bucket(self._s3_bucket_name)
+        self._s3 = session.client('s3')
+
+        # pick up where we left off
+        self._read_progress()
+
+        self._start_object_workers(fletch_config.s3_event_listener.workers)
 
         # start the listener
         Thread(target=self._s3_poll_loop,
                name="s3_event_listener_server").start()
 
     def shutdown(self):
-        self._shutdown = True
+        """
+        Stop polling. Wakes the poll loop right away if it is sleeping.
+        """
+        self._shutdown.set()
 
-    def _process_events(self, body):
-        for json_string in body:
-            json_object = json_loads(json_string)
+    def register_metrics(self, registry):
+        """
+        Expose the forwarder line and S3 object counters in a
+        MetricsRegistry.
+        """
+        self._event_filter.register_metrics(registry)
+        self._tracer.register_metrics(registry)
+        registry.register("s3_objects_read_total", self.objects_read)
+        registry.register("s3_objects_failed_total", self.objects_failed)
+        registry.register("s3_polls_failed_total", self.polls_failed)
+        registry.register("s3_objects_queued", Gauge(
+            "objects_queued", "forwarder files waiting for a worker",
+            self._object_queue.qsize))
+        registry.register("s3_objects_in_progress", Gauge(
+            "objects_in_progress",
+            "forwarder files listed and not yet checkpointed",
+            lambda: len(self._in_progress)))
 
-            # TODO test case of sending watchlist hit through here
-            accepted_message_types = [
-                "feed.storage.hit.process",
-                "watchlist.storage.hit.process"
-            ]
+    def _start_object_workers(self, workers):
+        """
+        Several objects are read at once, the queue is kept short so the
+        listing doesn't run far ahead of the workers.
+        """
+        self._object_queue = Queue(maxsize=workers * 2)
+        self._object_workers = workers
+        for i in range(workers):
+            worker = Thread(target=self._object_worker_loop,
+                            name="s3_object_reader_{0}".format(i))
+            worker.daemon = True
+            worker.start()
 
-            # assume keys are present, fetch what we need
-            # (errors will be caught anyhow by the try-except wrapper)
-            object_type = json_object.get("type")
+    def _process_events(self, lines, progress):
+        """
+        :param lines: iterable of raw JSON lines from a forwarder file
+        :param progress: the _ObjectProgress of the file, counting the
+                         lines read
+        :return: True if all lines were processed, False if interrupted
+                 by a shutdown
+        """
+        for json_string in lines:
+            if self._shutdown.is_set():
+                return False
+            progress.lines_read += 1
+
+            try:
+                json_object = self._event_filter.parse(json_string)
+            except Exception as e:
+                self.logger.warning("Skipping bad forwarder line: {0}".format(
+                    e))
+                continue
 
-            if object_type in accepted_message_types:
+            if json_object is not None:
                 self.logger.debug("Received message of type: {0}".format(
                     json_object['type']
                 ))
-                self._incoming_chan.send(json_object)
+                # only traced events carry a trace along
+                trace = self._tracer.start(json_object['type'])
+                if trace is None:
+                    self._incoming_chan.send(json_object)
+                else:
+                    self._incoming_chan.send(json_object, trace=trace)
+        return True
+
+    def _process_object(self, progress):
+        """
+        Stream one forwarder file off S3, line by line. Transient errors
+        are retried, picking up after the last line read.
+        :param progress: the _ObjectProgress of the file
+        :return: True if the whole file was read, False if interrupted
+                 by a shutdown
+        :raises: the last error if the file couldn't be read
+        """
+        self.logger.debug("Processing file: {}".format(progress.key))
+        attempt = 1
+        while True:
+            try:
+                body = self._s3.get_object(Bucket=self._s3_bucket_name,
+                                           Key=progress.key)["Body"]
+                try:
+                    lines = iter_object_lines(progress.key, body,
+                                              self._read_buffer_size)
+                    return self._process_events(
+                        islice(lines, progress.lines_read, None), progress)
+                finally:
+                    body.close()
+            except OBJECT_READ_ERRORS as e:
+                if attempt >= OBJECT_READ_ATTEMPTS:
+                    raise
+                delay = OBJECT_RETRY_DELAY * 2 ** (attempt - 1)
+                self.logger.warning("Failed to read {0}, trying again in {1} "
+                                    "seconds: {2}".format(progress.key,
+                                                          delay, e))
+                attempt += 1
+                if self._shutdown.wait(delay):
+                    return False
+
+    def _object_failed(self, progress):
+        """
+        Account for a file that couldn't be read.
+        :return: True if it is given up on, False if the next poll is to
+                 try again
+        """
+        with self._progress_lock:
+            polls, _ = self._object_failures.get(progress.key, (0, 0))
+            polls += 1
+            if polls >= OBJECT_MAX_FAILED_POLLS:
+                self._object_failures.pop(progress.key, None)
+                return True
+            self._object_failures[progress.key] = (polls,
+                                                   progress.lines_read)
+            return False
+
+    def _stop_object_workers(self):
+        for _ in range(self._object_workers):
+            self._object_queue.put(None)
+
+    def _object_worker_loop(self):
+        while True:
+            progress = self._object_queue.get()
+            if progress is None:
+                return
+
+            with self._progress_lock:
+                failure = self._object_failures.get(progress.key)
+            if failure is not None:
+                progress.lines_read = failure[1]
+
+            try:
+                done = self._process_object(progress)
+                if done:
+                    self.objects_read.increment()
+                    with self._progress_lock:
+                        self._object_failures.pop(progress.key, None)
+            except Exception as e:
+                self.objects_failed.increment()
+                # left out of the checkpoint so the next poll reads it
+                # again, but don't let one bad file hold back the progress
+                # forever
+                done = self._object_failed(progress)
+                if done:
+                    self.logger.exception(
+                        "Giving up on {0} after failing {1} polls: {2}".format(
+                            progress.key, OBJECT_MAX_FAILED_POLLS, e))
+                else:
+                    self.logger.exception(
+                        "Failed to process {0}, trying again next poll: "
+                        "{1}".format(progress.key, e))
+
+            try:
+                # only objects that finished ahead of an earlier one need
+                # their own entry, the rest are covered by the checkpoint
+                with self._progress_lock:
+                    if done and self._in_progress[0] is not progress:
+                        self._checkpoint.mark_processed(progress.key)
+                    progress.done = done
+                self._advance_progress()
+            except Exception as e:
+                self.logger.exception("Failed to save S3 progress: {0}".format(
+                    e))
+            finally:
+                self._object_queue.task_done()
 
-            elif not object_type:
-                self.logger.debug("Skipping unrelated object without 'type' field")
-            else:
-                self.logger.debug("Skipping unrelated object: {0}".format(
-                    json_object["type"]))
+    def _advance_progress(self):
+        """
+        Move the checkpoint past every object at the front of the in
+        progress list that is done.
+        """
+        with self._progress_lock:
+            advanced = False
+            while self._in_progress and self._in_progress[0].done:
+                progress = self._in_progress.popleft()
+                self._last_key = progress.key
+                if progress.last_modified > self._last_modified:
+                    self._last_modified = progress.last_modified
+                advanced = True
+
+            if advanced:
+                self._checkpoint.commit(self._last_key, self._last_modified)
 
     def _read_progress(self):
-        self._last_modified = parser.parse(open(S3_STATE_FILE, "r").readline())
+        """
+        Load the checkpoint left by a previous run. Without one, fall back
+        on the last modified time saved by older versions, if any.
+        """
+        if self._checkpoint.load():
+            self._last_key = self._checkpoint.last_key
+            if self._checkpoint.last_modified is not None:
+                self._last_modified = self._checkpoint.last_modified
+        else:
+            try:
+                with open(S3_STATE_FILE, "r") as state_file:
+                    self._last_modified = parser.parse(state_file.readline())
+            except (IOError, ValueError):
+                self.logger.info("No S3 progress saved, starting from the "
+                                 "beginning")
 
-    def _save_progress(self):
-        self.logger.debug("Last modified time is now {}".format(self._last_modified))
-        open(S3_STATE_FILE, "w").write(self._last_modified.isoformat())
+        self.logger.info("Resuming S3 listing after key {0}, {1} objects "
+                         "past it already processed".format(
+                            self._last_key, self._checkpoint.pending_count()))
+
+    def _list_new_objects(self):
+        """
+        List the objects under the key prefix that sort after the last key
+        processed, using list_objects_v2 StartAfter. Only new objects are
+        listed, instead of the whole bucket every poll.
+        :return: generator of object summary dicts (Key, LastModified, ...)
+        """
+        list_args = {"Bucket": self._s3_bucket_name,
+                     "Prefix": self._key_prefix}
+        if self._last_key is not None:
+            list_args["StartAfter"] = self._last_key
+
+        paginator = self._s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(**list_args):
+            for obj in page.get("Contents", []):
+                yield obj
+
+    def _poll_once(self):
+        """
+        Process every object written since the last poll on the worker
+        pool, returning once they have all been read.
+        :return: number of objects handed to the workers
+        :raises: errors listing the bucket, once the objects listed before
+                 the error have been read
+        """
+        # Without a last key (first run, or state from a version that only
+        # tracked times) fall back on the last modified time to skip the
+        # files that were already handled.
+        seeding = self._last_key is None
+        last_modified = self._last_modified
+        processed = 0
+
+        try:
+            for obj in self._list_new_objects():
+                if self._shutdown.is_set():
+                    break
+
+                progress = _ObjectProgress(obj["Key"], obj["LastModified"])
+                with self._progress_lock:
+                    self._in_progress.append(progress)
+
+                # finished out of order before a restart, or covered by an
+                # older version's last modified time
+                if self._checkpoint.is_processed(obj["Key"]) or (
+                        seeding and obj["LastModified"] <= last_modified):
+                    progress.done = True
+                    self._advance_progress()
+                else:
+                    self._object_queue.put(progress)
+                    processed += 1
+        finally:
+            self._object_queue.join()
+
+            # anything left was interrupted by a shutdown or failed, it
+            # gets read again next time
+            with self._progress_lock:
+                self._in_progress.clear()
+
+        return processed
 
     def _s3_poll_loop(self):
         """
@@ -100,22 +405,23 @@ class S3EventListener(object):
         IMPORTANT: This will never return until a shutdown is called.
         Start this function as a target of a thread.
         """
-        processed_list = set()
-        max_last_modified_time = self._last_modified
-
-        while not self._shutdown:
-            for obj in self._bucket.objects.all():
-                if obj.last_modified > self._last_modified:
-                    if obj.last_modified > max_last_modified_time:
-                        max_last_modified_time = obj.last_modified
-
-                    self.logger.debug("Processing file: {}".format(obj.key))
-                    body = obj.get()["Body"].read()
-                    self._process_events(body)
-
-            self._last_modified = max_last_modified_time
-            self._save_progress()
+        while not self._shutdown.is_set():
+            try:
+                processed = self._poll_once()
+                self.logger.debug("Processed {0} new files, up to {1}. "
+                                  "Forwarder lines so far: {2}".format(
+                                    processed, self._last_key,
+                                    self._event_filter.stats()))
+            except Exception as e:
+                # e.g. throttled or the endpoint is unreachable, try again
+                # on the next poll
+                self.polls_failed.increment()
+                self.logger.exception("Failed to poll S3 bucket {0}: "
+                                      "{1}".format(self._s3_bucket_name, e))
 
-            # sleep for 1 minute
-            time.sleep(60)
+            # sleep until the next poll, or until we are shutdown
+            self._shutdown.wait(S3_POLL_INTERVAL)
 
+        self._stop_object_workers()
+        self._checkpoint.close()
+        self._shutdown.close()
@@ -0,0 +1,116 @@
+"""
+Streams the lines out of cb-event-forwarder files stored on S3. Object
+bodies are read a chunk at a time and split into lines as they arrive, so
+memory use doesn't depend on the size of the object. Compressed forwarder
+output (gzip, or lz4 frames if the lz4 module is installed) is
+decompressed on the fly.
+"""
+import zlib
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+from ingress.cbforwarder.line_reader import LineFramer, DEFAULT_BUFFER_SIZE
+
+GZIP_MAGIC = b'\x1f\x8b'
+LZ4_FRAME_MAGIC = b'\x04\x22\x4d\x18'
+
+
+class _Passthrough(object):
+    def decompress(self, data):
+        return data
+
+    def flush(self):
+        return b''
+
+
+class _GzipStream(object):
+    """
+    Incremental gzip decompression. Handles files made of several gzip
+    members one after the other, which is what appending to a .gz gives.
+    """
+
+    def __init__(self):
+        self._inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decompress(self, data):
+        output = list()
+        while data:
+            output.append(self._inflater.decompress(data))
+            data = self._inflater.unused_data
+            if data:
+                # start of the next member
+                self._inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        return b''.join(output)
+
+    def flush(self):
+        return self._inflater.flush()
+
+
+class _Lz4Stream(object):
+    def __init__(self):
+        self._decompressor = lz4_frame.LZ4FrameDecompressor()
+
+    def decompress(self, data):
+        output = list()
+        while data:
+            output.append(self._decompressor.decompress(data))
+            data = self._decompressor.unused_data
+            if data:
+                self._decompressor = lz4_frame.LZ4FrameDecompressor()
+        return b''.join(output)
+
+    def flush(self):
+        return b''
+
+
+def open_decompressor(key, first_chunk):
+    """
+    Pick a decompressor by looking at the start of the object, falling back
+    on the key's extension.
+    :param key: the S3 key of the object
+    :param first_chunk: the first bytes read from the object body
+    :return: object with decompress(data) and flush() methods
+    """
+    if first_chunk.startswith(GZIP_MAGIC) or key.endswith(".gz"):
+        return _GzipStream()
+
+    if first_chunk.startswith(LZ4_FRAME_MAGIC) or key.endswith(".lz4"):
+        if lz4_frame is None:
+            raise ValueError("{0} is lz4 compressed, but the lz4 module "
+                             "is not installed".format(key))
+        return _Lz4Stream()
+
+    return _Passthrough()
+
+
+def iter_object_lines(key, body, chunk_size=DEFAULT_BUFFER_SIZE):
+    """
+    Yield the lines of an S3 object as its body streams in.
+    :param key: the S3 key, used to spot compressed objects
+    :param body: file-like object body (botocore StreamingBody) with read()
+    :param chunk_size: bytes to read at a time
+    :return: generator of the non-blank lines, newlines stripped
+    """
+    framer = LineFramer()
+    decompressor = None
+
+    while True:
+        chunk = body.read(chunk_size)
+        if not chunk:
+            break
+        if decompressor is None:
+            decompressor = open_decompressor(key, chunk)
+
+        for line in framer.feed(decompressor.decompress(chunk)):
+            yield line
+
+    if decompressor is not None:
+        for line in framer.feed(decompressor.flush()):
+            yield line
+
+    remainder = framer.flush()
+    if remainder is not None:
+        yield remainder
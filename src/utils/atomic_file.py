@@ -0,0 +1,24 @@
+"""
+Helpers for state files that have to survive a crash intact.
+"""
+import os
+
+
+def atomic_write(path, data):
+    """
+    Replace the file at path with data. Readers (and a crash) see either
+    the old content or the new, never a mix.
+    """
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as temp_file:
+        temp_file.write(data)
+        temp_file.flush()
+        os.fsync(temp_file.fileno())
+    os.rename(temp_path, path)
+
+    # make the rename itself durable
+    dir_fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
@@ -0,0 +1,67 @@
+"""
+Stops calls to a server that keeps failing. After failure_threshold
+failures in a row the circuit opens and calls are refused outright for
+reset_timeout seconds. Then a single trial call is let through: if it
+works the circuit closes again, if not it stays open for another
+reset_timeout.
+"""
+import time
+from threading import Lock
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitBreaker(object):
+
+    def __init__(self, failure_threshold, reset_timeout):
+        """
+        :param failure_threshold: failures in a row that open the circuit,
+                                  0 to never open it
+        :param reset_timeout: seconds to stay open before a trial call
+        """
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._lock = Lock()
+
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0
+
+    @property
+    def state(self):
+        return self._state
+
+    def allow(self):
+        """
+        :return: True if a call may go ahead. Once the open circuit times
+                 out, True is returned to a single caller for the trial.
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and \
+                    time.time() - self._opened_at >= self._reset_timeout:
+                self._state = HALF_OPEN
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+
+    def failure(self):
+        """
+        :return: True if this failure opened the circuit
+        """
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or (
+                    self._state == CLOSED and self._failure_threshold and
+                    self._failures >= self._failure_threshold):
+                self._state = OPEN
+                self._opened_at = time.time()
+                return True
+            return False
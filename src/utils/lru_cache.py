@@ -0,0 +1,162 @@
+"""
+A thread safe, size bounded LRU cache with per entry expiry.
+"""
+import time
+from collections import OrderedDict
+from threading import Lock, Event
+
+from utils.metrics import Counter, Gauge
+
+# returned by get() when there is no (unexpired) entry
+MISSING = object()
+
+
+class _Load(object):
+    """
+    Tracks a load in progress so that concurrent callers asking for the
+    same key can wait for its result instead of loading it themselves.
+    """
+    def __init__(self):
+        self.done = Event()
+        self.value = None
+        self.error = None
+
+
+class LruCache(object):
+
+    def __init__(self, max_size, ttl=None):
+        """
+        :param max_size: max number of entries, the least recently used
+                         entry is evicted to make room. 0 disables caching.
+        :param ttl: default seconds an entry stays valid, None for forever
+        """
+        self._max_size = max_size
+        self._ttl = ttl
+        self._lock = Lock()
+        self._entries = OrderedDict()   # key -> (value, expires at)
+        self._loads = dict()            # key -> _Load in progress
+
+        self.hits = Counter("hits", "lookups answered from the cache")
+        self.misses = Counter("misses", "lookups not found in the cache")
+
+    def get(self, key, default=MISSING):
+        """
+        :return: the cached value, or default if absent or expired
+        """
+        with self._lock:
+            value = self._get_locked(key)
+        if value is MISSING:
+            self.misses.increment()
+            return default
+        self.hits.increment()
+        return value
+
+    def _get_locked(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return MISSING
+
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            return MISSING
+
+        # re-insert to mark it as the most recently used
+        self._entries[key] = entry
+        return value
+
+    def put(self, key, value, ttl=MISSING):
+        """
+        Add or replace an entry.
+        :param ttl: seconds this entry stays valid, defaults to the cache ttl
+        """
+        if self._max_size <= 0:
+            return
+        if ttl is MISSING:
+            ttl = self._ttl
+        expires_at = None if ttl is None else time.time() + ttl
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires_at)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def get_or_load(self, key, loader, ttl=MISSING, none_ttl=MISSING):
+        """
+        Return the cached value, or call loader(key) to fetch and cache it.
+        Concurrent callers for the same key share a single loader call.
+        Exceptions from the loader are raised to every waiting caller and
+        nothing is cached.
+        :param loader: function taking the key, returning the value
+        :param ttl: seconds a loaded value stays valid
+        :param none_ttl: seconds a loaded None (negative result) stays
+                         valid, defaults to ttl
+        """
+        with self._lock:
+            value = self._get_locked(key)
+            if value is not MISSING:
+                self.hits.increment()
+                return value
+
+            self.misses.increment()
+            load = self._loads.get(key)
+            owner = load is None
+            if owner:
+                load = _Load()
+                self._loads[key] = load
+
+        if not owner:
+            load.done.wait()
+            if load.error is not None:
+                raise load.error
+            return load.value
+
+        try:
+            load.value = loader(key)
+            if load.value is None and none_ttl is not MISSING:
+                self.put(key, None, none_ttl)
+            else:
+                self.put(key, load.value, ttl)
+            return load.value
+        except Exception as e:
+            load.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._loads[key]
+            load.done.set()
+
+    @property
+    def ttl(self):
+        return self._ttl
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def register_metrics(self, registry, cache):
+        """
+        Expose the entry count and hit/miss counters in a MetricsRegistry.
+        :param cache: name of the cache, for the 'cache' label
+        """
+        registry.register("cache_entries", Gauge(
+            "entries", "entries in the cache", self.__len__), cache=cache)
+        registry.register("cache_hits_total", self.hits, cache=cache)
+        registry.register("cache_misses_total", self.misses, cache=cache)
+
+    def stats(self):
+        """
+        :return: dict with the entry count and hit/miss counters
+        """
+        return {
+            "size": len(self._entries),
+            "hits": self.hits.value,
+            "misses": self.misses.value,
+        }
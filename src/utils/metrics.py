@@ -0,0 +1,298 @@
+"""
+Small, thread safe counters for keeping track of what the connector is
+doing. These are cheap enough to be updated for every event that passes
+through the system.
+
+A MetricsRegistry gathers them from the services for the metrics endpoint
+(see utils.metrics_server), in the Prometheus text format.
+"""
+from bisect import bisect_left
+from threading import Lock
+
+
+class Counter(object):
+    """
+    A monotonically increasing count.
+    """
+
+    def __init__(self, name, description=""):
+        self.name = name
+        self.description = description
+        self._lock = Lock()
+        self._value = 0
+
+    def increment(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+
+# default histogram buckets (in seconds), suitable for request latencies
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                           1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram(object):
+    """
+    Counts observations into fixed, cumulative buckets. Also tracks the
+    total count, sum and max so averages can be reported.
+    """
+
+    def __init__(self, name, description="", buckets=DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self._lock = Lock()
+        self._bucket_counts = [0] * (len(self.buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self._bucket_counts[index] += 1
+            self._count += 1
+            self._sum += value
+            if value > self._max:
+                self._max = value
+
+    def snapshot(self):
+        """
+        :return: dict with count, sum, avg, max and the cumulative bucket
+                 counts as a list of (upper bound, count) tuples. The last
+                 bucket has an upper bound of float('inf').
+        """
+        with self._lock:
+            counts = list(self._bucket_counts)
+            count, total, maximum = self._count, self._sum, self._max
+
+        cumulative = list()
+        running = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),),
+                                       counts):
+            running += bucket_count
+            cumulative.append((bound, running))
+
+        return {
+            "count": count,
+            "sum": total,
+            "avg": total / count if count else 0.0,
+            "max": maximum,
+            "buckets": cumulative,
+        }
+
+
+# histogram buckets for sizes, e.g. the number of assets in a post
+DEFAULT_SIZE_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+
+
+class Gauge(object):
+    """
+    A value that can go up and down. Either set it, or give it a function
+    that returns the current value. The function is only called when the
+    gauge is read, so exposing a length that is already tracked somewhere
+    (a queue, a cache) costs nothing until it is looked at.
+    """
+
+    def __init__(self, name, description="", function=None):
+        self.name = name
+        self.description = description
+        self._function = function
+        self._value = 0
+
+    def set(self, value):
+        self._value = value
+
+    @property
+    def value(self):
+        if self._function is not None:
+            return self._function()
+        return self._value
+
+
+# label value the children of a full MetricFamily are folded into
+OTHER_LABEL_VALUE = "other"
+
+
+class MetricFamily(object):
+    """
+    A metric split up by label values, e.g. events counted per type. The
+    child metric for a set of label values is created on first use.
+    """
+
+    def __init__(self, metric_class, name, description, label_names,
+                 max_children=None, **metric_options):
+        """
+        :param metric_class: Counter, Histogram or Gauge
+        :param label_names: tuple of label names
+        :param max_children: max number of label value sets, further ones
+                             are all counted under OTHER_LABEL_VALUE. None
+                             for no limit.
+        :param metric_options: passed along to the child metrics
+        """
+        self.metric_class = metric_class
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._max_children = max_children
+        self._metric_options = metric_options
+        self._lock = Lock()
+        self._children = dict()
+
+    def labels(self, *values):
+        """
+        :param values: one value per label name, in order
+        :return: the child metric for these label values
+        """
+        child = self._children.get(values)
+        if child is not None:
+            return child
+
+        if len(values) != len(self.label_names):
+            raise ValueError("{0} expects labels {1}".format(
+                self.name, self.label_names))
+        with self._lock:
+            if self._max_children is not None and \
+                    values not in self._children and \
+                    len(self._children) >= self._max_children:
+                values = (OTHER_LABEL_VALUE,) * len(self.label_names)
+            child = self._children.get(values)
+            if child is None:
+                child = self.metric_class(
+                    self.name, self.description, **self._metric_options)
+                self._children[values] = child
+        return child
+
+    def children(self):
+        """
+        :return: list of (label values, child metric) tuples
+        """
+        with self._lock:
+            return list(self._children.items())
+
+
+_TYPE_NAMES = {Counter: "counter", Histogram: "histogram", Gauge: "gauge"}
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, (int, long)):
+        return str(value)
+    value = float(value)
+    if value == float('inf'):
+        return "+Inf"
+    if value == float('-inf'):
+        return "-Inf"
+    return repr(value)
+
+
+def _escape_label_value(value):
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{0}="{1}"'.format(name, _escape_label_value(value))
+                          for name, value in labels) + "}"
+
+
+class MetricsRegistry(object):
+    """
+    Collects the metrics of the running services under exposition names,
+    and renders them in the Prometheus text format. Nothing is read from
+    the metrics until render() is called.
+    """
+
+    def __init__(self, namespace="fletch"):
+        """
+        :param namespace: prefix for every exposition name
+        """
+        self._namespace = namespace
+        self._lock = Lock()
+        # exposition name -> [type name, description, [(labels, metric)]]
+        self._families = dict()
+        self._order = list()
+
+    def register(self, name, metric, **labels):
+        """
+        Expose a metric. The same name can be registered several times with
+        different labels, e.g. once per channel, as long as the metrics are
+        of the same type.
+        :param name: exposition name, without the namespace
+        :param metric: a Counter, Histogram, Gauge or MetricFamily
+        :param labels: fixed labels for this metric
+        """
+        metric_class = metric.metric_class \
+            if isinstance(metric, MetricFamily) else type(metric)
+        type_name = _TYPE_NAMES[metric_class]
+        if self._namespace:
+            name = "{0}_{1}".format(self._namespace, name)
+
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = [type_name, metric.description, list()]
+                self._families[name] = family
+                self._order.append(name)
+            elif family[0] != type_name:
+                raise ValueError("{0} is already registered as a "
+                                 "{1}".format(name, family[0]))
+            family[2].append((sorted(labels.items()), metric))
+
+    def render(self):
+        """
+        :return: every registered metric in the Prometheus text format
+        """
+        with self._lock:
+            families = [(name, self._families[name][0],
+                         self._families[name][1],
+                         list(self._families[name][2]))
+                        for name in self._order]
+
+        lines = list()
+        for name, type_name, description, metrics in families:
+            if description:
+                lines.append("# HELP {0} {1}".format(
+                    name, description.replace('\\', '\\\\')
+                    .replace('\n', '\\n')))
+            lines.append("# TYPE {0} {1}".format(name, type_name))
+            for labels, metric in metrics:
+                if isinstance(metric, MetricFamily):
+                    for values, child in sorted(metric.children()):
+                        self._render_metric(
+                            lines, name, child,
+                            labels + list(zip(metric.label_names, values)))
+                else:
+                    self._render_metric(lines, name, metric, labels)
+        lines.append("")
+        return "\n".join(lines)
+
+    def _render_metric(self, lines, name, metric, labels):
+        if not isinstance(metric, Histogram):
+            try:
+                value = metric.value
+            except Exception:
+                # a gauge function failing shouldn't take the rest with it
+                return
+            lines.append("{0}{1} {2}".format(
+                name, _format_labels(labels), _format_value(value)))
+            return
+
+        snapshot = metric.snapshot()
+        for bound, count in snapshot["buckets"]:
+            lines.append("{0}_bucket{1} {2}".format(
+                name, _format_labels(labels + [("le", _format_value(bound))]),
+                count))
+        lines.append("{0}_sum{1} {2}".format(
+            name, _format_labels(labels), _format_value(snapshot["sum"])))
+        lines.append("{0}_count{1} {2}".format(
+            name, _format_labels(labels), snapshot["count"]))
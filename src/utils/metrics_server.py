@@ -0,0 +1,59 @@
+"""
+Serves a MetricsRegistry over HTTP, for Prometheus (or curl) to scrape:
+
+    GET /metrics
+
+The metrics are only read when a scrape comes in, and the server runs in
+a single daemon thread, so it costs next to nothing between scrapes.
+"""
+import logging
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# seconds a scraper gets to send its request, so a stuck one can't hold
+# up the next
+REQUEST_TIMEOUT = 10
+
+
+class MetricsServer(object):
+
+    def __init__(self, registry, port, address="127.0.0.1"):
+        """
+        Start serving right away.
+        :param registry: the MetricsRegistry to serve
+        :param port: port to listen on, 0 picks a free one
+        :param address: address to listen on
+        """
+        self.logger = logging.getLogger(__name__)
+
+        class _Handler(BaseHTTPRequestHandler):
+            timeout = REQUEST_TIMEOUT
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render()
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = HTTPServer((address, port), _Handler)
+        self.port = self._server.server_address[1]
+        self._thread = Thread(target=self._server.serve_forever,
+                              name="metrics_server")
+        self._thread.daemon = True
+        self._thread.start()
+        self.logger.info("Serving metrics on {0}:{1}/metrics".format(
+            address, self.port))
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,110 @@
+"""
+A bounded queue of work that failed and has to be tried again later.
+Items are keyed, and an item put under a key that is already queued is
+merged into it, so a long outage builds up one consolidated retry per key
+instead of a backlog of every failed attempt.
+
+The queue is retried as a whole: all items are taken at once when it is
+due, and whatever fails again is put back. The wait between attempts
+grows exponentially with full jitter, and starts over once an attempt
+goes through.
+"""
+import random
+import time
+from threading import Lock
+
+
+def backoff_delay(attempt, base, cap):
+    """
+    :param attempt: number of failed attempts so far, from 0
+    :param base: delay (seconds) for the first retry
+    :param cap: max delay in seconds
+    :return: a random delay between 0 and min(cap, base * 2 ** attempt)
+    """
+    return random.uniform(0, min(cap, base * 2 ** min(attempt, 32)))
+
+
+class RetryQueue(object):
+
+    def __init__(self, max_items, merge, backoff_base=5, backoff_max=300):
+        """
+        :param max_items: max number of keys queued, new keys are refused
+                          once full (merging into queued keys still works)
+        :param merge: function (queued item, new item) -> merged item
+        :param backoff_base: delay (seconds) for the first retry
+        :param backoff_max: max delay between retries in seconds
+        """
+        self._max_items = max_items
+        self._merge = merge
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._lock = Lock()
+
+        self._items = dict()
+        self._attempts = 0
+        self._due = None
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, key, item):
+        """
+        Queue an item for a retry, merged into the one already queued under
+        the same key.
+        :return: False if the queue is full and the item was dropped
+        """
+        with self._lock:
+            queued = self._items.get(key)
+            if queued is not None:
+                self._items[key] = self._merge(queued, item)
+                return True
+            if len(self._items) >= self._max_items:
+                return False
+
+            self._items[key] = item
+            if self._due is None:
+                self._due = time.time() + backoff_delay(
+                    self._attempts, self._backoff_base, self._backoff_max)
+            return True
+
+    def due_in(self):
+        """
+        :return: seconds until the next retry is due (0 if it is), None if
+                 nothing is queued
+        """
+        with self._lock:
+            if self._due is None:
+                return None
+            return max(0, self._due - time.time())
+
+    def take(self, force=False):
+        """
+        Empty the queue for a retry, if it is due.
+        :param force: take the items even if the retry isn't due yet
+        :return: dict of key -> item, empty if nothing is due
+        """
+        with self._lock:
+            if self._due is None or (not force and self._due > time.time()):
+                return dict()
+            items = self._items
+            self._items = dict()
+            self._due = None
+            return items
+
+    def failed(self):
+        """
+        Count a failed retry, the items put back after it wait longer.
+        """
+        with self._lock:
+            self._attempts += 1
+            if self._due is not None:
+                self._due = time.time() + backoff_delay(
+                    self._attempts, self._backoff_base, self._backoff_max)
+
+    def succeeded(self):
+        """
+        Count a retry that went through, the next one starts over with the
+        shortest delay.
+        """
+        with self._lock:
+            self._attempts = 0
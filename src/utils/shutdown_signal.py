@@ -0,0 +1,150 @@
+"""
+A shutdown flag that threads can sleep on. Setting it wakes every waiter
+right away, instead of each waiter noticing on its next polling interval.
+
+Under python 2, threading.Event.wait(timeout) is itself a polling loop
+(sleeping up to 50ms at a time), so this is built on a pipe instead: the
+waiters block in the kernel until the pipe becomes readable. The read end
+is never drained, once set it stays readable for everyone.
+
+Whoever owns a signal closes it once nothing waits on it anymore, to give
+back the pipe. A closed signal still works, the pipe is made again if a
+file descriptor is asked for.
+"""
+import os
+import select
+from threading import Lock
+
+
+class ShutdownSignal(object):
+
+    def __init__(self):
+        self._lock = Lock()
+        self._is_set = False
+        self._pipe = None
+
+    def _get_pipe(self):
+        # created on first use, most signals are only ever checked
+        with self._lock:
+            if self._pipe is None:
+                self._pipe = os.pipe()
+                if self._is_set:
+                    os.write(self._pipe[1], b'x')
+            return self._pipe
+
+    def set(self):
+        """
+        Set the signal, waking up all waiters.
+        """
+        with self._lock:
+            if self._is_set:
+                return
+            self._is_set = True
+            if self._pipe is not None:
+                os.write(self._pipe[1], b'x')
+
+    def is_set(self):
+        return self._is_set
+
+    def wait(self, timeout=None):
+        """
+        Sleep until the signal is set or the timeout passes.
+        :param timeout: in seconds, None to wait forever
+        :return: True if the signal is set
+        """
+        if self._is_set:
+            return True
+
+        poller = select.poll()
+        poller.register(self.fileno(), select.POLLIN)
+        try:
+            poller.poll(None if timeout is None else int(timeout * 1000))
+        except (select.error, IOError, OSError):
+            # interrupted by a signal, let the caller loop around
+            pass
+        return self._is_set
+
+    def fileno(self):
+        """
+        :return: a file descriptor that becomes readable once set, for
+                 use with select/poll/epoll
+        """
+        return self._get_pipe()[0]
+
+    def close(self):
+        """
+        Close the pipe, to be called once nothing waits on it anymore.
+        """
+        with self._lock:
+            _close_pipe(self._pipe)
+            self._pipe = None
+
+
+class WakeupSignal(object):
+    """
+    Like ShutdownSignal, but it can be cleared again. For waking up a loop
+    early, as many times as needed.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._is_set = False
+        self._pipe = os.pipe()
+
+    def set(self):
+        with self._lock:
+            if self._is_set:
+                return
+            self._is_set = True
+            if self._pipe is not None:
+                os.write(self._pipe[1], b'x')
+
+    def clear(self):
+        with self._lock:
+            if not self._is_set:
+                return
+            self._is_set = False
+            if self._pipe is not None:
+                os.read(self._pipe[0], 1)
+
+    def is_set(self):
+        return self._is_set
+
+    def fileno(self):
+        with self._lock:
+            if self._pipe is None:
+                self._pipe = os.pipe()
+                if self._is_set:
+                    os.write(self._pipe[1], b'x')
+            return self._pipe[0]
+
+    def close(self):
+        """
+        Close the pipe, to be called once nothing waits on it anymore.
+        """
+        with self._lock:
+            _close_pipe(self._pipe)
+            self._pipe = None
+
+
+def _close_pipe(pipe):
+    if pipe is not None:
+        os.close(pipe[0])
+        os.close(pipe[1])
+
+
+def wait_any(filenos, timeout=None):
+    """
+    Sleep until any of the file descriptors (e.g. of a ShutdownSignal or a
+    WakeupSignal) becomes readable, or the timeout passes.
+    :param filenos: file descriptors to wait on
+    :param timeout: in seconds, None to wait forever
+    """
+    poller = select.poll()
+    for fileno in filenos:
+        poller.register(fileno, select.POLLIN)
+    try:
+        poller.poll(None if timeout is None else int(timeout * 1000))
+    except (select.error, IOError, OSError):
+        # interrupted by a signal, let the caller loop around
+        pass
@@ -0,0 +1,37 @@
+"""
+A fixed set of locks picked by key, so that work on different keys can run
+in parallel while work on the same key is serialized, without keeping a
+lock around for every key ever seen.
+"""
+from threading import Lock
+
+
+class StripedLock(object):
+
+    def __init__(self, stripes, lock_type=Lock):
+        """
+        :param stripes: number of locks, keys are spread over them by hash
+        :param lock_type: factory for the individual locks
+        """
+        self._locks = [lock_type() for _ in range(max(stripes, 1))]
+
+    def __len__(self):
+        return len(self._locks)
+
+    def index(self, key):
+        """
+        :return: the stripe number the key maps to
+        """
+        return hash(key) % len(self._locks)
+
+    def lock(self, key):
+        """
+        :return: the lock guarding the key, use it as a context manager
+        """
+        return self._locks[self.index(key)]
+
+    def lock_at(self, index):
+        """
+        :return: the lock of a stripe by number, for walking all of them
+        """
+        return self._locks[index]
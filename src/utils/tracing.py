@@ -0,0 +1,208 @@
+"""
+Lightweight tracing of single events through the pipeline, to tell where
+the time goes between a forwarder line coming in and its data reaching
+BigFix:
+
+    listener -> switchboard -> CbEventHandler (Cb lookups, besid query)
+             -> EgressBigFix -> BigFixApi (cache, packaging interval, post)
+
+A sampled event carries a Trace along, and each stage marks it with a
+monotonic timestamp. Once the event is done with, the trace is finished:
+the time spent in each stage goes into the tracer's histograms, and a
+summary of the trace is logged if it took longer than the latency budget.
+
+Events that aren't sampled carry None instead of a Trace and cost nothing.
+"""
+import itertools
+import logging
+import os
+import random
+from threading import Lock
+
+from utils.metrics import Counter, Histogram, MetricFamily
+
+try:
+    from time import monotonic
+except ImportError:
+    import ctypes
+    import ctypes.util
+
+    class _Timespec(ctypes.Structure):
+        _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+    _CLOCK_MONOTONIC = 1
+    _librt = ctypes.CDLL(ctypes.util.find_library("rt") or
+                         ctypes.util.find_library("c"), use_errno=True)
+    _clock_gettime = _librt.clock_gettime
+    _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+
+    def monotonic():
+        """
+        :return: seconds from the monotonic clock, unaffected by changes
+                 of the system time
+        """
+        timespec = _Timespec()
+        if _clock_gettime(_CLOCK_MONOTONIC, ctypes.byref(timespec)) != 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        return timespec.tv_sec + timespec.tv_nsec * 1e-9
+
+# stage every trace starts with
+STAGE_RECEIVED = "received"
+
+# at most one slow trace summary is logged per this many seconds, the ones
+# in between are only counted
+SLOW_TRACE_LOG_INTERVAL = 1.0
+
+# histogram buckets (in seconds) for the trace and stage durations, the
+# packaging interval alone is minutes
+TRACE_LATENCY_BUCKETS = (0.001, 0.01, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0,
+                         120.0, 300.0, 600.0, 1800.0)
+
+
+class Trace(object):
+    """
+    The stage timestamps of one event. Stages are marked by whichever
+    thread has the event at the time, one after the other.
+    """
+
+    def __init__(self, tracer, trace_id, description):
+        self.trace_id = trace_id
+        self.description = description
+        self._tracer = tracer
+        self._finished = False
+        self.stages = [(STAGE_RECEIVED, monotonic())]
+
+    def mark(self, stage):
+        """
+        Record that the event has reached (finished) a stage.
+        """
+        self.stages.append((stage, monotonic()))
+
+    def elapsed(self):
+        """
+        :return: seconds between the first and the last stage
+        """
+        return self.stages[-1][1] - self.stages[0][1]
+
+    def finish(self, stage):
+        """
+        Mark the last stage and hand the trace to the tracer. Only the
+        first call counts, an event can fan out into several that share
+        the trace.
+        """
+        if self._finished:
+            return
+        self._finished = True
+        self.mark(stage)
+        self._tracer.finished(self)
+
+    def summary(self):
+        """
+        :return: one line with the time spent getting to each stage
+        """
+        steps = list()
+        previous = self.stages[0][1]
+        for stage, timestamp in self.stages[1:]:
+            steps.append("{0} +{1:.3f}s".format(stage, timestamp - previous))
+            previous = timestamp
+        return "trace {0} ({1}) took {2:.3f}s: {3}".format(
+            self.trace_id, self.description, self.elapsed(),
+            ", ".join(steps))
+
+
+class Tracer(object):
+
+    def __init__(self, sample_rate, latency_budget):
+        """
+        :param sample_rate: fraction of the events to trace, 0 to 1
+        :param latency_budget: seconds an event may take end to end before
+                               its trace summary is logged, 0 to log every
+                               trace
+        """
+        self.logger = logging.getLogger(__name__)
+        self._sample_rate = sample_rate
+        self._latency_budget = latency_budget
+        self._ids = itertools.count(1)
+
+        self._log_lock = Lock()
+        self._last_slow_log = None
+        self._slow_not_logged = 0
+
+        self.traces_finished = Counter(
+            "traces_finished", "sampled events traced to the end")
+        self.traces_slow = Counter(
+            "traces_slow", "traced events over the latency budget")
+        self.trace_latency = Histogram(
+            "trace_latency", "seconds a traced event took end to end",
+            TRACE_LATENCY_BUCKETS)
+        self.stage_latency = MetricFamily(
+            Histogram, "stage_latency",
+            "seconds traced events took to reach each stage from the one "
+            "before", ("stage",), buckets=TRACE_LATENCY_BUCKETS)
+
+    def start(self, description=""):
+        """
+        Start tracing an event, if it is sampled.
+        :param description: what the event is, for the summary
+        :return: a Trace, or None if the event isn't sampled
+        """
+        if self._sample_rate <= 0 or (self._sample_rate < 1 and
+                                      random.random() >= self._sample_rate):
+            return None
+        return Trace(self, next(self._ids), description)
+
+    def finished(self, trace):
+        """
+        Account for a finished trace, logging it if it was slow.
+        """
+        previous = trace.stages[0][1]
+        for stage, timestamp in trace.stages[1:]:
+            self.stage_latency.labels(stage).observe(timestamp - previous)
+            previous = timestamp
+
+        elapsed = trace.elapsed()
+        self.traces_finished.increment()
+        self.trace_latency.observe(elapsed)
+        if elapsed < self._latency_budget:
+            return
+
+        self.traces_slow.increment()
+        with self._log_lock:
+            now = trace.stages[-1][1]
+            if self._last_slow_log is not None and \
+                    now - self._last_slow_log < SLOW_TRACE_LOG_INTERVAL:
+                self._slow_not_logged += 1
+                return
+            self._last_slow_log = now
+            not_logged, self._slow_not_logged = self._slow_not_logged, 0
+
+        self.logger.warning("Slow event, {0}{1}".format(
+            trace.summary(),
+            " ({0} more slow traces not logged)".format(not_logged)
+            if not_logged else ""))
+
+    def register_metrics(self, registry):
+        """
+        Expose the trace counters and stage latencies in a MetricsRegistry.
+        """
+        registry.register("traces_finished_total", self.traces_finished)
+        registry.register("traces_slow_total", self.traces_slow)
+        registry.register("trace_latency_seconds", self.trace_latency)
+        registry.register("trace_stage_latency_seconds", self.stage_latency)
+
+
+def mark(trace, stage):
+    """
+    Mark a stage of a trace, if the event is traced at all.
+    """
+    if trace is not None:
+        trace.mark(stage)
+
+
+def finish(trace, stage):
+    """
+    Finish a trace, if the event is traced at all.
+    """
+    if trace is not None:
+        trace.finish(stage)
@@ -0,0 +1,98 @@
+"""
+Contention benchmark for the BigFix dashboard cache. Many writer threads
+merge events while a poster thread pulls the cache on an interval, once
+with a single lock around the whole cache (the old class wide RLock) and
+once with ShardedDashboardCache.
+
+Run from the root of the repository:
+    PYTHONPATH=src:. python -m test.t_bench.bench_cache_contention
+"""
+import argparse
+import sys
+import threading
+import time
+
+from comms.dashboard_cache import DashboardCache, ShardedDashboardCache
+
+
+class _SingleLockCache(object):
+    """
+    The old layout: one RLock held for merges and for the pull.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._cache = DashboardCache()
+
+    def merge(self, assets):
+        with self._lock:
+            self._cache.merge(assets)
+
+    def pull(self):
+        with self._lock:
+            temp_cache, self._cache = self._cache, DashboardCache()
+            return temp_cache.to_json()
+
+
+def _run(cache, writers, events_per_writer, cves, pull_interval):
+    """
+    :return: tuple of (merges/sec, worst merge wait in seconds, pulls)
+    """
+    stop = threading.Event()
+    worst_waits = [0.0] * writers
+    pulls = [0]
+
+    def writer(number):
+        worst = 0.0
+        for event in range(events_per_writer):
+            besid = number * 1000 + event % 50
+            asset = {"fqdn": "host", "besid": besid, "cves": [
+                {"id": event % cves, "risk": 5, "implicated": 0}]}
+            start = time.time()
+            cache.merge([asset])
+            worst = max(worst, time.time() - start)
+        worst_waits[number] = worst
+
+    def poster():
+        while not stop.wait(pull_interval):
+            cache.pull()
+            pulls[0] += 1
+
+    poster_thread = threading.Thread(target=poster)
+    poster_thread.start()
+    threads = [threading.Thread(target=writer, args=(number,))
+               for number in range(writers)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    stop.set()
+    poster_thread.join()
+    return writers * events_per_writer / elapsed, max(worst_waits), pulls[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--writers', type=int, default=32)
+    parser.add_argument('--events', type=int, default=20000,
+                        help="merges per writer thread")
+    parser.add_argument('--cves', type=int, default=300)
+    parser.add_argument('--pull-interval', type=float, default=0.05)
+    parser.add_argument('--shards', type=int, default=16)
+    args = parser.parse_args(argv)
+
+    print("{0:>14} {1:>14} {2:>16} {3:>6}".format(
+        "cache", "merges/sec", "worst wait (ms)", "pulls"))
+    for name, cache in [("single lock", _SingleLockCache()),
+                        ("sharded", ShardedDashboardCache(args.shards))]:
+        rate, worst, pulls = _run(cache, args.writers, args.events,
+                                  args.cves, args.pull_interval)
+        print("{0:>14} {1:>14.0f} {2:>16.2f} {3:>6}".format(
+            name, rate, worst * 1000, pulls))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""
+Throughput benchmark for reading the cb-event-forwarder stream.
+Compares the old one-byte-per-recv reader against SocketLineReader over a
+local TCP connection fed with recorded forwarder JSON.
+
+Run from the root of the repository:
+    PYTHONPATH=src:. python -m test.t_bench.bench_cb_event_listener
+
+Use --min-speedup to turn the run into a regression check, the process
+exits non-zero if the buffered reader falls under the given speedup.
+"""
+import argparse
+import socket
+import sys
+import time
+from threading import Thread
+
+from ingress.cbforwarder.line_reader import SocketLineReader
+
+from test.t_bench.forwarder_corpus import build_corpus
+
+
+def _legacy_read_lines(client_socket):
+    """
+    The original CbEventListener framing: recv(1) per character.
+    """
+    count = 0
+    connection_alive = True
+    while connection_alive:
+        json_string = list()
+        char = ''
+        while char != '\n' and connection_alive is True:
+            char = client_socket.recv(1)
+            if not char:
+                connection_alive = False
+            else:
+                json_string.append(char)
+        if "".join(json_string).strip():
+            count += 1
+    return count
+
+
+def _buffered_read_lines(client_socket):
+    count = 0
+    reader = SocketLineReader(client_socket)
+    while not reader.closed:
+        count += len(reader.read_lines())
+    return count
+
+
+def _run(read_function, payload):
+    """
+    Sends the payload over a local socket and times how long the read
+    function takes to consume all of it.
+    :return: tuple of (lines read, seconds taken)
+    """
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.bind(('127.0.0.1', 0))
+    server_socket.listen(1)
+    port = server_socket.getsockname()[1]
+
+    def sender():
+        s = socket.create_connection(('127.0.0.1', port))
+        try:
+            s.sendall(payload)
+        finally:
+            s.close()
+
+    Thread(target=sender, name="bench_sender").start()
+    client_socket, _ = server_socket.accept()
+    try:
+        start = time.time()
+        count = read_function(client_socket)
+        elapsed = time.time() - start
+    finally:
+        client_socket.close()
+        server_socket.close()
+    return count, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--lines', type=int, default=20000)
+    parser.add_argument('--min-speedup', type=float, default=None)
+    args = parser.parse_args(argv)
+
+    lines = build_corpus(args.lines)
+    payload = "\n".join(lines) + "\n"
+    print("Corpus: {0} lines, {1:.1f} MiB".format(
+        len(lines), len(payload) / (1024.0 * 1024.0)))
+
+    results = dict()
+    for name, function in [("recv(1) legacy", _legacy_read_lines),
+                           ("SocketLineReader", _buffered_read_lines)]:
+        count, elapsed = _run(function, payload)
+        if count != len(lines):
+            print("{0}: read {1} lines, expected {2}".format(
+                name, count, len(lines)))
+            return 2
+        results[name] = count / elapsed
+        print("{0:>18}: {1:>12.0f} lines/sec ({2:.3f}s)".format(
+            name, results[name], elapsed))
+
+    speedup = results["SocketLineReader"] / results["recv(1) legacy"]
+    print("Speedup: {0:.1f}x".format(speedup))
+
+    if args.min_speedup is not None and speedup < args.min_speedup:
+        print("FAIL: speedup below {0}x".format(args.min_speedup))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""
+Microbenchmark for merging events into the BigFix dashboard cache.
+Compares the original nested list scan merge against DashboardCache, over
+synthetic hosts that each carry many CVEs.
+
+Run from the root of the repository:
+    PYTHONPATH=src:. python -m test.t_bench.bench_dashboard_cache
+"""
+import argparse
+import random
+import sys
+import time
+
+from comms.dashboard_cache import DashboardCache
+
+
+def _legacy_merge(cache, json_data):
+    """
+    The original BigFixApi._cache_json_data merge.
+    """
+    for asset in json_data:
+        if asset['besid'] not in cache:
+            cache[asset['besid']] = asset
+        else:
+            cached_asset = cache[asset['besid']]
+            for cve in asset['cves']:
+                cve_found = False
+                for cached_cve in cached_asset['cves']:
+                    if cve['id'] == cached_cve['id']:
+                        cve_found = True
+                        if cve['implicated'] == 1:
+                            cached_cve['implicated'] = 1
+                if cve_found is False:
+                    cached_asset['cves'].append(cve)
+
+
+def _build_events(hosts, cves_per_host, events_per_host, seed=1):
+    """
+    :return: list of single asset 'assets' lists, as the connector caches
+             them, one CVE hit per event
+    """
+    rng = random.Random(seed)
+    events = list()
+    for _ in range(events_per_host):
+        for besid in range(hosts):
+            cve = rng.randrange(cves_per_host)
+            events.append([{
+                "fqdn": "host{0}".format(besid),
+                "besid": besid,
+                "cves": [{"id": "2016-{0}".format(cve), "risk": 5,
+                          "implicated": int(rng.random() < 0.1)}]}])
+    return events
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--hosts', type=int, default=200)
+    parser.add_argument('--cves', type=int, default=500,
+                        help="distinct CVEs per host")
+    parser.add_argument('--events', type=int, default=1000,
+                        help="events per host")
+    args = parser.parse_args(argv)
+
+    events = _build_events(args.hosts, args.cves, args.events)
+    print("{0} events over {1} hosts, up to {2} CVEs each".format(
+        len(events), args.hosts, args.cves))
+
+    start = time.time()
+    legacy = dict()
+    for event in _build_events(args.hosts, args.cves, args.events):
+        _legacy_merge(legacy, event)
+    legacy_elapsed = time.time() - start
+
+    start = time.time()
+    cache = DashboardCache()
+    for event in events:
+        cache.merge(event)
+    merge_elapsed = time.time() - start
+
+    start = time.time()
+    assets = cache.to_json()
+    flatten_elapsed = time.time() - start
+
+    legacy_cves = sum(len(asset['cves']) for asset in legacy.values())
+    if legacy_cves != cache.cve_count or len(assets) != len(legacy):
+        print("Mismatch: {0} vs {1} CVEs".format(legacy_cves,
+                                                 cache.cve_count))
+        return 2
+
+    print("{0:>16}: {1:>10.0f} events/sec".format(
+        "list scan", len(events) / legacy_elapsed))
+    print("{0:>16}: {1:>10.0f} events/sec".format(
+        "DashboardCache", len(events) / merge_elapsed))
+    print("Flattening {0} CVE records: {1:.3f}s".format(
+        cache.cve_count, flatten_elapsed))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""
+Benchmark for building the XML document of a dashboard post. Compares
+parsing and reserializing with ElementTree on every post against the
+precompiled DashboardPostTemplate, for a post of many assets.
+
+Run from the root of the repository:
+    PYTHONPATH=src:. python -m test.t_bench.bench_dashboard_post
+"""
+import argparse
+import json
+import sys
+import time
+import xml.etree.ElementTree as Et
+
+from comms.dashboard_xml import DashboardPostTemplate, gzip_body
+
+TEMPLATE_PATH = 'src/statics/bigfix_plugin_api_post_template.xml'
+
+
+def _build_assets(count, cves_per_asset):
+    return [{"fqdn": "host{0}.example.com".format(besid), "besid": besid,
+             "cves": [{"id": "CVE-2016-{0:04d}".format(cve), "risk": 7,
+                       "implicated": cve % 2}
+                      for cve in range(cves_per_asset)]}
+            for besid in range(count)]
+
+
+def _legacy_render(dashboard_xml, name, assets):
+    xml_result = Et.fromstring(dashboard_xml)
+    xml_result.find('DashboardData').find('Name').text = name
+    data_out = json.dumps({"name": name, "assets": assets})
+    xml_result.find('DashboardData').find('Value').text = data_out
+    return Et.tostring(xml_result)
+
+
+def _template_render(template, name, assets):
+    return template.render(name, json.dumps({"name": name, "assets": assets}))
+
+
+def _time(function, rounds):
+    start = time.time()
+    for _ in range(rounds):
+        result = function()
+    return (time.time() - start) / rounds, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--assets', type=int, default=10000)
+    parser.add_argument('--cves', type=int, default=5,
+                        help="CVEs per asset")
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    with open(TEMPLATE_PATH) as temp_open:
+        dashboard_xml = temp_open.read()
+    assets = _build_assets(args.assets, args.cves)
+    name = "20160720.175526.545.1 - Name"
+
+    legacy_time, legacy_xml = _time(
+        lambda: _legacy_render(dashboard_xml, name, assets), args.rounds)
+    template = DashboardPostTemplate(dashboard_xml)
+    template_time, template_xml = _time(
+        lambda: _template_render(template, name, assets), args.rounds)
+    if legacy_xml != template_xml:
+        print("Template output differs from ElementTree")
+        return 2
+    json_time, _ = _time(lambda: json.dumps(assets), args.rounds)
+    gzip_time, compressed = _time(lambda: gzip_body(template_xml),
+                                  args.rounds)
+
+    print("Post of {0} assets, {1:.1f} MiB".format(
+        args.assets, len(template_xml) / (1024.0 * 1024.0)))
+    print("{0:>22}: {1:>8.1f} ms".format("json.dumps alone", json_time * 1000))
+    print("{0:>22}: {1:>8.1f} ms".format("ElementTree", legacy_time * 1000))
+    print("{0:>22}: {1:>8.1f} ms".format("DashboardPostTemplate",
+                                         template_time * 1000))
+    print("{0:>22}: {1:>8.1f} ms, {2:.1f}x smaller".format(
+        "gzip", gzip_time * 1000,
+        len(template_xml) / float(len(compressed))))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
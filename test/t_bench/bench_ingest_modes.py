@@ -0,0 +1,112 @@
+"""
+Connections vs throughput benchmark for the CbEventListener ingest modes.
+Several local "forwarders" connect at once and push their share of the
+recorded corpus, for both the thread per connection and the selector mode.
+
+Run from the root of the repository:
+    PYTHONPATH=src:. python -m test.t_bench.bench_ingest_modes
+"""
+import argparse
+import socket
+import sys
+import threading
+import time
+
+from data.switchboard import Switchboard
+from ingress.cbforwarder.cb_event_listener import CbEventListener, \
+    INGEST_MODE_THREADS, INGEST_MODE_SELECTOR
+
+from test.t_bench.forwarder_corpus import build_corpus
+
+
+class _Section(object):
+    def __init__(self, **options):
+        self.__dict__.update(options)
+
+
+def _bench_config(port, ingest_mode):
+    listener_config = _Section(
+        listen_port=port, read_buffer_size=65536,
+        sb_incoming_cb_events="sb_incoming_cb_events",
+        ingest_mode=ingest_mode, flow_control_high_watermark=5000,
+        flow_control_low_watermark=1000)
+    return _Section(cb_event_listener=listener_config, event_prefilter=True,
+                    trace_sample_rate=0, trace_latency_budget=0)
+
+
+def _free_port():
+    probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+
+def _run(ingest_mode, connections, payloads, line_count):
+    """
+    :return: tuple of (seconds to ingest every line, peak thread count)
+    """
+    port = _free_port()
+    switchboard = Switchboard()
+    switchboard.channel("sb_incoming_cb_events").register_callback(
+        lambda message: None)
+    listener = CbEventListener(_bench_config(port, ingest_mode), switchboard)
+    time.sleep(0.2)
+
+    def sender(payload):
+        s = socket.create_connection(('127.0.0.1', port))
+        try:
+            s.sendall(payload)
+        finally:
+            s.close()
+
+    start = time.time()
+    for i in range(connections):
+        threading.Thread(target=sender, args=(payloads[i],),
+                         name="bench_forwarder").start()
+
+    # peak threads, not counting our own senders
+    peak_threads = 0
+    while True:
+        stats = listener._event_filter.stats()
+        if stats["skipped"] + stats["parsed"] >= line_count:
+            break
+        peak_threads = max(peak_threads, len(
+            [t for t in threading.enumerate()
+             if t.name != "bench_forwarder"]))
+        time.sleep(0.001)
+    elapsed = time.time() - start
+
+    listener.shutdown()
+    switchboard.shutdown()
+    switchboard.join(10)
+    return elapsed, peak_threads
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--lines', type=int, default=200000,
+                        help="lines sent in total, split over connections")
+    parser.add_argument('--connections', default="1,4,16,64",
+                        help="comma separated connection counts to run")
+    args = parser.parse_args(argv)
+
+    corpus = build_corpus(args.lines)
+    print("{0:>10} {1:>11} {2:>14} {3:>8}".format(
+        "mode", "connections", "lines/sec", "threads"))
+
+    for connections in [int(c) for c in args.connections.split(",")]:
+        share = len(corpus) // connections
+        payloads = ["\n".join(corpus[i * share:(i + 1) * share]) + "\n"
+                    for i in range(connections)]
+        line_count = share * connections
+
+        for mode in (INGEST_MODE_THREADS, INGEST_MODE_SELECTOR):
+            elapsed, threads = _run(mode, connections, payloads, line_count)
+            print("{0:>10} {1:>11} {2:>14.0f} {3:>8}".format(
+                mode, connections, line_count / elapsed, threads))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
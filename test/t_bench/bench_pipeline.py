@@ -0,0 +1,393 @@
+"""
+End-to-end replay benchmark of the whole connector pipeline.
+A recorded cb-event-forwarder JSON file (or a generated corpus) is fed
+into CbEventListener over TCP at a set rate, and goes all the way through
+CbEventHandler, EgressBigFix and BigFixApi. Cb Response and BigFix are
+played by local stand-ins (FakeCbResponse, FakeBigFixHttp), each with a
+configurable delay per request.
+
+Every hit in the replayed stream is moved to one of --hosts sensors, so
+that it can be recognized when it reaches BigFix: vulnerable app and
+implication hits by their host showing up in a dashboard post, banned
+file hits by their path showing up in a fixlet update. Reported are the
+ingest and end-to-end throughput, the p50/p99 latency from a line being
+sent to its data reaching BigFix, the peak thread count and the peak RSS.
+The stand-ins run in the same process, their threads are not counted.
+
+Run from the root of the repository:
+    PYTHONPATH=src:. python -m test.t_bench.bench_pipeline
+
+With --forwarder-log, lines are replayed from the file as recorded. The
+vulnerable app and implication watchlist names of the recording are
+given with --vuln-watchlist and --implication-watchlist.
+"""
+import argparse
+import json
+import logging
+import resource
+import socket
+import sys
+import threading
+import time
+
+import ingress.cbforwarder.cb_event_handler as cb_event_handler
+from comms.bigfix_api import BigFixApi, CACHE_POST_CHANNEL
+from data.switchboard import Switchboard
+from egress.bigfix import EgressBigFix
+from fletch_config import Config, CbEventListener as CbEventListenerConfig
+from ingress.cbforwarder.cb_event_handler import CbEventHandler
+from ingress.cbforwarder.cb_event_listener import CbEventListener, \
+    INGEST_MODE_THREADS, INGEST_MODE_SELECTOR
+
+from test.t_bench.forwarder_corpus import build_corpus
+from test.t_tools.fake_bigfix_http import FakeBigFixHttp
+from test.t_tools.fake_cb_response import FakeCbResponse
+
+SAMPLE_CONFIG = 'root/etc/cb/integrations/bigfix/connector.sample.config'
+
+# watchlist names used in test/t_ingress/data, which the generated corpus
+# is built from
+RECORDED_VULN_WATCHLIST = "BigFix Vulnerable Apps Watchlist"
+RECORDED_IMPLICATION_WATCHLIST = "BigFix Implication Watchlist"
+
+# threads of the benchmark itself and of the stand-ins
+_OWN_THREADS = ("bench_replay", "fake_bigfix_server", "fake_bigfix_request")
+
+KIND_DASHBOARD = "dashboard"
+KIND_FIXLET = "fixlet"
+
+
+def _free_port():
+    probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+class _Replay(object):
+    """
+    The lines to replay, with each hit moved to a bench sensor, and the
+    bookkeeping of which hits have reached BigFix.
+    """
+
+    def __init__(self, lines, args, fake_cb):
+        self.lines = list()
+        self.kinds = list()
+        self.counts = {"vulnerable": 0, "implication": 0, "banned": 0}
+        self._lock = threading.Lock()
+
+        # besid -> send times not yet seen in a dashboard post, path ->
+        # send time not yet seen in a fixlet update
+        self._pending_dashboard = dict()
+        self._pending_fixlet = dict()
+        self.latencies = {KIND_DASHBOARD: list(), KIND_FIXLET: list()}
+        self.last_delivery = None
+
+        for tag, line in enumerate(lines):
+            kind, key = None, None
+            if '.storage.hit.process' in line:
+                line, kind, key = self._rewrite(
+                    json.loads(line), tag, args, fake_cb)
+            self.lines.append(line)
+            self.kinds.append((kind, key))
+
+    def _rewrite(self, doc, tag, args, fake_cb):
+        sensor_id = 1 + tag % args.hosts
+
+        if doc['type'] == 'watchlist.storage.hit.process' and \
+                doc.get('watchlist_name') == args.vuln_watchlist:
+            doc['process_id'] = "bench-proc-{0}".format(tag)
+            fake_cb.register_vulnerable_process(doc['process_id'],
+                                                sensor_id)
+            self.counts["vulnerable"] += 1
+            return json.dumps(doc), KIND_DASHBOARD, sensor_id
+
+        if doc['type'] == 'watchlist.storage.hit.process' and \
+                doc.get('watchlist_name') == args.implication_watchlist:
+            unique_id = fake_cb.implicating_unique_id(sensor_id, tag)
+            doc['docs'][0]['unique_id'] = unique_id
+            doc['process_id'] = unique_id.rsplit('-', 1)[0]
+            self.counts["implication"] += 1
+            return json.dumps(doc), KIND_DASHBOARD, sensor_id
+
+        if doc['type'] == 'feed.storage.hit.process' and \
+                doc.get('feed_name') == args.banned_feed:
+            path = "c:\\bench\\{0}\\banned.exe".format(tag)
+            doc['sensor_id'] = sensor_id
+            doc['ioc_attr']['hit_field_md5'] = "{0:032x}".format(
+                tag % args.banned_md5s)
+            doc['ioc_attr']['hit_field_path'] = path
+            doc['docs'][0]['os_type'] = "windows"
+            self.counts["banned"] += 1
+            return json.dumps(doc), KIND_FIXLET, path
+
+        return json.dumps(doc), None, None
+
+    def sent(self, start, end, sent_at):
+        """
+        Record the send time of the hits in lines[start:end].
+        """
+        with self._lock:
+            for kind, key in self.kinds[start:end]:
+                if kind == KIND_DASHBOARD:
+                    self._pending_dashboard.setdefault(key, list()).append(
+                        sent_at)
+                elif kind == KIND_FIXLET:
+                    self._pending_fixlet[key] = sent_at
+
+    def delivered(self, dashboard_posts, fixlet_updates):
+        """
+        Match the BigFix requests seen so far against the pending hits.
+        A host's hits count as delivered with the first dashboard post of
+        that host after them.
+        """
+        with self._lock:
+            for posted_at, besids in dashboard_posts:
+                for besid in besids:
+                    for sent_at in self._pending_dashboard.pop(besid, ()):
+                        self.latencies[KIND_DASHBOARD].append(
+                            posted_at - sent_at)
+                        self.last_delivery = posted_at
+            for updated_at, paths in fixlet_updates:
+                for path in paths:
+                    sent_at = self._pending_fixlet.pop(path, None)
+                    if sent_at is not None:
+                        self.latencies[KIND_FIXLET].append(
+                            updated_at - sent_at)
+                        self.last_delivery = updated_at
+
+    def pending(self):
+        with self._lock:
+            return sum(len(sent) for sent in
+                       self._pending_dashboard.values()) + \
+                len(self._pending_fixlet)
+
+
+def _replay(replay, port, rate, done):
+    """
+    Send the lines over one forwarder connection, rate lines per second
+    (0 for as fast as possible), in small batches.
+    """
+    batch = max(1, rate // 100) if rate else 1000
+    connection = socket.create_connection(('127.0.0.1', port))
+    start_time = time.time()
+    try:
+        for start in range(0, len(replay.lines), batch):
+            end = min(start + batch, len(replay.lines))
+            if rate:
+                delay = start_time + float(start) / rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            replay.sent(start, end, time.time())
+            connection.sendall("".join(line + "\n"
+                                       for line in replay.lines[start:end]))
+    finally:
+        connection.close()
+        done.set()
+
+
+def _build_config(args, port, bigfix_url):
+    config = Config(args.config)
+    config.event_source = "cb-event-forwarder"
+    config.cb_event_listener = CbEventListenerConfig(args.config)
+    config.cb_event_listener.listen_port = port
+    config.cb_event_listener.ingest_mode = args.ingest_mode
+    config.vuln_watchlist_name = args.vuln_watchlist
+    config.integration_implication_watchlists = [args.implication_watchlist]
+    config.banned_file_feed = args.banned_feed
+    config.switchboard_workers = args.workers
+    config.trace_sample_rate = args.trace_sample_rate
+    config.trace_latency_budget = float('inf')
+
+    bigfix = config.ibm_bigfix
+    bigfix.url = bigfix_url
+    bigfix.protocol = 'http'
+    bigfix.ssl_verify = False
+    bigfix.cache_enabled = True
+    bigfix.packaging_interval = args.packaging_interval / 60.0
+    bigfix.dashboard_delta_posts = args.delta_posts
+    bigfix.dashboard_state_file = None
+    bigfix.cache_spool_dir = None
+    bigfix.fixlet_index_preload = False
+    bigfix.besid_cache_warmup = False
+    return config
+
+
+def _connector_threads():
+    return len([thread for thread in threading.enumerate()
+                if thread.name not in _OWN_THREADS])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--forwarder-log',
+                        help="recorded forwarder output, one JSON document "
+                             "per line. Default: a generated corpus")
+    parser.add_argument('--lines', type=int, default=100000,
+                        help="size of the generated corpus")
+    parser.add_argument('--hit-ratio', type=float, default=0.01,
+                        help="fraction of hits in the generated corpus")
+    parser.add_argument('--rate', type=int, default=20000,
+                        help="lines sent per second, 0 for no limit")
+    parser.add_argument('--hosts', type=int, default=1000,
+                        help="sensors the hits are spread over")
+    parser.add_argument('--banned-md5s', type=int, default=50,
+                        help="banned md5s the banned file hits are spread "
+                             "over")
+    parser.add_argument('--chain-depth', type=int, default=3,
+                        help="parents between an implicating process and "
+                             "the vulnerable one")
+    parser.add_argument('--cb-latency', type=float, default=0.02,
+                        help="seconds per Cb Response process lookup")
+    parser.add_argument('--bigfix-latency', type=float, default=0.05,
+                        help="seconds per BigFix request")
+    parser.add_argument('--packaging-interval', type=float, default=5,
+                        help="seconds between dashboard posts")
+    parser.add_argument('--drain-timeout', type=float, default=60,
+                        help="max seconds to wait for the hits to reach "
+                             "BigFix after the replay")
+    parser.add_argument('--workers', type=int, default=4,
+                        help="switchboard workers per channel")
+    parser.add_argument('--ingest-mode', default=INGEST_MODE_THREADS,
+                        choices=(INGEST_MODE_THREADS, INGEST_MODE_SELECTOR))
+    parser.add_argument('--delta-posts', action='store_true',
+                        help="only post dashboard changes, repeat hits of "
+                             "a host are then never posted")
+    parser.add_argument('--config', default=SAMPLE_CONFIG,
+                        help="connector config to start from")
+    parser.add_argument('--vuln-watchlist', default=RECORDED_VULN_WATCHLIST)
+    parser.add_argument('--implication-watchlist',
+                        default=RECORDED_IMPLICATION_WATCHLIST)
+    parser.add_argument('--banned-feed', default='cbbanning')
+    parser.add_argument('--trace-sample-rate', type=float, default=0,
+                        help="fraction of the hits to trace, the time "
+                             "spent per stage is then reported")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.ERROR)
+
+    if args.forwarder_log:
+        with open(args.forwarder_log) as log_file:
+            lines = [line.strip() for line in log_file if line.strip()]
+    else:
+        lines = build_corpus(args.lines, hit_ratio=args.hit_ratio)
+
+    # the stand-ins, and the pipeline wired up as in fletch.py
+    fake_cb = FakeCbResponse(latency=args.cb_latency,
+                             chain_depth=args.chain_depth)
+    fake_cb.install(cb_event_handler)
+    fake_bigfix = FakeBigFixHttp(latency=args.bigfix_latency)
+    replay = _Replay(lines, args, fake_cb)
+
+    port = _free_port()
+    config = _build_config(args, port, fake_bigfix.url)
+    switchboard = Switchboard(
+        workers=config.switchboard_workers,
+        max_queue_depth=config.switchboard_max_queue_depth,
+        backpressure=config.switchboard_backpressure)
+    bigfix_api = BigFixApi(config, switchboard)
+    listener = CbEventListener(config, switchboard)
+    handler = CbEventHandler(config, switchboard, bigfix_api)
+    EgressBigFix(config, switchboard, bigfix_api)
+    time.sleep(0.2)
+
+    done = threading.Event()
+    start = time.time()
+    threading.Thread(target=_replay, name="bench_replay",
+                     args=(replay, port, args.rate, done)).start()
+
+    # sample while the replay runs and until the hits are through
+    peak_threads = 0
+    replay_seconds = None
+    seen_posts, seen_updates = 0, 0
+    while True:
+        peak_threads = max(peak_threads, _connector_threads())
+        posts = fake_bigfix.dashboard_posts[seen_posts:]
+        updates = fake_bigfix.fixlet_updates[seen_updates:]
+        seen_posts += len(posts)
+        seen_updates += len(updates)
+        replay.delivered(posts, updates)
+
+        if replay_seconds is None and done.is_set():
+            replay_seconds = time.time() - start
+        if replay_seconds is not None and (
+                replay.pending() == 0 or
+                time.time() - start - replay_seconds > args.drain_timeout):
+            break
+        time.sleep(0.05)
+
+    listener.shutdown()
+    switchboard.shutdown(order=("sb_incoming_cb_events",
+                                config.sb_feed_hit_events,
+                                config.sb_banned_file_events,
+                                CACHE_POST_CHANNEL), timeout=30)
+    switchboard.join(30)
+    handler.shutdown()
+    handler.join(30)
+    bigfix_api.join(30)
+    fake_bigfix.shutdown()
+
+    filter_stats = listener._event_filter.stats()
+    delivered = sum(len(latencies)
+                    for latencies in replay.latencies.values())
+    end_to_end = (replay.last_delivery - start) if replay.last_delivery \
+        else None
+
+    print("Replayed {0} lines in {1:.1f} s, {2:.0f} lines/s ({3} parsed, "
+          "{4} skipped by the prefilter)".format(
+              len(replay.lines), replay_seconds,
+              len(replay.lines) / replay_seconds,
+              filter_stats["parsed"], filter_stats["skipped"]))
+    print("Hits: {0} vulnerable app, {1} implication, {2} banned file".format(
+        replay.counts["vulnerable"], replay.counts["implication"],
+        replay.counts["banned"]))
+    print("Reached BigFix: {0} hits{1}, {2} not within the drain "
+          "timeout".format(
+              delivered,
+              ", {0:.1f} hits/s end to end".format(delivered / end_to_end)
+              if end_to_end else "",
+              replay.pending()))
+    print("{0:>10} {1:>8} {2:>10} {3:>10} {4:>10}".format(
+        "latency", "count", "p50 (s)", "p99 (s)", "max (s)"))
+    for kind in (KIND_DASHBOARD, KIND_FIXLET):
+        ordered = sorted(replay.latencies[kind])
+        print("{0:>10} {1:>8} {2:>10.3f} {3:>10.3f} {4:>10.3f}".format(
+            kind, len(ordered), _percentile(ordered, 0.5),
+            _percentile(ordered, 0.99), ordered[-1] if ordered else 0.0))
+    print("Requests: {0} Cb Response lookups, {1} BigFix ({2} dashboard "
+          "posts, {3} fixlet updates)".format(
+              fake_cb.lookups, fake_bigfix.requests,
+              len(fake_bigfix.dashboard_posts),
+              len(fake_bigfix.fixlet_updates)))
+    print("Peak threads: {0}, peak RSS: {1:.1f} MiB".format(
+        peak_threads, _peak_rss_mb()))
+
+    stages = listener._tracer.stage_latency.children()
+    if stages:
+        print("Traced {0} hits, time to reach each stage:".format(
+            listener._tracer.traces_finished.value))
+        print("{0:>16} {1:>8} {2:>10} {3:>10}".format(
+            "stage", "count", "avg (s)", "max (s)"))
+        for (stage,), histogram in sorted(
+                stages, key=lambda item: -item[1].snapshot()["sum"]):
+            snapshot = histogram.snapshot()
+            print("{0:>16} {1:>8} {2:>10.3f} {3:>10.3f}".format(
+                stage, snapshot["count"], snapshot["avg"],
+                snapshot["max"]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
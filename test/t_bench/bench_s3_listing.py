@@ -0,0 +1,216 @@
+"""
+Listing cost benchmark for S3EventListener. Compares the old full bucket
+listing (filtered on last modified time) against the incremental
+list_objects_v2 StartAfter listing, as the bucket keeps growing.
+
+A local in-memory S3 stand-in is used so no AWS account is needed. It
+serves list_objects_v2 in pages of 1000 keys like the real thing, with an
+optional per page delay (--page-latency) standing in for the round trip.
+
+Run from the root of the repository:
+    PYTHONPATH=src:. python -m test.t_bench.bench_s3_listing
+"""
+import argparse
+import logging
+import sys
+import tempfile
+import time
+from collections import deque
+from threading import Lock
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from io import BytesIO
+
+from dateutil.tz import tzutc
+
+from ingress.cbforwarder.event_filter import EventTypeFilter
+from ingress.cbforwarder.s3_checkpoint import S3Checkpoint
+from ingress.cbforwarder.s3_event_listener import S3EventListener
+from utils.metrics import Counter
+from utils.shutdown_signal import ShutdownSignal
+from utils.tracing import Tracer
+
+PAGE_SIZE = 1000
+
+
+class _Paginator(object):
+    def __init__(self, client):
+        self._client = client
+
+    def paginate(self, **kwargs):
+        token = None
+        while True:
+            if token is not None:
+                kwargs["ContinuationToken"] = token
+            page = self._client.list_objects_v2(**kwargs)
+            yield page
+            if not page["IsTruncated"]:
+                return
+            token = page["NextContinuationToken"]
+
+
+class FakeS3Client(object):
+    """
+    Just enough of the boto3 S3 client for the listener. Keys are kept
+    sorted, as S3 returns them.
+    """
+
+    def __init__(self, page_latency=0.0):
+        self._page_latency = page_latency
+        self._keys = list()
+        self._objects = dict()
+        self.pages_listed = 0
+        self.keys_listed = 0
+
+    def put_object(self, Key, Body, LastModified):
+        self._keys.insert(bisect_right(self._keys, Key), Key)
+        self._objects[Key] = (Body, LastModified)
+
+    def get_paginator(self, operation):
+        assert operation == "list_objects_v2"
+        return _Paginator(self)
+
+    def list_objects_v2(self, Bucket, Prefix="", StartAfter="",
+                        ContinuationToken=None):
+        after = ContinuationToken or StartAfter
+        start = bisect_right(self._keys, after) if after else 0
+        keys = [k for k in self._keys[start:start + PAGE_SIZE]
+                if k.startswith(Prefix)]
+
+        self.pages_listed += 1
+        self.keys_listed += len(keys)
+        if self._page_latency:
+            time.sleep(self._page_latency)
+
+        truncated = start + PAGE_SIZE < len(self._keys)
+        return {
+            "Contents": [{"Key": k, "LastModified": self._objects[k][1]}
+                         for k in keys],
+            "IsTruncated": truncated,
+            "NextContinuationToken": keys[-1] if truncated else None,
+        }
+
+    def get_object(self, Bucket, Key):
+        return {"Body": BytesIO(self._objects[Key][0])}
+
+
+class _NullChannel(object):
+    def send(self, message):
+        pass
+
+
+def _make_listener(client):
+    """
+    Build a listener wired to the stand-in client, without the boto3
+    session or poll thread. Checkpoints go to a temp directory.
+    """
+    listener = S3EventListener.__new__(S3EventListener)
+    listener.logger = logging.getLogger("bench")
+    listener._s3 = client
+    listener._s3_bucket_name = "bench"
+    listener._key_prefix = ""
+    listener._shutdown = ShutdownSignal()
+    listener._event_filter = EventTypeFilter()
+    listener._incoming_chan = _NullChannel()
+    listener._last_modified = datetime(2001, 1, 1, tzinfo=tzutc())
+    listener._last_key = None
+    listener._checkpoint = S3Checkpoint(tempfile.mkdtemp())
+    listener._read_buffer_size = 65536
+    listener._progress_lock = Lock()
+    listener._in_progress = deque()
+    listener._object_failures = dict()
+    listener._tracer = Tracer(0, 0)
+    listener.objects_read = Counter("objects_read", "")
+    listener.objects_failed = Counter("objects_failed", "")
+    listener._start_object_workers(4)
+    return listener
+
+
+def _legacy_poll(client, last_modified):
+    """
+    The original poll: list the whole bucket and filter on the client.
+    """
+    newest = last_modified
+    for page in client.get_paginator("list_objects_v2").paginate(
+            Bucket="bench"):
+        for obj in page.get("Contents", []):
+            if obj["LastModified"] > last_modified:
+                newest = max(newest, obj["LastModified"])
+                client.get_object(Bucket="bench",
+                                  Key=obj["Key"])["Body"].read()
+    return newest
+
+
+def _fill(client, start, count, when):
+    for i in range(start, start + count):
+        when += timedelta(seconds=1)
+        client.put_object(
+            Key="event-forwarder.{0}".format(when.strftime(
+                "%Y-%m-%dT%H:%M:%S.{0:06d}".format(i))),
+            Body=b'{"type": "ingress.event.procstart"}\n',
+            LastModified=when)
+    return when
+
+
+def _run(poll, existing, new_per_poll, polls, page_latency):
+    client = FakeS3Client(page_latency)
+    when = _fill(client, 0, existing,
+                 datetime(2017, 1, 1, tzinfo=tzutc()))
+    state = poll(client, None)
+
+    client.pages_listed = client.keys_listed = 0
+    start = time.time()
+    for i in range(polls):
+        when = _fill(client, existing + i * new_per_poll, new_per_poll, when)
+        state = poll(client, state)
+    elapsed = time.time() - start
+
+    if isinstance(state, S3EventListener):
+        state._stop_object_workers()
+    return elapsed, client.pages_listed, client.keys_listed
+
+
+def _poll_legacy(client, state):
+    return _legacy_poll(client, state or datetime(2001, 1, 1,
+                                                   tzinfo=tzutc()))
+
+
+def _poll_incremental(client, state):
+    listener = state or _make_listener(client)
+    listener._poll_once()
+    return listener
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    arg_parser.add_argument("--existing", type=int, default=50000,
+                            help="objects already in the bucket")
+    arg_parser.add_argument("--new-per-poll", type=int, default=50,
+                            help="objects written between polls")
+    arg_parser.add_argument("--polls", type=int, default=10)
+    arg_parser.add_argument("--page-latency", type=float, default=0.02,
+                            help="seconds added per list_objects_v2 page")
+    args = arg_parser.parse_args(argv)
+
+    results = dict()
+    listed = dict()
+    for name, poll in (("full listing", _poll_legacy),
+                       ("incremental", _poll_incremental)):
+        elapsed, pages, keys = _run(poll, args.existing, args.new_per_poll,
+                                    args.polls, args.page_latency)
+        results[name] = elapsed
+        listed[name] = keys
+        print("{0:>13}: {1:8.3f}s  {2:7d} pages  {3:9d} keys listed  "
+              "({4:.1f} keys/poll)".format(name, elapsed, pages, keys,
+                                           float(keys) / args.polls))
+
+    # the incremental run also saves a checkpoint per object, which is
+    # most of its time when there is no listing latency to speak of
+    print("keys listed: {0:.0f}x fewer, speedup: {1:.1f}x".format(
+        float(listed["full listing"]) / max(listed["incremental"], 1),
+        results["full listing"] / max(results["incremental"], 1e-9)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
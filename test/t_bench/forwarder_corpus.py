@@ -0,0 +1,79 @@
+"""
+Builds a stream of cb-event-forwarder JSON lines for the benchmarks.
+The feed/watchlist hits come from the recorded documents in
+test/t_ingress/data, the remaining traffic is shaped like the raw sensor
+events (procstart, netconn, modload) that make up most of a real stream.
+"""
+import json
+import random
+
+RECORDED_HITS = [
+    "test/t_ingress/data/adobe_reader_9_3_4_nvd_hit.json",
+    "test/t_ingress/data/adobearm_implication_watchlist_hit.json",
+    "test/t_ingress/data/banned_file_message.json",
+    "test/t_ingress/data/java_7u79_vuln_watchlist_hit.json",
+    "test/t_ingress/data/reader_sl_feed_hit_with_nvd_vuln_parent.json",
+]
+
+
+def load_recorded_hits():
+    """
+    :return: the recorded forwarder documents as compact JSON lines
+    """
+    lines = list()
+    for path in RECORDED_HITS:
+        with open(path) as json_file:
+            lines.append(json.dumps(json.load(json_file)))
+    return lines
+
+
+def _sensor_event(event_type, sequence):
+    doc = {
+        "cb_server": "cbserver",
+        "computer_name": "WIN7-{0}".format(sequence % 200),
+        "event_type": event_type.split('.')[-1],
+        "md5": "332C581D5AAFC3AD4D4C4419EC9F22D4",
+        "pid": 4000 + sequence % 1000,
+        "process_guid": "0000000a-0000-12e8-01d2-0fc6b28a{0:04x}".format(
+            sequence % 65536),
+        "sensor_id": sequence % 200,
+        "timestamp": 1473995431.134 + sequence,
+        "type": event_type,
+    }
+    if event_type == "ingress.event.procstart":
+        doc["command_line"] = "\"C:\\\\Windows\\\\system32\\\\svchost.exe\"" \
+                              " -k netsvcs"
+        doc["path"] = "c:\\windows\\system32\\svchost.exe"
+        doc["parent_guid"] = "0000000a-0000-105c-01d2-0e9818b49780"
+    elif event_type == "ingress.event.netconn":
+        doc["domain"] = "update.example.com"
+        doc["ipv4"] = "10.0.{0}.{1}".format(sequence % 250, sequence % 100)
+        doc["port"] = 443
+        doc["protocol"] = 6
+        doc["direction"] = "outbound"
+    else:
+        doc["path"] = "c:\\windows\\system32\\kernel32.dll"
+    return json.dumps(doc)
+
+
+def build_corpus(line_count, hit_ratio=0.01, seed=1234):
+    """
+    Creates a mixed stream of forwarder lines.
+    :param line_count: number of lines to generate
+    :param hit_ratio: fraction of the lines that are feed/watchlist hits
+    :param seed: seed for the random mix, keeps runs comparable
+    :return: list of JSON lines (without newlines)
+    """
+    rand = random.Random(seed)
+    hits = load_recorded_hits()
+    raw_types = ["ingress.event.procstart",
+                 "ingress.event.netconn",
+                 "ingress.event.modload"]
+
+    lines = list()
+    for sequence in range(line_count):
+        if rand.random() < hit_ratio:
+            lines.append(hits[sequence % len(hits)])
+        else:
+            lines.append(_sensor_event(raw_types[sequence % 3], sequence))
+    return lines
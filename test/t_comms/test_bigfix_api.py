@@ -1,13 +1,19 @@
 from copy import deepcopy as deepcopy
+import shutil
+import tempfile
 from time import sleep
 from unittest import TestCase, main as unittest_main
 
+import requests
+
 import data.events as events
-from comms.bigfix_api import BigFixApi
+from comms.bigfix_api import BigFixApi, BigFixUnavailableError
 from data.switchboard import Switchboard
 from fletch_config import Config
 from test_config import mutate_to_test_config
 from t_tools.deep_compare import deep_compare as deep_compare
+from test.t_tools import fake_bigfix_server
+from utils.tracing import Tracer
 
 from test.test_config import test_config_file_path
 
@@ -22,11 +28,48 @@ class TestCommsBigFix(TestCase):
         _sb.shutdown()
 
 
+class TestCommsBesidLookup(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.test_config = mutate_to_test_config(
+            Config(test_config_file_path),
+            fake_bigfix_server_requests=2
+        )
+        cls._sb = Switchboard()
+        cls.bigfix = BigFixApi(cls.test_config, cls._sb)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._sb.shutdown()
+
+    def test_bulk_lookup_fills_cache(self):
+        fake_bigfix_server.sensor_besids = {'10': 3634135, '11': 3634136}
+        queries_before = fake_bigfix_server.query_count
+
+        # one query for all three sensors
+        result = self.bigfix.get_besids([10, 11, 12])
+        self.assertEqual(sorted(result),
+                         [('10', 3634135), ('11', 3634136)])
+        self.assertEqual(fake_bigfix_server.query_count, queries_before + 1)
+
+        # answers, including the unknown sensor, now come from the cache
+        self.assertEqual(self.bigfix.get_besid(10), 3634135)
+        self.assertEqual(self.bigfix.get_besid(11), 3634136)
+        self.assertEqual(self.bigfix.get_besid(12), None)
+        self.assertEqual(fake_bigfix_server.query_count, queries_before + 1)
+
+        # the query went through the session and got timed
+        latency = self.bigfix.request_latency_stats()['GET query']
+        self.assertTrue(latency['count'] >= 1)
+
+
 class TestCommsBigFixCache(TestCase):
 
     @classmethod
     def setUpClass(cls):
         cls.test_config = Config(test_config_file_path)
+        cls.test_config.ibm_bigfix.cache_spool_dir = None
         cls._sb = Switchboard()
         cls.bigfix = BigFixApi(cls.test_config, cls._sb)
 
@@ -68,6 +111,75 @@ class TestCommsBigFixCache(TestCase):
             result[computer1['besid']]['cves'][0]['implicated'] == 1
         )
 
+    def test_cache_full_triggers_post(self):
+        self.bigfix._packaging_max_cves = 2
+        self.addCleanup(setattr, self.bigfix, '_packaging_max_cves', 0)
+
+        computer1 = {"fqdn": "computer1", "besid": "456789", "cves": [
+            {"id": "2016-1000", "risk": 1, "implicated": 0}]}
+        self.bigfix._cache_json_data([computer1])
+        self.assertFalse(self.bigfix._flush_signal.is_set())
+
+        computer2 = deepcopy(computer1)
+        computer2['besid'] = "456790"
+        self.bigfix._cache_json_data([computer2])
+        self.assertTrue(self.bigfix._flush_signal.is_set())
+        self.bigfix._cache_pull_and_delete()
+
+
+class TestCommsBigFixSpool(TestCase):
+
+    def test_cache_survives_restart(self):
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_dir)
+        test_config = mutate_to_test_config(
+            Config(test_config_file_path),
+            fake_bigfix_server_enable=False,
+            bigfix_cache_enabled=True
+        )
+        test_config.ibm_bigfix.cache_spool_dir = spool_dir
+
+        computer1 = {"fqdn": "computer1", "besid": "456789", "cves": [
+            {"id": "2016-1000", "risk": 1, "implicated": 1}]}
+        _sb = Switchboard()
+        self.addCleanup(_sb.shutdown)
+        BigFixApi(test_config, _sb)._cache_json_data([computer1])
+
+        # a second connector on the same spool picks up the cached data
+        _sb2 = Switchboard()
+        self.addCleanup(_sb2.shutdown)
+        restarted = BigFixApi(test_config, _sb2)
+        self.assertEqual(restarted._cache_pull_and_delete(), [computer1])
+
+    def test_spool_fsynced_without_further_appends(self):
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_dir)
+        test_config = mutate_to_test_config(
+            Config(test_config_file_path),
+            fake_bigfix_server_enable=False,
+            bigfix_cache_enabled=True
+        )
+        test_config.ibm_bigfix.cache_spool_dir = spool_dir
+        test_config.ibm_bigfix.cache_spool_fsync_interval = 0.2
+
+        _sb = Switchboard()
+        self.addCleanup(_sb.shutdown)
+        bigfix = BigFixApi(test_config, _sb)
+
+        # the first append is fsync'd straight away, the second is left
+        # for the purging loop, well before the packaging interval
+        computer1 = {"fqdn": "computer1", "besid": "456789", "cves": [
+            {"id": "2016-1000", "risk": 1, "implicated": 1}]}
+        bigfix._cache_json_data([computer1])
+        computer1["besid"] = "456790"
+        bigfix._cache_json_data([computer1])
+        self.assertNotEqual(bigfix._spool.sync_due_in(), None)
+
+        for _ in range(40):
+            if bigfix._spool.sync_due_in() is None:
+                break
+            sleep(0.05)
+        self.assertEqual(bigfix._spool.sync_due_in(), None)
 
 class TestCommsDashboard(TestCase):
 
@@ -106,6 +218,55 @@ class TestCommsDashboard(TestCase):
         self.assertTrue(deep_compare(test_data, dashboard_data))
 
 
+class TestCommsDashboardDelta(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.test_config = mutate_to_test_config(
+            Config(test_config_file_path),
+            fake_bigfix_server_enable=False,
+            dashboard_delta_posts=True
+        )
+        cls._sb = Switchboard()
+        cls.bigfix = BigFixApi(cls.test_config, cls._sb)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._sb.shutdown()
+
+    def test_repeat_hits_are_not_posted(self):
+        posts = list()
+        self.bigfix.put_dashboard_data = \
+            lambda assets: posts.append(deepcopy(assets)) or True
+
+        def event(event_type):
+            test_event = event_type()
+            test_event.host.name = 'computer1'
+            test_event.host.bigfix_id = '456789'
+            test_event_hit = events.ThreatIntelHit()
+            test_event_hit.cve = '2016-1000'
+            test_event_hit.score = 1
+            test_event.threat_intel.hits.append(test_event_hit)
+            return test_event
+
+        self.bigfix.update_nvd_dashboard_data(
+            event(events.VulnerableAppEvent), bypass_cache=True)
+        self.bigfix.update_nvd_dashboard_data(
+            event(events.VulnerableAppEvent), bypass_cache=True)
+        self.assertEqual(len(posts), 1)
+
+        # becoming implicated is news to the dashboard, again only once
+        self.bigfix.update_nvd_dashboard_data(
+            event(events.ImplicatedAppEvent), bypass_cache=True)
+        self.bigfix.update_nvd_dashboard_data(
+            event(events.VulnerableAppEvent), bypass_cache=True)
+        self.assertEqual(len(posts), 2)
+        self.assertEqual(posts[1][0]['cves'][0]['implicated'], 1)
+
+        # a full reconcile posts it all again
+        self.assertEqual(self.bigfix._full_dashboard_state([]), posts[1])
+
+
 class TestBannedFileFixlets(TestCase):
 
     @classmethod
@@ -136,5 +297,206 @@ class TestBannedFileFixlets(TestCase):
         self.assertTrue(test_event.process.file_path in ban_data.actionscript)
 
 
+class TestBannedFileCoalescing(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.test_config = mutate_to_test_config(
+            Config(test_config_file_path),
+            fake_bigfix_server_enable=False,
+            fixlet_coalesce_window=60
+        )
+        cls._sb = Switchboard()
+        cls.bigfix = BigFixApi(cls.test_config, cls._sb)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._sb.shutdown()
+
+    def test_one_update_per_md5(self):
+        calls = list()
+        self.bigfix._get_remediation_fixlet_id = \
+            lambda md5: calls.append(('id', md5)) or 12
+        self.bigfix._get_remediation_fixlet = \
+            lambda md5, fixlet_id: calls.append(('get', md5)) or None
+        self.bigfix._put_remediation_fixlet = \
+            lambda xml, data, fixlet_id: calls.append(('put', data))
+
+        for path in ['C:\\Test\\One', 'C:\\Test\\Two', 'C:\\Test\\One']:
+            test_event = events.BannedFileEvent()
+            test_event.host.os_type = events.Host.OS_TYPE_WINDOWS
+            test_event.process.file_path = path
+            test_event.process.md5 = 'ABCDEF1234567890ABCDEF1234567890'
+            self.bigfix.process_banned_file_event(test_event)
+
+        # nothing is sent until the window closes
+        self.assertEqual(calls, [])
+        self.assertEqual(self.bigfix._flush_banned_file_events(), 1)
+
+        self.assertEqual([call[0] for call in calls], ['id', 'get', 'put'])
+        actionscript = calls[2][1].actionscript
+        self.assertEqual(actionscript.count('delete "C:\\Test\\One"'), 1)
+        self.assertEqual(actionscript.count('delete "C:\\Test\\Two"'), 1)
+
+
+class TestBannedFileFixletIndex(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.test_config = mutate_to_test_config(
+            Config(test_config_file_path),
+            fake_bigfix_server_enable=False
+        )
+        cls._sb = Switchboard()
+        cls.bigfix = BigFixApi(cls.test_config, cls._sb)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._sb.shutdown()
+
+    def _event(self, path):
+        test_event = events.BannedFileEvent()
+        test_event.host.os_type = events.Host.OS_TYPE_WINDOWS
+        test_event.process.file_path = path
+        test_event.process.md5 = '0123456789ABCDEF0123456789ABCDEF'
+        return test_event
+
+    def test_known_paths_skip_bigfix(self):
+        calls = list()
+        self.bigfix._get_remediation_fixlet_id = \
+            lambda md5: calls.append('id') or None
+        self.bigfix._get_remediation_fixlet = \
+            lambda md5, fixlet_id: calls.append('get') or None
+        self.bigfix._put_remediation_fixlet = \
+            lambda xml, data, fixlet_id: calls.append('put') or 34
+
+        # first sighting has to look for the fixlet, then creates it
+        self.bigfix.process_banned_file_event(self._event('C:\\Test\\One'))
+        self.assertEqual(calls, ['id', 'get', 'put'])
+
+        # a path the fixlet already deletes costs nothing
+        self.bigfix.process_banned_file_event(self._event('C:\\Test\\One'))
+        self.assertEqual(calls, ['id', 'get', 'put'])
+
+        # and a new one just the PUT
+        self.bigfix.process_banned_file_event(self._event('C:\\Test\\Two'))
+        self.assertEqual(calls, ['id', 'get', 'put', 'put'])
+        entry = self.bigfix._fixlet_index.get(self._event('').process.md5)
+        self.assertEqual(entry.fixlet_id, 34)
+        self.assertEqual(entry.paths,
+                         set(['C:\\Test\\One', 'C:\\Test\\Two']))
+
+
+
+class TestBigFixRetry(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.test_config = mutate_to_test_config(
+            Config(test_config_file_path),
+            fake_bigfix_server_enable=False
+        )
+        # keep the retry threads out of the way, retries are run by hand
+        cls.test_config.ibm_bigfix.retry_backoff_base = 600
+        cls.test_config.ibm_bigfix.retry_backoff_max = 600
+        cls.test_config.ibm_bigfix.circuit_breaker_threshold = 1
+        cls.test_config.ibm_bigfix.circuit_breaker_reset = 60
+        cls._sb = Switchboard()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._sb.shutdown()
+
+    def test_failed_posts_are_merged_and_retried(self):
+        bigfix = BigFixApi(self.test_config, self._sb)
+        posts = list()
+
+        def unavailable(assets):
+            raise BigFixUnavailableError("down")
+        bigfix.put_dashboard_data = unavailable
+
+        computer = {"fqdn": "computer1", "besid": "456789", "cves": [
+            {"id": "2016-1000", "risk": 1, "implicated": 0}]}
+        self.assertFalse(bigfix._post_dashboard_assets([computer]))
+        computer = {"fqdn": "computer1", "besid": "456789", "cves": [
+            {"id": "2016-1000", "risk": 1, "implicated": 1},
+            {"id": "2016-1001", "risk": 2, "implicated": 0}]}
+        self.assertFalse(bigfix._post_dashboard_assets([computer]))
+        self.assertEqual(len(bigfix._dashboard_retry), 1)
+
+        # one consolidated post once BigFix is back
+        bigfix.put_dashboard_data = lambda assets: posts.append(assets) or True
+        queued = bigfix._dashboard_retry.take(force=True)
+        bigfix._post_and_compact(queued.values(), None)
+        self.assertEqual(len(posts), 1)
+        self.assertEqual(sorted(posts[0][0]["cves"],
+                                key=lambda cve: cve["id"]),
+                         [{"id": "2016-1000", "risk": 1, "implicated": 1},
+                          {"id": "2016-1001", "risk": 2, "implicated": 0}])
+        self.assertEqual(len(bigfix._dashboard_retry), 0)
+
+    def test_rejected_posts_traced_as_rejected(self):
+        bigfix = BigFixApi(self.test_config, self._sb)
+
+        def unavailable(assets):
+            raise BigFixUnavailableError("down")
+        computer = {"fqdn": "computer1", "besid": "456789", "cves": [
+            {"id": "2016-1000", "risk": 1, "implicated": 0}]}
+
+        bigfix.put_dashboard_data = unavailable
+        self.assertEqual(bigfix._post_dashboard_outcome([computer]),
+                         "retry_queued")
+        bigfix._dashboard_retry.take(force=True)
+
+        # a post BigFix turned down isn't queued for a retry
+        bigfix.put_dashboard_data = lambda assets: False
+        event = events.VulnerableAppEvent()
+        event.host.name = "computer1"
+        event.host.bigfix_id = 456789
+        hit = events.ThreatIntelHit()
+        hit.cve = "2016-1000"
+        hit.score = 1
+        event.threat_intel.hits.append(hit)
+        event.trace = Tracer(1, float('inf')).start()
+        bigfix.update_nvd_dashboard_data(event, bypass_cache=True)
+        self.assertEqual(event.trace.stages[-1][0], "rejected")
+        self.assertEqual(len(bigfix._dashboard_retry), 0)
+
+    def test_failed_fixlet_updates_are_retried(self):
+        bigfix = BigFixApi(self.test_config, self._sb)
+        updates = list()
+
+        def unavailable(events_list):
+            raise requests.ConnectionError("down")
+        bigfix._update_banned_file_fixlet = unavailable
+
+        for path in ['C:\\Test\\One', 'C:\\Test\\Two']:
+            test_event = events.BannedFileEvent()
+            test_event.process.file_path = path
+            test_event.process.md5 = 'abcdef1234567890abcdef1234567890'
+            bigfix.process_banned_file_event(test_event)
+        self.assertEqual(len(bigfix._fixlet_retry), 1)
+
+        # both events go in one update once BigFix is back
+        bigfix._update_banned_file_fixlet = updates.append
+        self.assertEqual(bigfix._retry_banned_file_fixlets(force=True), 1)
+        self.assertEqual([len(events_list) for events_list in updates], [2])
+        self.assertEqual(len(bigfix._fixlet_retry), 0)
+
+    def test_circuit_breaker_holds_off_requests(self):
+        bigfix = BigFixApi(self.test_config, self._sb)
+        requests_sent = list()
+
+        def refused(*args, **kwargs):
+            requests_sent.append(args)
+            raise requests.ConnectionError("refused")
+        bigfix._session.request = refused
+
+        self.assertRaises(requests.ConnectionError,
+                          bigfix.get_besid, 1, bypass_cache=True)
+        self.assertRaises(BigFixUnavailableError,
+                          bigfix.get_besid, 1, bypass_cache=True)
+        self.assertEqual(len(requests_sent), 1)
+
 if __name__ == '__main__':
     unittest_main()
@@ -0,0 +1,70 @@
+from threading import Thread, Lock, Event
+from time import sleep
+from unittest import TestCase, main as unittest_main
+
+from comms.cb_request_executor import CbRequestExecutor, CbRequestTimeout, \
+    CbRequestRejected
+
+
+class TestCbRequestExecutor(TestCase):
+
+    def test_call_result_and_error(self):
+        executor = CbRequestExecutor(max_concurrent=2, timeout=5)
+        self.assertEqual(executor.call(lambda a, b=0: a + b, 1, b=2), 3)
+
+        def broken():
+            raise ValueError("nope")
+        self.assertRaises(ValueError, executor.call, broken)
+
+        metrics = executor.metrics()
+        self.assertEqual(metrics["errors"], 1)
+        self.assertEqual(metrics["request_latency"]["count"], 2)
+        self.assertEqual(metrics["queue_wait"]["count"], 2)
+
+        executor.shutdown()
+        executor.join(5)
+        self.assertRaises(CbRequestRejected, executor.call, lambda: 1)
+
+    def test_bounded_in_flight(self):
+        executor = CbRequestExecutor(max_concurrent=3, timeout=10)
+        lock = Lock()
+        state = {"in_flight": 0, "peak": 0}
+
+        def slow_lookup():
+            with lock:
+                state["in_flight"] += 1
+                state["peak"] = max(state["peak"], state["in_flight"])
+            sleep(0.02)
+            with lock:
+                state["in_flight"] -= 1
+
+        callers = [Thread(target=executor.call, args=(slow_lookup,))
+                   for _ in range(20)]
+        for caller in callers:
+            caller.start()
+        for caller in callers:
+            caller.join()
+
+        self.assertEqual(state["peak"], 3)
+        metrics = executor.metrics()
+        self.assertEqual(metrics["request_latency"]["count"], 20)
+        # everything past the first few had to queue for a slot
+        self.assertTrue(metrics["queue_wait"]["max"] > 0.02)
+        executor.shutdown()
+        executor.join(5)
+
+    def test_timeout(self):
+        executor = CbRequestExecutor(max_concurrent=1, timeout=0.1)
+        release = Event()
+
+        self.assertRaises(CbRequestTimeout, executor.call, release.wait)
+        self.assertEqual(executor.metrics()["timeouts"], 1)
+
+        release.set()
+        self.assertEqual(executor.call(lambda: "ok"), "ok")
+        executor.shutdown()
+        executor.join(5)
+
+
+if __name__ == '__main__':
+    unittest_main()
@@ -0,0 +1,153 @@
+import json
+from unittest import TestCase, main as unittest_main
+from threading import Thread
+
+from comms.dashboard_cache import DashboardCache, ShardedDashboardCache, \
+    split_assets
+
+
+def _asset(besid, *cves):
+    return {"fqdn": "computer{0}".format(besid), "besid": besid,
+            "cves": [{"id": cve_id, "risk": 1, "implicated": implicated}
+                     for cve_id, implicated in cves]}
+
+
+class TestDashboardCache(TestCase):
+
+    def test_merge_adds_new_cves(self):
+        cache = DashboardCache()
+        cache.merge([_asset(1, ("2016-1000", 0))])
+        cache.merge([_asset(1, ("2016-2000", 0)), _asset(2, ("2016-1000", 0))])
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.cve_count, 3)
+        assets = cache.to_json()
+        self.assertEqual(sorted(cve["id"] for cve in assets[1]["cves"]),
+                         ["2016-1000", "2016-2000"])
+        self.assertEqual(assets[2]["fqdn"], "computer2")
+
+    def test_implicated_is_never_downgraded(self):
+        cache = DashboardCache()
+        cache.merge([_asset(1, ("2016-1000", 0), ("2016-2000", 1))])
+        cache.merge([_asset(1, ("2016-1000", 1), ("2016-2000", 0))])
+
+        cves = dict((cve["id"], cve["implicated"])
+                    for cve in cache.to_json()[1]["cves"])
+        self.assertEqual(cves, {"2016-1000": 1, "2016-2000": 1})
+        self.assertEqual(cache.cve_count, 2)
+
+    def test_merge_returns_changes(self):
+        cache = DashboardCache()
+        self.assertEqual(cache.merge([_asset(1, ("2016-1000", 0))]),
+                         [_asset(1, ("2016-1000", 0))])
+        self.assertEqual(cache.merge([_asset(1, ("2016-1000", 0))]), [])
+        self.assertEqual(
+            cache.merge([_asset(1, ("2016-1000", 1), ("2016-2000", 0))]),
+            [_asset(1, ("2016-1000", 1), ("2016-2000", 0))])
+        self.assertEqual(cache.merge([_asset(1, ("2016-1000", 1))]), [])
+
+    def test_input_is_not_aliased(self):
+        cache = DashboardCache()
+        asset = _asset(1, ("2016-1000", 0))
+        cache.merge([asset])
+        cache.merge([_asset(1, ("2016-1000", 1))])
+        self.assertEqual(asset["cves"][0]["implicated"], 0)
+
+    def test_approx_bytes_tracks_serialized_size(self):
+        cache = DashboardCache()
+        assets = [_asset(besid, *[("2016-{0}".format(cve), 0)
+                                  for cve in range(20)])
+                  for besid in range(10)]
+        cache.merge(assets)
+        actual = len(json.dumps(list(cache.to_json().values())))
+        self.assertTrue(0.8 < float(cache.approx_bytes) / actual < 1.2)
+
+
+class TestSplitAssets(TestCase):
+
+    def test_split_by_count(self):
+        assets = [_asset(1, ("a", 0), ("b", 0), ("c", 0)),
+                  _asset(2, ("a", 0))]
+        chunks = split_assets(assets, max_cves=2)
+        self.assertEqual(chunks, [
+            [_asset(1, ("a", 0), ("b", 0))],
+            [_asset(1, ("c", 0)), _asset(2, ("a", 0))],
+        ])
+        self.assertEqual(split_assets(assets), [assets])
+        self.assertEqual(split_assets([]), [])
+
+    def test_split_by_size(self):
+        assets = [_asset(besid, *[("2016-{0}".format(cve), 0)
+                                  for cve in range(50)])
+                  for besid in range(20)]
+        chunks = split_assets(assets, max_bytes=4096)
+        self.assertTrue(len(chunks) > 1)
+        for chunk in chunks:
+            self.assertTrue(len(json.dumps(chunk)) < 4096 * 1.2)
+        self.assertEqual(sum(len(asset["cves"]) for chunk in chunks
+                             for asset in chunk), 1000)
+
+
+class TestShardedDashboardCache(TestCase):
+
+    def test_concurrent_merges_and_pulls(self):
+        cache = ShardedDashboardCache(4)
+        pulled = dict()
+
+        def writer(besid):
+            for cve in range(100):
+                cache.merge([_asset(besid, ("2016-{0}".format(cve), 0))])
+
+        threads = [Thread(target=writer, args=(besid,))
+                   for besid in range(8)]
+        for thread in threads:
+            thread.start()
+        for _ in range(5):
+            for besid, asset in cache.pull().items():
+                pulled.setdefault(besid, set()).update(
+                    cve["id"] for cve in asset["cves"])
+        for thread in threads:
+            thread.join()
+        for besid, asset in cache.pull().items():
+            pulled.setdefault(besid, set()).update(
+                cve["id"] for cve in asset["cves"])
+
+        # nothing lost across the pulls
+        self.assertEqual(sorted(pulled), list(range(8)))
+        for cves in pulled.values():
+            self.assertEqual(len(cves), 100)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.cve_count, 0)
+
+    def test_traces_pulled_with_their_data(self):
+        cache = ShardedDashboardCache(4)
+        pulls = list()
+
+        def writer(besid):
+            for cve in range(100):
+                cve_id = "2016-{0}".format(cve)
+                cache.merge([_asset(besid, (cve_id, 0))],
+                            trace=(besid, cve_id))
+
+        threads = [Thread(target=writer, args=(besid,))
+                   for besid in range(8)]
+        for thread in threads:
+            thread.start()
+        for _ in range(5):
+            pulls.append(cache.pull_with_traces())
+        for thread in threads:
+            thread.join()
+        pulls.append(cache.pull_with_traces())
+
+        # every trace comes out of the same pull as its event's data
+        traced = list()
+        for assets, traces in pulls:
+            for besid, cve_id in traces:
+                self.assertTrue(cve_id in [cve["id"] for cve
+                                           in assets[besid]["cves"]])
+            traced.extend(traces)
+        self.assertEqual(len(traced), 800)
+
+
+if __name__ == '__main__':
+    unittest_main()
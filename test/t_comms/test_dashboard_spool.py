@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main as unittest_main
+
+from comms.dashboard_spool import DashboardSpool
+
+
+def _asset(besid, cve_id, implicated=0):
+    return {"fqdn": "computer{0}".format(besid), "besid": besid,
+            "cves": [{"id": cve_id, "risk": 5, "implicated": implicated}]}
+
+
+class TestDashboardSpool(TestCase):
+
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spool_dir)
+
+    def test_replay_after_restart(self):
+        spool = DashboardSpool(self.spool_dir, fsync_interval=0)
+        spool.append([_asset(1, "2016-1000")])
+        spool.append([_asset(2, "2016-2000", 1)])
+        # no close, as if the process died
+
+        restarted = DashboardSpool(self.spool_dir)
+        self.assertEqual(restarted.replay(),
+                         [_asset(1, "2016-1000"), _asset(2, "2016-2000", 1)])
+
+        # new appends go to a new segment, not replayed by this run
+        restarted.append([_asset(3, "2016-3000")])
+        self.assertEqual(len(restarted.replay()), 2)
+
+    def test_compact_after_post(self):
+        spool = DashboardSpool(self.spool_dir)
+        spool.append([_asset(1, "2016-1000")])
+        posted = spool.rotate()
+        spool.append([_asset(2, "2016-2000")])
+
+        # the post went through, only what came in after the pull is kept
+        spool.compact(posted)
+        spool.close()
+        self.assertEqual(DashboardSpool(self.spool_dir).replay(),
+                         [_asset(2, "2016-2000")])
+
+    def test_sync_due(self):
+        spool = DashboardSpool(self.spool_dir, fsync_interval=60)
+        self.assertEqual(spool.sync_due_in(), None)
+
+        # the first append is fsync'd right away, the next one waits
+        self.assertFalse(spool.append([_asset(1, "2016-1000")]))
+        self.assertEqual(spool.sync_due_in(), None)
+        self.assertTrue(spool.append([_asset(2, "2016-2000")]))
+        self.assertFalse(spool.append([_asset(3, "2016-3000")]))
+        self.assertTrue(0 < spool.sync_due_in() <= 60)
+
+        spool.sync()
+        self.assertEqual(spool.sync_due_in(), None)
+        spool.close()
+
+    def test_damaged_line_skipped(self):
+        spool = DashboardSpool(self.spool_dir)
+        spool.append([_asset(1, "2016-1000")])
+        spool.close()
+        segment = os.path.join(self.spool_dir, os.listdir(self.spool_dir)[0])
+        with open(segment, "a") as segment_file:
+            segment_file.write('{"fqdn": "comp')
+
+        self.assertEqual(DashboardSpool(self.spool_dir).replay(),
+                         [_asset(1, "2016-1000")])
+
+
+if __name__ == '__main__':
+    unittest_main()
@@ -0,0 +1,59 @@
+import gzip
+import json
+import xml.etree.ElementTree as Et
+from io import BytesIO
+from unittest import TestCase, main as unittest_main
+
+from comms.dashboard_xml import DashboardPostTemplate, gzip_body
+
+TEMPLATE_PATH = 'src/statics/bigfix_plugin_api_post_template.xml'
+
+
+def _element_tree_render(dashboard_xml, name, value):
+    """
+    How put_dashboard_data used to build the document.
+    """
+    xml_result = Et.fromstring(dashboard_xml)
+    xml_result.find('DashboardData').find('Name').text = name
+    xml_result.find('DashboardData').find('Value').text = value
+    return Et.tostring(xml_result)
+
+
+class TestDashboardPostTemplate(TestCase):
+
+    def setUp(self):
+        with open(TEMPLATE_PATH) as temp_open:
+            self.dashboard_xml = temp_open.read()
+
+    def test_same_as_element_tree(self):
+        value = json.dumps({"assets": [
+            {"fqdn": "R&D <lab>", "besid": 1, "cves": []}]})
+        name = u"20160720.175526.545.1 - N\u00e4me"
+
+        template = DashboardPostTemplate(self.dashboard_xml)
+        self.assertEqual(template.render(name, value),
+                         _element_tree_render(self.dashboard_xml, name, value))
+
+    def test_from_dashboard_get(self):
+        # the dashboard GET answer already has a name and value filled in
+        fetched = _element_tree_render(self.dashboard_xml, "old name",
+                                       json.dumps({"assets": []}))
+        template = DashboardPostTemplate(fetched)
+        rendered = template.render("new name", "[1, 2]")
+
+        xml_result = Et.fromstring(rendered)
+        self.assertEqual(xml_result.find('DashboardData').find('Name').text,
+                         "new name")
+        self.assertEqual(xml_result.find('DashboardData').find('Value').text,
+                         "[1, 2]")
+
+    def test_gzip_body(self):
+        data = b"<BESAPI>" + b"x" * 10000 + b"</BESAPI>"
+        compressed = gzip_body(data)
+        self.assertTrue(len(compressed) < len(data))
+        self.assertEqual(
+            gzip.GzipFile(fileobj=BytesIO(compressed)).read(), data)
+
+
+if __name__ == '__main__':
+    unittest_main()
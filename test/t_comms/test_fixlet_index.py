@@ -0,0 +1,43 @@
+from unittest import TestCase, main as unittest_main
+
+from comms.bigfix_api import BannedFileFixletData
+from comms.fixlet_index import FixletIndex, fixlet_paths
+
+ACTIONSCRIPT = """
+            if {(exists file "a.exe" whose (md5 of it as lowercase = "ab" as lowercase) of folders "C:\\Test")}
+                    delete "C:\\Test\\a.exe"
+            endif
+
+            if {(exists file "b.exe" whose (md5 of it as lowercase = "ab" as lowercase) of folders "C:\\Other")}
+                    delete "C:\\Other\\b.exe"
+            endif
+            """
+
+
+class TestFixletIndex(TestCase):
+
+    def test_paths_from_actionscript(self):
+        self.assertEqual(fixlet_paths(ACTIONSCRIPT),
+                         set(["C:\\Test\\a.exe", "C:\\Other\\b.exe"]))
+        self.assertEqual(fixlet_paths(None), set())
+
+    def test_put_get_discard(self):
+        index = FixletIndex()
+        index.put("ABCD", 12, BannedFileFixletData(
+            "ABCD", actionscript=ACTIONSCRIPT))
+
+        entry = index.get("abcd")
+        self.assertEqual(entry.fixlet_id, 12)
+        self.assertTrue("C:\\Test\\a.exe" in entry.paths)
+
+        # loading doesn't clobber what updates have put in
+        index.put("abcd", 99, BannedFileFixletData("abcd"), replace=False)
+        self.assertEqual(index.get("ABCD").fixlet_id, 12)
+
+        index.discard("Abcd")
+        self.assertEqual(index.get("abcd"), None)
+        self.assertEqual(len(index), 0)
+
+
+if __name__ == '__main__':
+    unittest_main()
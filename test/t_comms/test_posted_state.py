@@ -0,0 +1,91 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main as unittest_main
+
+from comms.posted_state import DashboardPostedState
+
+
+def _asset(besid, *cves):
+    return {"fqdn": "computer{0}".format(besid), "besid": besid,
+            "cves": [{"id": cve_id, "risk": 5, "implicated": implicated}
+                     for cve_id, implicated in cves]}
+
+
+class TestDashboardPostedState(TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.state_dir)
+        self.path = os.path.join(self.state_dir, "dashboard-posted")
+
+    def test_delta_only_new_and_upgraded(self):
+        state = DashboardPostedState(self.path)
+        state.record([_asset(1, ("2016-1000", 0), ("2016-2000", 1))])
+
+        delta = state.delta([
+            _asset(1, ("2016-1000", 0), ("2016-2000", 0)),
+            _asset(1, ("2016-1000", 1), ("2016-3000", 0)),
+            _asset(2, ("2016-1000", 0)),
+        ])
+        self.assertEqual(delta, [
+            _asset(1, ("2016-1000", 1), ("2016-3000", 0)),
+            _asset(2, ("2016-1000", 0)),
+        ])
+
+    def test_state_survives_restart(self):
+        state = DashboardPostedState(self.path)
+        state.record([_asset(1, ("2016-1000", 1))])
+
+        restarted = DashboardPostedState(self.path)
+        self.assertTrue(restarted.load())
+        self.assertEqual(restarted.delta([_asset(1, ("2016-1000", 1))]), [])
+        self.assertEqual(restarted.to_json(), [_asset(1, ("2016-1000", 1))])
+
+    def test_record_only_journals_changes(self):
+        state = DashboardPostedState(self.path)
+        state.record([_asset(1, ("2016-1000", 0), ("2016-2000", 1))])
+        state.record([_asset(1, ("2016-1000", 0), ("2016-2000", 1))])
+        state.record([_asset(1, ("2016-1000", 1))])
+
+        self.assertFalse(os.path.exists(self.path))
+        with open(self.path + ".journal") as journal_file:
+            self.assertEqual(len(journal_file.readlines()), 2)
+
+        state.compact(force=True)
+        with open(self.path + ".journal") as journal_file:
+            self.assertEqual(journal_file.read(), "")
+
+        restarted = DashboardPostedState(self.path)
+        self.assertTrue(restarted.load())
+        self.assertEqual(
+            restarted.delta([_asset(1, ("2016-1000", 1), ("2016-2000", 1))]),
+            [])
+
+    def test_old_assets_dropped(self):
+        stale = _asset(1, ("2016-1000", 1))
+        stale["seen"] = 0
+        with open(self.path, "w") as state_file:
+            json.dump({"assets": [stale]}, state_file)
+
+        state = DashboardPostedState(self.path, max_age=86400)
+        self.assertTrue(state.load())
+        state.record([_asset(2, ("2016-1000", 1))])
+        state.compact()
+        self.assertEqual(state.to_json(), [_asset(2, ("2016-1000", 1))])
+
+        restarted = DashboardPostedState(self.path)
+        restarted.load()
+        self.assertEqual(restarted.to_json(), [_asset(2, ("2016-1000", 1))])
+
+    def test_missing_or_bad_file(self):
+        self.assertFalse(DashboardPostedState(self.path).load())
+        with open(self.path, "w") as state_file:
+            state_file.write("{not json")
+        self.assertFalse(DashboardPostedState(self.path).load())
+        self.assertFalse(DashboardPostedState(None).load())
+
+
+if __name__ == '__main__':
+    unittest_main()
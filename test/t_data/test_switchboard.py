@@ -1,7 +1,11 @@
 from unittest import TestCase, main as unittest_main
 from data.switchboard import Switchboard, Channel
+from data.switchboard import BACKPRESSURE_DROP_NEWEST, \
+    BACKPRESSURE_DROP_OLDEST, BACKPRESSURE_BLOCK
 from random import randint
-from time import sleep
+import os
+from threading import Event, Thread, active_count
+from time import sleep, time
 
 
 class TestSwitchboard(TestCase):
@@ -16,6 +20,70 @@ class TestSwitchboard(TestCase):
 
         sb.shutdown()
 
+    def test_shutdown_join_drains(self):
+        """
+        Shutdown must not wait on polling intervals, and join has to wait
+        for the messages already queued to be delivered.
+        """
+        sb = Switchboard(workers=2)
+        received = list()
+
+        def t_slow_callback(value):
+            sleep(0.01)
+            received.append(value)
+
+        sb.channel("from_test").register_callback(t_slow_callback)
+        sb.channel("idle")
+        for i in range(20):
+            sb.channel("from_test").send(i)
+
+        start = time()
+        sb.shutdown()
+        self.assertTrue(sb.join(timeout=5))
+        self.assertTrue(time() - start < 0.5)
+        self.assertEqual(sorted(received), list(range(20)))
+
+        # once shutdown, further messages are refused
+        sb.channel("from_test").send(100)
+        sleep(0.1)
+        self.assertFalse(100 in received)
+
+    def test_shutdown_in_pipeline_order(self):
+        """
+        Messages queued upstream before the shutdown are passed on
+        downstream and delivered there.
+        """
+        sb = Switchboard(workers=2)
+        received = list()
+
+        def t_forward(value):
+            sleep(0.01)
+            sb.channel("downstream").send(value)
+
+        sb.channel("upstream").register_callback(t_forward)
+        sb.channel("downstream").register_callback(received.append)
+        for i in range(20):
+            sb.channel("upstream").send(i)
+
+        sb.shutdown(order=("upstream", "downstream"), timeout=5)
+        self.assertTrue(sb.join(timeout=5))
+        self.assertEqual(sorted(received), list(range(20)))
+
+
+    def test_join_closes_shutdown_signal(self):
+        sb = Switchboard(workers=1)
+        chan = sb.channel("from_test")
+        fds = set(os.listdir("/proc/self/fd"))
+        # makes the pipe, as a service waiting on the channel would
+        chan.shutdown_fileno()
+
+        sb.shutdown()
+        self.assertTrue(sb.join(timeout=5))
+        self.assertEqual(set(os.listdir("/proc/self/fd")), fds)
+
+        # still reports the shutdown afterwards
+        self.assertTrue(chan.wait_for_shutdown(0))
+
 
 class TestChannel(TestCase):
     def test_create_register_send_remove_shutdown(self):
@@ -54,5 +122,104 @@ class TestChannel(TestCase):
 
         ch.shutdown()
 
+    def _blocked_channel(self, backpressure):
+        """
+        Helper: a single worker channel whose callback is stuck until
+        the returned event is set. One message is in flight, the
+        subscriber queue (depth 2) is full.
+        """
+        release = Event()
+        received = list()
+
+        def t_blocking_callback(value):
+            release.wait()
+            received.append(value)
+
+        ch = Channel("test", workers=1, max_queue_depth=2,
+                     backpressure=backpressure)
+        self.addCleanup(ch.shutdown)
+        self.addCleanup(release.set)
+        ch.register_callback(t_blocking_callback)
+
+        ch.send(0)
+        sleep(0.2)  # let the worker pick up the first message
+        ch.send(1)
+        ch.send(2)
+        return ch, release, received
+
+    def test_drop_newest(self):
+        ch, release, received = self._blocked_channel(
+            BACKPRESSURE_DROP_NEWEST)
+        ch.send(3)
+
+        metrics = ch.metrics()
+        self.assertEqual(metrics['queue_depth'], 2)
+        self.assertEqual(metrics['in_flight'], 1)
+        self.assertEqual(metrics['dropped'], 1)
+
+        release.set()
+        sleep(0.3)
+        self.assertEqual(received, [0, 1, 2])
+        self.assertEqual(ch.metrics()['dispatched'], 3)
+
+    def test_drop_oldest(self):
+        ch, release, received = self._blocked_channel(
+            BACKPRESSURE_DROP_OLDEST)
+        ch.send(3)
+        self.assertEqual(ch.metrics()['dropped'], 1)
+
+        release.set()
+        sleep(0.3)
+        self.assertEqual(received, [0, 2, 3])
+
+    def test_block_sender(self):
+        ch, release, received = self._blocked_channel(BACKPRESSURE_BLOCK)
+        sender = Thread(target=ch.send, args=(3,))
+        sender.start()
+        sleep(0.2)
+        self.assertTrue(sender.is_alive())
+
+        release.set()
+        sender.join(2)
+        self.assertFalse(sender.is_alive())
+        sleep(0.3)
+        self.assertEqual(received, [0, 1, 2, 3])
+        self.assertEqual(ch.metrics()['dropped'], 0)
+
+    def test_bounded_threads(self):
+        """
+        A burst of messages must not create a thread per message.
+        """
+        ch = Channel("test", workers=2)
+        self.addCleanup(ch.shutdown)
+        received = list()
+        ch.register_callback(lambda value: received.append(value))
+
+        threads_before = active_count()
+        for i in range(500):
+            ch.send(i)
+        self.assertTrue(active_count() <= threads_before)
+
+        sleep(0.5)
+        self.assertEqual(sorted(received), list(range(500)))
+        self.assertEqual(ch.metrics()['dispatch_latency']['count'], 500)
+
+    def test_wait_for_shutdown(self):
+        ch = Channel("test")
+        self.assertFalse(ch.wait_for_shutdown(0.05))
+
+        waiter_result = list()
+        waiter = Thread(target=lambda: waiter_result.append(
+            ch.wait_for_shutdown(30)))
+        waiter.start()
+        sleep(0.1)
+
+        start = time()
+        ch.shutdown()
+        waiter.join(5)
+        self.assertTrue(time() - start < 0.5)
+        self.assertEqual(waiter_result, [True])
+        self.assertTrue(ch.join(timeout=5))
+
 if __name__ == '__main__':
     unittest_main()
\ No newline at end of file
@@ -3,10 +3,15 @@ from time import sleep
 import logging
 import json
 
+from requests.exceptions import HTTPError
+
+from comms.cb_request_executor import CbRequestTimeout
 from data.switchboard import Switchboard
 from fletch_config import Config
 from ingress.cbforwarder.cb_event_handler import CbEventHandler
 from utils.loggy import Loggy
+from utils.lru_cache import LruCache, MISSING
+from utils.tracing import Tracer
 from comms.bigfix_api import BigFixApi
 import data.events as events
 
@@ -135,5 +140,157 @@ class TestCbEventHandler(TestCase):
         self.assertTrue(cve_to_check_for in cves)
 
 
+class _StubCbApi(object):
+    """
+    Serves process documents out of a dict of unique id (without the
+    segment) -> (parent unique id, CVE or None), counting the lookups.
+    Processes missing from it raise an HTTPError.
+    """
+    def __init__(self, processes):
+        self._processes = processes
+        self.lookups = dict()
+
+    def process_events(self, unique_id, segment_id):
+        self.lookups[unique_id] = self.lookups.get(unique_id, 0) + 1
+        if unique_id not in self._processes:
+            raise HTTPError("404 Client Error: Not Found")
+
+        parent, cve = self._processes[unique_id]
+        process_json = {
+            "unique_id": "{0}-{1:08d}".format(unique_id, int(segment_id)),
+            "segment_id": segment_id,
+            "parent_unique_id": None if parent is None
+            else "{0}-00000001".format(parent),
+            "hostname": "host", "sensor_id": 1,
+            "process_md5": "0" * 32, "path": "c:\\{0}.exe".format(unique_id),
+            "process_name": "{0}.exe".format(unique_id),
+        }
+        if cve is not None:
+            process_json["alliance_score_nvd"] = 90
+            process_json["alliance_hits"] = {"1": {
+                "feedinfo": {"name": "nvd"},
+                "hits": {"1": {"title": "CVE-{0} vulnerable".format(cve),
+                               "score": 90}}}}
+        return {"process": process_json}
+
+
+class _StubExecutor(object):
+    """
+    Runs the lookups right away, timing out on the given unique ids.
+    """
+    def __init__(self, timing_out=()):
+        self._timing_out = timing_out
+
+    def call(self, func, *args):
+        if args[0] in self._timing_out:
+            raise CbRequestTimeout("Cb API request timed out")
+        return func(*args)
+
+
+def _stub_handler(processes, timing_out=()):
+    """
+    A handler looking processes up in a _StubCbApi, without the Cb API
+    connections or the switchboard.
+    """
+    handler = CbEventHandler.__new__(CbEventHandler)
+    handler.logger = logging.getLogger(__name__)
+    handler.vuln_feeds_entries = [("nvd", 50)]
+    handler._old_cbapi = _StubCbApi(processes)
+    handler._cb_executor = _StubExecutor(timing_out)
+    handler._process_cache = LruCache(100)
+    handler._resolved_ancestors = LruCache(100)
+    return handler
+
+
+class TestProcessTreeCaches(TestCase):
+
+    def _handler(self, processes, timing_out=()):
+        return _stub_handler(processes, timing_out)
+
+    def _walk(self, handler, unique_id):
+        return handler._find_vulnerable_ancestor(
+            handler._get_process_summary(unique_id, "1"))
+
+    def test_shared_ancestors_looked_up_once(self):
+        handler = self._handler({"child1": ("parent", None),
+                                 "child2": ("parent", None),
+                                 "parent": ("vulnerable", None),
+                                 "vulnerable": ("root", "2016-1000"),
+                                 "root": (None, None)})
+
+        self.assertEqual(self._walk(handler, "child1").name,
+                         "vulnerable.exe")
+        lookups = dict(handler._old_cbapi.lookups)
+
+        # the second walk stops at the shared parent, only the starting
+        # process is looked up
+        self.assertEqual(self._walk(handler, "child2").name,
+                         "vulnerable.exe")
+        self.assertEqual(sum(handler._old_cbapi.lookups.values()) -
+                         sum(lookups.values()), 1)
+        self.assertEqual(handler._old_cbapi.lookups["parent"], 1)
+        self.assertEqual(handler._old_cbapi.lookups["vulnerable"], 1)
+
+    def test_no_vulnerable_ancestor_cached(self):
+        handler = self._handler({"child1": ("parent", None),
+                                 "child2": ("parent", None),
+                                 "parent": ("root", None),
+                                 "root": (None, None)})
+
+        self.assertEqual(self._walk(handler, "child1"), None)
+        self.assertEqual(self._walk(handler, "child2"), None)
+        self.assertEqual(handler._old_cbapi.lookups,
+                         {"child1": 1, "child2": 1, "parent": 1, "root": 1})
+        self.assertEqual(
+            handler._resolved_ancestors.get("parent-1", MISSING), None)
+
+    def test_failed_walk_not_cached(self):
+        # the parent of child1 can't be found, the one of child2 times out
+        handler = self._handler({"child1": ("gone", None),
+                                 "child2": ("slow", None),
+                                 "slow": (None, "2016-1000")},
+                                timing_out=("slow",))
+
+        for _ in range(2):
+            self.assertEqual(self._walk(handler, "child1"), None)
+            self.assertEqual(self._walk(handler, "child2"), None)
+        self.assertEqual(handler._old_cbapi.lookups["gone"], 2)
+        for key in ("child1-1", "child2-1"):
+            self.assertTrue(
+                handler._resolved_ancestors.get(key, MISSING) is MISSING)
+
+
+class TestDroppedEventTraces(TestCase):
+
+    def test_dropped_events_finish_their_trace(self):
+        handler = _stub_handler({"child": ("root", None),
+                                 "root": (None, None)})
+        handler.send_banned_file_info = False
+        handler.send_vulnerable_app_info = False
+        handler.send_implicated_app_info = True
+        handler.implication_watchlists = ["implication"]
+        tracer = Tracer(1, float('inf'))
+
+        # no vulnerable ancestor
+        trace = tracer.start()
+        handler.handle_incoming_event({
+            "type": "watchlist.storage.hit.process",
+            "watchlist_name": "implication", "process_id": "child",
+            "docs": [{"unique_id": "child-00000001"}]}, trace)
+        self.assertEqual(trace.stages[-1][0], "dropped")
+
+        # failed to be handled
+        trace = tracer.start()
+        handler.handle_incoming_event({
+            "type": "watchlist.storage.hit.process",
+            "watchlist_name": "implication"}, trace)
+        self.assertEqual(trace.stages[-1][0], "dropped")
+
+        # not of interest
+        handler.handle_incoming_event({"type": "feed.storage.hit.process"},
+                                      tracer.start())
+        self.assertEqual(tracer.traces_finished.value, 3)
+
+
 if __name__ == '__main__':
     unittest_main()
@@ -1,6 +1,8 @@
 from unittest import TestCase, main as unittest_main
 from time import sleep
+import errno
 import json
+import select
 import socket
 import logging
 
@@ -8,10 +10,27 @@ from data.switchboard import Switchboard
 from fletch_config import Config
 from ingress.cbforwarder.cb_event_listener import CbEventListener
 from utils.loggy import Loggy
+from utils.shutdown_signal import ShutdownSignal
 
 from test.test_config import test_config_file_path
 
 
+class _FakeServerSocket(object):
+    """
+    Hands out the given accept() results in turn, errnos are raised.
+    """
+    def __init__(self, results):
+        self._results = list(results)
+        self.accepts = 0
+
+    def accept(self):
+        self.accepts += 1
+        result = self._results.pop(0) if self._results else errno.EAGAIN
+        if isinstance(result, int):
+            raise socket.error(result, "accept failed")
+        return result
+
+
 class TestCbEventListener(TestCase):
 
     @classmethod
@@ -125,5 +144,76 @@ class TestCbEventListener(TestCase):
         # now verify the data was parsed correctly
         self.assertTrue(original_json, object_pass_back)
 
+    def test_inbound_data_processing_selector_mode(self):
+        """
+        Same as above but with every connection served from the single
+        selector thread, with a couple of forwarders connected at once.
+        """
+        sleep(1)
+
+        sb = Switchboard()
+        self.addCleanup((lambda board: board.shutdown()), sb)
+        test_config = Config(test_config_file_path)
+        test_config.cb_event_listener.ingest_mode = "selector"
+        listener = CbEventListener(test_config, sb)
+        self.addCleanup((lambda a_listener: a_listener.shutdown()), listener)
+
+        received = []
+        sb.channel(test_config.cb_event_listener.sb_incoming_cb_events)\
+            .register_callback(received.append)
+
+        test_nvd_hit = "test/t_ingress/data/adobe_reader_9_3_4_nvd_hit.json"
+        with open(test_nvd_hit) as json_file:
+            original_json = json.load(json_file)
+
+        sleep(.5)
+        sockets = []
+        for i in range(2):
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.connect((
+                'localhost',
+                test_config.cb_event_listener.listen_port
+            ))
+            sockets.append(s)
+        try:
+            for s in sockets:
+                s.send(json.dumps(original_json) + "\n")
+        finally:
+            for s in sockets:
+                s.close()
+
+        sleep(1)
+        self.assertEqual(2, len(received))
+        self.assertEqual(original_json, received[0])
+
+    def test_accept_errors_keep_listening(self):
+        """
+        Failed accepts are logged and skipped (or backed off from), they
+        don't take down the selector thread.
+        """
+        listener = CbEventListener.__new__(CbEventListener)
+        listener.logger = self._logger
+        listener._shutdown = ShutdownSignal()
+        listener._read_buffer_size = 4096
+
+        client, peer = socket.socketpair()
+        self.addCleanup(client.close)
+        self.addCleanup(peer.close)
+        epoll_instance = select.epoll()
+        self.addCleanup(epoll_instance.close)
+        connections = dict()
+
+        server = _FakeServerSocket([errno.ECONNABORTED, (client, "forwarder"),
+                                    errno.EMFILE])
+        listener._accept_connections(server, epoll_instance, connections,
+                                     False)
+        self.assertEqual(server.accepts, 3)
+        self.assertEqual(list(connections), [client.fileno()])
+
+        # and accepting again afterwards goes on as usual
+        listener._accept_connections(server, epoll_instance, connections,
+                                     False)
+        self.assertEqual(server.accepts, 4)
+
 if __name__ == '__main__':
     unittest_main()
@@ -0,0 +1,89 @@
+from unittest import TestCase, main as unittest_main
+import json
+
+from ingress.cbforwarder.event_filter import EventTypeFilter
+
+from test.t_bench.forwarder_corpus import build_corpus
+
+
+class TestEventTypeFilter(TestCase):
+
+    def test_skips_raw_sensor_events(self):
+        event_filter = EventTypeFilter()
+        line = json.dumps({"type": "ingress.event.procstart", "pid": 4})
+        self.assertFalse(event_filter.is_candidate(line))
+        self.assertEqual(event_filter.parse(line), None)
+        self.assertEqual(event_filter.stats(),
+                         {"skipped": 1, "parsed": 0, "accepted": 0})
+
+    def test_accepts_hits(self):
+        event_filter = EventTypeFilter()
+        with open("test/t_ingress/data/"
+                  "java_7u79_vuln_watchlist_hit.json") as json_file:
+            original_json = json.load(json_file)
+        result = event_filter.parse(json.dumps(original_json))
+        self.assertEqual(result, original_json)
+        self.assertEqual(event_filter.stats(),
+                         {"skipped": 0, "parsed": 1, "accepted": 1})
+
+    def test_fallback_to_full_decode(self):
+        event_filter = EventTypeFilter()
+
+        # type string present in another field only, decoded and rejected
+        decoy = json.dumps({"type": "ingress.event.procstart",
+                            "cmdline": "watchlist.storage.hit.process"})
+        self.assertEqual(event_filter.parse(decoy), None)
+
+        # escaped type value, can't be judged from the raw text
+        escaped = '{"type": "feed.storage.hit.\\u0070rocess", "a": 1}'
+        self.assertEqual(event_filter.parse(escaped)['a'], 1)
+
+        self.assertEqual(event_filter.stats(),
+                         {"skipped": 0, "parsed": 2, "accepted": 1})
+
+    def test_skips_non_objects(self):
+        for enabled in (True, False):
+            event_filter = EventTypeFilter(enabled=enabled)
+            for line in ('[1]', '"x"', '3', 'null'):
+                self.assertEqual(event_filter.parse(line), None)
+
+    def test_counts_by_type(self):
+        event_filter = EventTypeFilter()
+        event_filter.parse(json.dumps({"type": "ingress.event.procstart"}))
+        event_filter.parse(json.dumps({"type": "ingress.event.procstart"}))
+        event_filter.parse(json.dumps({"type": "feed.storage.hit.process"}))
+        event_filter.parse(json.dumps({
+            "type": "ingress.event.netconn",
+            "cmdline": "feed.storage.hit.process"}))
+
+        counts = dict((values, child.value) for values, child
+                      in event_filter.events_by_type.children())
+        self.assertEqual(counts, {
+            ("ingress.event.procstart", "skipped"): 2,
+            ("feed.storage.hit.process", "accepted"): 1,
+            ("ingress.event.netconn", "skipped"): 1,
+        })
+
+    def test_matches_full_decode(self):
+        """
+        The pre-filter must accept exactly what decoding every line does.
+        """
+        corpus = build_corpus(2000, hit_ratio=0.05)
+        expected = [json.loads(line) for line in corpus
+                    if json.loads(line)["type"] in
+                    ("feed.storage.hit.process",
+                     "watchlist.storage.hit.process")]
+
+        event_filter = EventTypeFilter()
+        results = [event_filter.parse(line) for line in corpus]
+        self.assertEqual([r for r in results if r is not None], expected)
+        self.assertEqual(event_filter.lines_accepted.value, len(expected))
+
+        unfiltered = EventTypeFilter(enabled=False)
+        for line in corpus:
+            unfiltered.parse(line)
+        self.assertEqual(unfiltered.lines_parsed.value, len(corpus))
+
+
+if __name__ == '__main__':
+    unittest_main()
@@ -0,0 +1,53 @@
+from unittest import TestCase, main as unittest_main
+import json
+import socket
+
+from ingress.cbforwarder.line_reader import LineFramer, SocketLineReader
+
+
+class TestLineFramer(TestCase):
+
+    def test_split_complete_lines(self):
+        framer = LineFramer()
+        self.assertEqual(framer.feed('{"a": 1}\n{"b": 2}\n'),
+                         ['{"a": 1}', '{"b": 2}'])
+        self.assertEqual(framer.pending_bytes(), 0)
+
+    def test_partial_line_carried_over(self):
+        framer = LineFramer()
+        self.assertEqual(framer.feed('{"a": 1}\n{"b"'), ['{"a": 1}'])
+        self.assertEqual(framer.feed(': 2'), [])
+        self.assertEqual(framer.feed('}\n{"c": 3}'), ['{"b": 2}'])
+        self.assertEqual(framer.flush(), '{"c": 3}')
+        self.assertEqual(framer.flush(), None)
+
+    def test_blank_lines_dropped(self):
+        framer = LineFramer()
+        self.assertEqual(framer.feed('\n\n{"a": 1}\r\n  \n'), ['{"a": 1}\r'])
+
+
+class TestSocketLineReader(TestCase):
+
+    def test_read_until_close(self):
+        documents = [{"type": "ingress.event.procstart", "id": i}
+                     for i in range(500)]
+        payload = "\n".join(json.dumps(doc) for doc in documents)
+
+        sender, receiver = socket.socketpair()
+        try:
+            # small buffer forces documents to straddle reads
+            reader = SocketLineReader(receiver, buffer_size=64)
+            sender.sendall(payload)
+            sender.close()
+
+            received = list()
+            while not reader.closed:
+                received.extend(reader.read_lines())
+        finally:
+            receiver.close()
+
+        self.assertEqual([json.loads(line) for line in received], documents)
+
+
+if __name__ == '__main__':
+    unittest_main()
@@ -0,0 +1,80 @@
+from unittest import TestCase, main as unittest_main
+from datetime import datetime
+import os
+import shutil
+import tempfile
+
+from dateutil.tz import tzutc
+
+from ingress.cbforwarder.s3_checkpoint import S3Checkpoint, \
+    PROCESSED_LOG_FILE_NAME
+
+
+class TestS3Checkpoint(TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+        self.when = datetime(2017, 3, 4, 5, 6, 7, tzinfo=tzutc())
+
+    def tearDown(self):
+        shutil.rmtree(self.state_dir)
+
+    def _log_lines(self):
+        with open(os.path.join(self.state_dir,
+                               PROCESSED_LOG_FILE_NAME)) as log_file:
+            return log_file.read().splitlines()
+
+    def test_fresh_start(self):
+        checkpoint = S3Checkpoint(self.state_dir)
+        self.assertFalse(checkpoint.load())
+        self.assertEqual(checkpoint.last_key, None)
+        self.assertFalse(checkpoint.is_processed("a"))
+
+    def test_resume_after_restart(self):
+        checkpoint = S3Checkpoint(self.state_dir)
+        checkpoint.load()
+
+        # "c" and "e" finish before "b" does, then "a" and "b" commit
+        for key in ("a", "c", "e", "b"):
+            checkpoint.mark_processed(key)
+        checkpoint.commit("c", self.when)
+        checkpoint.close()
+
+        restarted = S3Checkpoint(self.state_dir)
+        self.assertTrue(restarted.load())
+        self.assertEqual(restarted.last_key, "c")
+        self.assertEqual(restarted.last_modified, self.when)
+        self.assertTrue(restarted.is_processed("b"))
+        self.assertTrue(restarted.is_processed("e"))
+        self.assertFalse(restarted.is_processed("d"))
+        self.assertEqual(restarted.pending_count(), 1)
+
+        # no temp files left behind by the atomic writes
+        self.assertEqual([name for name in os.listdir(self.state_dir)
+                          if name.endswith(".tmp")], [])
+
+    def test_compaction(self):
+        checkpoint = S3Checkpoint(self.state_dir, compact_threshold=10)
+        keys = ["key-{0:04d}".format(i) for i in range(25)]
+        for key in keys[:20]:
+            checkpoint.mark_processed(key)
+        checkpoint.mark_processed(keys[22])
+        self.assertEqual(len(self._log_lines()), 21)
+
+        checkpoint.commit(keys[19], self.when)
+        self.assertEqual(self._log_lines(), [keys[22]])
+
+        # keeps appending after a compaction
+        checkpoint.mark_processed(keys[24])
+        self.assertEqual(self._log_lines(), [keys[22], keys[24]])
+        checkpoint.close()
+
+        restarted = S3Checkpoint(self.state_dir)
+        restarted.load()
+        self.assertTrue(restarted.is_processed(keys[5]))
+        self.assertTrue(restarted.is_processed(keys[24]))
+        self.assertFalse(restarted.is_processed(keys[21]))
+
+
+if __name__ == '__main__':
+    unittest_main()
@@ -0,0 +1,233 @@
+from unittest import TestCase, main as unittest_main
+from collections import deque
+from datetime import datetime, timedelta
+from threading import Lock
+import json
+import logging
+import shutil
+import socket
+import tempfile
+import threading
+
+from dateutil.tz import tzutc
+
+from ingress.cbforwarder import s3_event_listener
+from ingress.cbforwarder.event_filter import EventTypeFilter
+from ingress.cbforwarder.s3_checkpoint import S3Checkpoint
+from ingress.cbforwarder.s3_event_listener import S3EventListener
+from utils.metrics import Counter
+from utils.shutdown_signal import ShutdownSignal
+from utils.tracing import Tracer
+
+from test.t_bench.bench_s3_listing import FakeS3Client
+
+
+class _Channel(object):
+    def __init__(self):
+        self.messages = list()
+
+    def send(self, message, trace=None):
+        self.messages.append(message)
+
+
+class _BrokenBody(object):
+    """
+    A body that hands out a few lines, one per read, then fails.
+    """
+    def __init__(self, lines, fail_after):
+        self._lines = lines
+        self._reads = 0
+        self._fail_after = fail_after
+
+    def read(self, size):
+        if self._reads == self._fail_after:
+            raise socket.error(104, "Connection reset by peer")
+        self._reads += 1
+        return self._lines.pop(0) if self._lines else b''
+
+    def close(self):
+        pass
+
+
+class _FlakyS3Client(FakeS3Client):
+    """
+    Fails reading the given keys, for as many attempts as asked.
+    """
+    def __init__(self):
+        super(_FlakyS3Client, self).__init__()
+        self.failures = dict()
+        self.listing_failures = 0
+        self.listed_after = list()
+
+    def list_objects_v2(self, **kwargs):
+        if self.listing_failures:
+            self.listing_failures -= 1
+            raise socket.error(111, "Connection refused")
+        if "ContinuationToken" not in kwargs:
+            self.listed_after.append(kwargs.get("StartAfter"))
+        return super(_FlakyS3Client, self).list_objects_v2(**kwargs)
+
+    def get_object(self, Bucket, Key):
+        failures, fail_after = self.failures.get(Key, (0, 0))
+        if not failures:
+            return super(_FlakyS3Client, self).get_object(Bucket, Key)
+        self.failures[Key] = (failures - 1, fail_after)
+        if fail_after == 0:
+            raise socket.error(110, "Connection timed out")
+        lines = [line + b"\n" for line in
+                 self._objects[Key][0].splitlines()]
+        return {"Body": _BrokenBody(lines, fail_after)}
+
+
+class TestS3EventListener(TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.state_dir)
+        self.when = datetime(2017, 1, 1, tzinfo=tzutc())
+
+        for name in ("OBJECT_RETRY_DELAY", "S3_POLL_INTERVAL"):
+            self.addCleanup(setattr, s3_event_listener, name,
+                            getattr(s3_event_listener, name))
+            setattr(s3_event_listener, name, 0.01)
+
+        self.client = _FlakyS3Client()
+        self.channel = _Channel()
+
+    def _listener(self):
+        """
+        A listener wired to the stand-in client, without the boto3
+        session or poll thread.
+        """
+        listener = S3EventListener.__new__(S3EventListener)
+        listener.logger = logging.getLogger(__name__)
+        listener._s3 = self.client
+        listener._s3_bucket_name = "test"
+        listener._key_prefix = ""
+        listener._shutdown = ShutdownSignal()
+        listener._event_filter = EventTypeFilter()
+        listener._incoming_chan = self.channel
+        listener._last_modified = datetime(2001, 1, 1, tzinfo=tzutc())
+        listener._last_key = None
+        listener._checkpoint = S3Checkpoint(self.state_dir)
+        listener._read_buffer_size = 65536
+        listener._progress_lock = Lock()
+        listener._in_progress = deque()
+        listener._object_failures = dict()
+        listener._tracer = Tracer(0, 0)
+        listener.objects_read = Counter("objects_read", "")
+        listener.objects_failed = Counter("objects_failed", "")
+        listener.polls_failed = Counter("polls_failed", "")
+        listener._start_object_workers(2)
+        return listener
+
+    def _put(self, key, *events):
+        self.when += timedelta(seconds=1)
+        body = b"".join(json.dumps({"type": "feed.storage.hit.process",
+                                    "event": event}).encode() + b"\n"
+                        for event in events)
+        self.client.put_object(Key=key, Body=body, LastModified=self.when)
+
+    def _events(self):
+        return [message["event"] for message in self.channel.messages]
+
+    def test_resumes_after_last_key(self):
+        self._put("a", 1)
+        self._put("b", 2)
+        listener = self._listener()
+        self.addCleanup(listener._stop_object_workers)
+        self.assertEqual(listener._poll_once(), 2)
+        self.assertEqual(listener._poll_once(), 0)
+
+        # a restart picks up the checkpoint and only lists what is new
+        self._put("c", 3)
+        restarted = self._listener()
+        self.addCleanup(restarted._stop_object_workers)
+        restarted._read_progress()
+        self.assertEqual(restarted._last_key, "b")
+        self.assertEqual(restarted._poll_once(), 1)
+
+        self.assertEqual(self.client.listed_after, [None, "b", "b"])
+        self.assertEqual(self._events(), [1, 2, 3])
+        self.assertEqual(restarted._last_key, "c")
+
+    def test_poll_loop_survives_listing_errors(self):
+        self._put("a", 1)
+        self.client.listing_failures = 2
+
+        listener = self._listener()
+        poll_thread = threading.Thread(target=listener._s3_poll_loop)
+        poll_thread.start()
+        try:
+            for _ in range(500):
+                if listener._last_key is not None:
+                    break
+                listener._shutdown.wait(0.01)
+        finally:
+            listener.shutdown()
+            poll_thread.join(5)
+
+        self.assertFalse(poll_thread.is_alive())
+        self.assertEqual(listener.polls_failed.value, 2)
+        self.assertEqual(self._events(), [1])
+        self.assertEqual(listener._last_key, "a")
+
+    def test_transient_errors_retried(self):
+        self._put("a", 1, 2)
+        self._put("b", 3, 4, 5)
+        self.client.failures["a"] = (2, 0)
+        self.client.failures["b"] = (1, 2)
+
+        listener = self._listener()
+        self.addCleanup(listener._stop_object_workers)
+        self.assertEqual(listener._poll_once(), 2)
+
+        # the broken off read picks up after the lines already sent
+        self.assertEqual(sorted(self._events()), [1, 2, 3, 4, 5])
+        self.assertEqual(listener._last_key, "b")
+
+    def test_bad_lines_skipped(self):
+        self.when += timedelta(seconds=1)
+        self.client.put_object(
+            Key="a", LastModified=self.when,
+            Body=b'[1]\n"x"\n{broken\n'
+                 b'{"type": "feed.storage.hit.process", "event": 1}\n')
+
+        listener = self._listener()
+        self.addCleanup(listener._stop_object_workers)
+        listener._poll_once()
+        self.assertEqual(self._events(), [1])
+        self.assertEqual(listener._last_key, "a")
+
+    def test_failed_object_read_next_poll(self):
+        self._put("a", 1)
+        self._put("b", 2)
+        self.client.failures["a"] = (s3_event_listener.OBJECT_READ_ATTEMPTS,
+                                     0)
+
+        listener = self._listener()
+        self.addCleanup(listener._stop_object_workers)
+        listener._poll_once()
+        self.assertEqual(self._events(), [2])
+        self.assertEqual(listener._last_key, None)
+
+        listener._poll_once()
+        self.assertEqual(self._events(), [2, 1])
+        self.assertEqual(listener._last_key, "b")
+
+    def test_failing_object_given_up_on(self):
+        self._put("a", 1)
+        self._put("b", 2)
+        self.client.failures["a"] = (1000, 0)
+
+        listener = self._listener()
+        self.addCleanup(listener._stop_object_workers)
+        for _ in range(s3_event_listener.OBJECT_MAX_FAILED_POLLS):
+            self.assertEqual(listener._last_key, None)
+            listener._poll_once()
+        self.assertEqual(self._events(), [2])
+        self.assertEqual(listener._last_key, "b")
+
+
+if __name__ == '__main__':
+    unittest_main()
@@ -0,0 +1,62 @@
+from unittest import TestCase, main as unittest_main, skipIf
+from io import BytesIO
+import gzip
+
+from ingress.cbforwarder.s3_object_reader import iter_object_lines, \
+    lz4_frame
+
+from test.t_bench.forwarder_corpus import build_corpus
+
+
+def _gzip(data):
+    compressed = BytesIO()
+    gzip_file = gzip.GzipFile(fileobj=compressed, mode="wb")
+    gzip_file.write(data)
+    gzip_file.close()
+    return compressed.getvalue()
+
+
+class TestS3ObjectReader(TestCase):
+
+    def setUp(self):
+        self.lines = build_corpus(500, hit_ratio=0.05)
+        self.raw = "\n".join(self.lines) + "\n"
+
+    def test_plain_small_chunks(self):
+        # chunks much smaller than a line, so every line spans reads
+        result = list(iter_object_lines("event-forwarder.1",
+                                        BytesIO(self.raw), chunk_size=7))
+        self.assertEqual(result, self.lines)
+
+    def test_no_trailing_newline(self):
+        result = list(iter_object_lines("event-forwarder.1",
+                                        BytesIO(self.raw.rstrip("\n"))))
+        self.assertEqual(result, self.lines)
+
+    def test_gzip(self):
+        result = list(iter_object_lines("event-forwarder.1.gz",
+                                        BytesIO(_gzip(self.raw)),
+                                        chunk_size=1000))
+        self.assertEqual(result, self.lines)
+
+    def test_gzip_detected_without_extension(self):
+        # two members back to back, split in the middle of a line
+        half = len(self.raw) // 2
+        data = _gzip(self.raw[:half]) + _gzip(self.raw[half:])
+        result = list(iter_object_lines("event-forwarder.1", BytesIO(data),
+                                        chunk_size=333))
+        self.assertEqual(result, self.lines)
+
+    @skipIf(lz4_frame is None, "lz4 module not installed")
+    def test_lz4(self):
+        data = lz4_frame.compress(self.raw)
+        result = list(iter_object_lines("event-forwarder.1.lz4",
+                                        BytesIO(data), chunk_size=1000))
+        self.assertEqual(result, self.lines)
+
+    def test_empty(self):
+        self.assertEqual(list(iter_object_lines("x", BytesIO(b""))), [])
+
+
+if __name__ == '__main__':
+    unittest_main()
@@ -0,0 +1,196 @@
+"""
+Stand-in for the BigFix REST API on a local port, for driving BigFixApi
+under load. Unlike fake_bigfix_server it needs nothing but the standard
+library, serves any number of requests concurrently and can add a delay
+to every answer to play the part of a slow server.
+
+It answers the sensor id to besid relevance queries (besid = sensor id),
+keeps the banned file fixlets of the custom site, and records the time
+of every dashboard post and fixlet update along with what they carried.
+"""
+import gzip
+import json
+import re
+import threading
+import time
+import xml.etree.ElementTree as Et
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from io import BytesIO
+from urlparse import urlparse, parse_qs
+
+from comms.fixlet_index import fixlet_paths
+
+DASHBOARD_TEMPLATE_PATH = 'src/statics/bigfix_plugin_api_post_template.xml'
+
+_QUOTED_NUMBER = re.compile(r'"(\d+)"')
+_FIXLET_MD5 = re.compile(r'contains "([0-9a-fA-F]+)" as lowercase')
+
+
+class _ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def process_request(self, request, client_address):
+        # named, so the benchmarks can tell them from the connector's
+        thread = threading.Thread(target=self.process_request_thread,
+                                  args=(request, client_address),
+                                  name="fake_bigfix_request")
+        thread.daemon = True
+        thread.start()
+
+
+class FakeBigFixHttp(object):
+
+    def __init__(self, latency=0.0, port=0):
+        """
+        :param latency: seconds to wait before answering each request
+        :param port: port to listen on, 0 picks a free one
+        """
+        self.latency = latency
+        self._lock = threading.Lock()
+
+        with open(DASHBOARD_TEMPLATE_PATH) as temp_open:
+            self._dashboard_xml = temp_open.read()
+
+        # md5 -> fixlet id, fixlet id -> xml
+        self._fixlet_ids = dict()
+        self._fixlets = dict()
+
+        # (time, list of besids) per dashboard post and (time, set of
+        # paths) per fixlet update
+        self.dashboard_posts = list()
+        self.fixlet_updates = list()
+        self.requests = 0
+
+        fake = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                fake._handle(self, 'GET')
+
+            def do_POST(self):
+                fake._handle(self, 'POST')
+
+            def do_PUT(self):
+                fake._handle(self, 'PUT')
+
+        self._server = _ThreadingServer(('127.0.0.1', port), _Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name="fake_bigfix_server")
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def url(self):
+        """
+        :return: host:port, as for the url option of [ibm-bigfix]
+        """
+        return "127.0.0.1:{0}".format(self.port)
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handle(self, request, method):
+        body = b""
+        length = int(request.headers.get('Content-Length') or 0)
+        if length:
+            body = request.rfile.read(length)
+        if request.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.GzipFile(fileobj=BytesIO(body)).read()
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        with self._lock:
+            self.requests += 1
+        url = urlparse(request.path)
+        path = url.path
+
+        if path == '/api/query':
+            status, answer = self._query(parse_qs(url.query))
+        elif path.startswith('/api/dashboardvariables/'):
+            status, answer = self._dashboard(method, body)
+        elif path.startswith('/api/fixlets/'):
+            status, answer = self._create_fixlet(body)
+        elif path.startswith('/api/fixlet/'):
+            status, answer = self._fixlet(method, path, body)
+        else:
+            status, answer = 404, "not found"
+
+        request.send_response(status)
+        request.send_header('Content-Length', str(len(answer)))
+        request.end_headers()
+        request.wfile.write(answer)
+
+    def _query(self, params):
+        relevance = params.get('relevance', [''])[0]
+        as_json = params.get('output', [''])[0] == 'json'
+
+        if 'bes fixlets' in relevance:
+            match = _FIXLET_MD5.search(relevance)
+            with self._lock:
+                fixlet_id = self._fixlet_ids.get(
+                    match.group(1).lower()) if match else None
+            result = [fixlet_id] if fixlet_id is not None else []
+            return 200, json.dumps({"result": result})
+
+        # sensor ids, every one of them is known with besid = sensor id
+        sensor_ids = _QUOTED_NUMBER.findall(relevance)
+        if as_json:
+            return 200, json.dumps({"result": [
+                [sensor_id, int(sensor_id)] for sensor_id in sensor_ids]})
+        answers = "".join('<Answer type="integer">{0}</Answer>'.format(
+            sensor_id) for sensor_id in sensor_ids[:1])
+        return 200, ('<BESAPI><Query Resource="{0}"><Result>{1}</Result>'
+                     '</Query></BESAPI>'.format("relevance", answers))
+
+    def _dashboard(self, method, body):
+        if method == 'GET':
+            return 200, self._dashboard_xml
+
+        value = Et.fromstring(body).find('DashboardData').find('Value').text
+        besids = [asset['besid'] for asset in json.loads(value)['assets']]
+        with self._lock:
+            self.dashboard_posts.append((time.time(), besids))
+        return 200, "<BESAPI/>"
+
+    def _record_fixlet(self, fixlet_id, xml):
+        fixlet = Et.fromstring(xml).find('Fixlet')
+        md5 = fixlet.find('Title').text.split('=')[1].lower()
+        actionscript = fixlet.find('DefaultAction').find('ActionScript').text
+        with self._lock:
+            self._fixlet_ids[md5] = fixlet_id
+            self._fixlets[fixlet_id] = xml
+            self.fixlet_updates.append((time.time(),
+                                        fixlet_paths(actionscript)))
+
+    def _create_fixlet(self, body):
+        with self._lock:
+            fixlet_id = len(self._fixlets) + 1
+            self._fixlets[fixlet_id] = body
+        self._record_fixlet(fixlet_id, body)
+        return 200, ('<BESAPI><Fixlet Resource="fixlet"><Name>fixlet</Name>'
+                     '<ID>{0}</ID></Fixlet></BESAPI>'.format(fixlet_id))
+
+    def _fixlet(self, method, path, body):
+        try:
+            fixlet_id = int(path.rstrip('/').split('/')[-1])
+        except ValueError:
+            return 404, "not found"
+
+        with self._lock:
+            xml = self._fixlets.get(fixlet_id)
+        if xml is None:
+            return 404, "not found"
+        if method == 'GET':
+            return 200, xml
+
+        self._record_fixlet(fixlet_id, body)
+        return 200, "<BESAPI/>"
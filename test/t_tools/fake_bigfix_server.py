@@ -7,12 +7,19 @@ ready for their new code.
 from flask import Flask, request
 import xml.etree.ElementTree as Et
 import json
+import re
 
 # number of requests to accept before shutting down.
 # if we are running test cases, leave this at 2 otherwise
 # the testing will hang because of the blocking wait for HTTP requests
 max_requests_before_shutdown = 2
 
+# sensor id (as str) -> besid, answers for the relevance query api
+sensor_besids = dict()
+
+# number of relevance queries received
+query_count = 0
+
 
 class FakeBigFixData(object):
 
@@ -99,6 +106,33 @@ def init_fake_server(*args, **kwargs):
     app.run(*args, **kwargs)
 
 
+@app.route("/api/query", methods=['GET'])
+def query():
+    """
+    Answers the sensor id -> besid relevance queries from sensor_besids.
+    Any other relevance query gets an empty answer.
+    """
+    global query_count
+    query_count += 1
+    request_tracker()
+
+    relevance = request.args.get('relevance', '')
+    answers = list()
+    if 'bes computers' in relevance:
+        asked_ids = re.findall(r'"(\d+)"', relevance)
+        for sensor_id, besid in sorted(sensor_besids.items()):
+            if not asked_ids or sensor_id in asked_ids:
+                answers.append((sensor_id, besid))
+
+    if request.args.get('output') == 'json':
+        return json.dumps({"result": [list(answer) for answer in answers]})
+
+    answer_xml = "".join('<Answer type="integer">{0}</Answer>'.format(besid)
+                         for sensor_id, besid in answers)
+    return '<BESAPI><Query><Result>{0}</Result></Query></BESAPI>'.format(
+        answer_xml)
+
+
 @app.route("/<path:path>", methods=['GET'])
 def get(path):
     """
@@ -0,0 +1,153 @@
+"""
+In-process stand-in for the Cb Response server, for driving the event
+handler without a real server. It answers both cbapi interfaces the
+handler uses, with made up process documents and an optional delay per
+lookup to play the part of the server round trip.
+
+Process ids are chosen by the caller: register_vulnerable_process for the
+vulnerable app watchlist hits, and implicating_unique_id for implication
+watchlist hits. Implicating processes get a chain of parents, shared by
+every process on the same host, and only the top one has vulnerability
+feed hits.
+"""
+import threading
+import time
+
+# unique ids of the made up process trees:
+#   bench-<sensor>-<tag>-0-<segment>   an implicating process
+#   bench-<sensor>-a-<level>-<segment> its ancestors, the vulnerable one
+#                                      at level chain_depth
+_PREFIX = "bench"
+
+
+class _ProcessDoc(object):
+    """
+    What cbapi's select(Process, id) gives back, after refresh().
+    """
+
+    def __init__(self, fields):
+        self.__dict__.update(fields)
+
+    def refresh(self):
+        pass
+
+
+class FakeCbResponse(object):
+    """
+    Instances of this replace both CbApi and CbEnterpriseResponseAPI, use
+    install() to get them picked up by the event handler.
+    """
+
+    def __init__(self, latency=0.0, chain_depth=3, feed_name="nvd",
+                 score=100):
+        """
+        :param latency: seconds each process lookup takes
+        :param chain_depth: parents between an implicating process and the
+                            vulnerable one
+        :param feed_name: vulnerability feed the hits are reported under
+        :param score: feed score of the hits, out of 100
+        """
+        self.latency = latency
+        self.chain_depth = chain_depth
+        self.feed_name = feed_name
+        self.score = score
+
+        self._lock = threading.Lock()
+        self._vulnerable = dict()
+        self.lookups = 0
+
+    def __call__(self, *args, **kwargs):
+        # stands in for the cbapi constructors
+        return self
+
+    def install(self, handler_module):
+        """
+        Make the event handler module use this server.
+        :param handler_module: ingress.cbforwarder.cb_event_handler
+        """
+        handler_module.CbApi = self
+        handler_module.CbEnterpriseResponseAPI = self
+
+    def _lookup(self):
+        with self._lock:
+            self.lookups += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def _cve(self, sensor_id):
+        # one CVE per host, so every host shows up in the dashboard
+        return "CVE-2016-{0:05d}".format(sensor_id % 100000)
+
+    def register_vulnerable_process(self, process_id, sensor_id):
+        """
+        Make process_id a vulnerable app running on the sensor.
+        """
+        with self._lock:
+            self._vulnerable[process_id] = sensor_id
+
+    def implicating_unique_id(self, sensor_id, tag):
+        """
+        :return: the unique id (with segment) of an implicating process on
+                 the sensor, its process tree is made up on lookup
+        """
+        return "{0}-{1}-{2}-0-00000001".format(_PREFIX, sensor_id, tag)
+
+    # the new cbapi interface, for the vulnerable app watchlist hits
+
+    def select(self, model, process_id):
+        self._lookup()
+        sensor_id = self._vulnerable.get(process_id, 0)
+        hit_id = self._cve(sensor_id)
+        return _ProcessDoc({
+            "hostname": "HOST-{0}".format(sensor_id),
+            "sensor_id": sensor_id,
+            "webui_link": "https://cbserver/#analyze/{0}/1".format(
+                process_id),
+            "alliance_hits": {
+                self.feed_name: {
+                    "feedinfo": {"name": self.feed_name},
+                    "hits": {hit_id: {
+                        "id": hit_id,
+                        "score": self.score,
+                        "link": "https://nvd.nist.gov/vuln/detail/{0}".format(
+                            hit_id)}},
+                }
+            },
+        })
+
+    # the old cbapi interface, for walking up the process tree
+
+    def process_events(self, unique_id, segment_id):
+        self._lookup()
+        parts = unique_id.split("-")
+        sensor_id = int(parts[1])
+        level = int(parts[3])
+        if parts[2] != "a":
+            level = 0
+
+        parent_level = level + 1
+        process = {
+            "unique_id": "{0}-{1:08d}".format(unique_id, int(segment_id)),
+            "segment_id": int(segment_id),
+            "parent_unique_id": "{0}-{1}-a-{2}-00000001".format(
+                _PREFIX, sensor_id, parent_level),
+            "hostname": "HOST-{0}".format(sensor_id),
+            "sensor_id": sensor_id,
+            "process_md5": "98536d980f14545816dd33998146ee9c",
+            "path": "c:\\program files\\vulnerable\\app{0}.exe".format(level),
+            "process_name": "app{0}.exe".format(level),
+            "alliance_hits": {},
+        }
+
+        if level == self.chain_depth:
+            hit_id = self._cve(sensor_id)
+            process["alliance_score_" + self.feed_name] = self.score
+            process["alliance_hits"] = {
+                self.feed_name: {
+                    "feedinfo": {"name": self.feed_name},
+                    "hits": {hit_id: {
+                        "title": "{0} vulnerable app".format(hit_id),
+                        "score": self.score}},
+                }
+            }
+        return {"process": process}
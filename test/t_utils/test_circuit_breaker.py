@@ -0,0 +1,49 @@
+from unittest import TestCase, main as unittest_main
+from time import sleep
+
+from utils.circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+
+class TestCircuitBreaker(TestCase):
+
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker(3, 60)
+        self.assertFalse(breaker.failure())
+        self.assertFalse(breaker.failure())
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.failure())
+        self.assertEqual(breaker.state, OPEN)
+        self.assertFalse(breaker.allow())
+
+    def test_success_resets_the_count(self):
+        breaker = CircuitBreaker(2, 60)
+        breaker.failure()
+        breaker.success()
+        breaker.failure()
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_single_trial_after_reset_timeout(self):
+        breaker = CircuitBreaker(1, 0.05)
+        breaker.failure()
+        sleep(0.1)
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertFalse(breaker.allow())
+
+        # a failed trial opens it again, a good one closes it
+        self.assertTrue(breaker.failure())
+        self.assertFalse(breaker.allow())
+        sleep(0.1)
+        self.assertTrue(breaker.allow())
+        breaker.success()
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_zero_threshold_never_opens(self):
+        breaker = CircuitBreaker(0, 60)
+        for _ in range(100):
+            breaker.failure()
+        self.assertTrue(breaker.allow())
+
+
+if __name__ == '__main__':
+    unittest_main()
@@ -0,0 +1,85 @@
+from unittest import TestCase, main as unittest_main
+from threading import Thread, Lock
+from time import sleep
+
+from utils.lru_cache import LruCache
+
+
+class TestLruCache(TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LruCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)  # 'b' is now the oldest
+        cache.put('c', 3)
+        self.assertEqual(cache.get('b', None), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats(), {"size": 2, "hits": 3, "misses": 1})
+
+    def test_ttl_expiry(self):
+        cache = LruCache(10, ttl=0.1)
+        cache.put('a', 1)
+        cache.put('b', 2, ttl=None)
+        self.assertEqual(cache.get('a'), 1)
+        sleep(0.15)
+        self.assertEqual(cache.get('a', None), None)
+        self.assertEqual(cache.get('b'), 2)
+
+    def test_negative_caching(self):
+        cache = LruCache(10, ttl=60)
+        calls = list()
+
+        def loader(key):
+            calls.append(key)
+            return None
+
+        self.assertEqual(cache.get_or_load('x', loader, none_ttl=0.1), None)
+        self.assertEqual(cache.get_or_load('x', loader, none_ttl=0.1), None)
+        self.assertEqual(calls, ['x'])
+        sleep(0.15)
+        cache.get_or_load('x', loader, none_ttl=0.1)
+        self.assertEqual(calls, ['x', 'x'])
+
+    def test_loader_errors_not_cached(self):
+        cache = LruCache(10)
+
+        def loader(key):
+            raise IOError("server down")
+
+        with self.assertRaises(IOError):
+            cache.get_or_load('x', loader)
+        self.assertEqual(cache.get_or_load('x', lambda key: 5), 5)
+
+    def test_single_flight(self):
+        """
+        Concurrent lookups for the same key share one loader call.
+        """
+        cache = LruCache(10)
+        calls = list()
+        calls_lock = Lock()
+        results = list()
+
+        def slow_loader(key):
+            with calls_lock:
+                calls.append(key)
+            sleep(0.2)
+            return 42
+
+        def lookup():
+            results.append(cache.get_or_load('sensor', slow_loader))
+
+        threads = [Thread(target=lookup) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(calls, ['sensor'])
+        self.assertEqual(results, [42] * 10)
+        self.assertEqual(cache.misses.value, 10)
+
+
+if __name__ == '__main__':
+    unittest_main()
@@ -0,0 +1,110 @@
+from unittest import TestCase, main as unittest_main
+from urllib2 import urlopen, HTTPError
+
+from utils.metrics import Counter, Histogram, Gauge, MetricFamily, \
+    MetricsRegistry, OTHER_LABEL_VALUE
+from utils.metrics_server import MetricsServer
+
+
+class TestMetricFamily(TestCase):
+
+    def test_children_by_label_values(self):
+        family = MetricFamily(Counter, "events", "events", ("type",))
+        family.labels("a").increment()
+        family.labels("a").increment()
+        family.labels("b").increment()
+        self.assertTrue(family.labels("a") is family.labels("a"))
+        self.assertEqual(sorted((values, child.value)
+                                for values, child in family.children()),
+                         [(("a",), 2), (("b",), 1)])
+        self.assertRaises(ValueError, family.labels, "a", "b")
+
+    def test_max_children(self):
+        family = MetricFamily(Counter, "events", "events", ("type",),
+                              max_children=2)
+        for event_type in ("a", "b", "c", "d"):
+            family.labels(event_type).increment()
+        self.assertEqual(family.labels("a").value, 1)
+        self.assertEqual(family.labels(OTHER_LABEL_VALUE).value, 2)
+
+
+class TestMetricsRegistry(TestCase):
+
+    def test_render(self):
+        registry = MetricsRegistry(namespace="test")
+        counter = Counter("sent", "messages sent")
+        counter.increment(3)
+        registry.register("sent_total", counter, channel="a")
+        registry.register("sent_total", Counter("sent"), channel='b"')
+        registry.register("depth", Gauge("depth", "queued", lambda: 7))
+
+        histogram = Histogram("latency", "request latency", (0.1, 1.0))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        registry.register("latency_seconds", histogram)
+
+        family = MetricFamily(Counter, "events", "events", ("type",))
+        family.labels("b").increment()
+        family.labels("a").increment(2)
+        registry.register("events_total", family, source="s3")
+
+        self.assertEqual(registry.render().split("\n"), [
+            '# HELP test_sent_total messages sent',
+            '# TYPE test_sent_total counter',
+            'test_sent_total{channel="a"} 3',
+            'test_sent_total{channel="b\\""} 0',
+            '# HELP test_depth queued',
+            '# TYPE test_depth gauge',
+            'test_depth 7',
+            '# HELP test_latency_seconds request latency',
+            '# TYPE test_latency_seconds histogram',
+            'test_latency_seconds_bucket{le="0.1"} 1',
+            'test_latency_seconds_bucket{le="1.0"} 2',
+            'test_latency_seconds_bucket{le="+Inf"} 2',
+            'test_latency_seconds_sum 0.55',
+            'test_latency_seconds_count 2',
+            '# HELP test_events_total events',
+            '# TYPE test_events_total counter',
+            'test_events_total{source="s3",type="a"} 2',
+            'test_events_total{source="s3",type="b"} 1',
+            '',
+        ])
+
+    def test_type_mismatch(self):
+        registry = MetricsRegistry()
+        registry.register("depth", Gauge("depth"))
+        self.assertRaises(ValueError, registry.register, "depth",
+                          Counter("depth"))
+
+    def test_failing_gauge_is_left_out(self):
+        registry = MetricsRegistry(namespace="")
+        registry.register("broken", Gauge("broken", "", lambda: 1 / 0))
+        registry.register("working", Gauge("working", "", lambda: 1))
+        self.assertTrue("\nworking 1\n" in registry.render())
+        self.assertFalse("\nbroken " in registry.render())
+
+
+class TestMetricsServer(TestCase):
+
+    def test_serves_metrics(self):
+        registry = MetricsRegistry(namespace="test")
+        counter = Counter("sent", "messages sent")
+        registry.register("sent_total", counter)
+        server = MetricsServer(registry, 0)
+        try:
+            url = "http://127.0.0.1:{0}".format(server.port)
+            counter.increment()
+            response = urlopen(url + "/metrics")
+            self.assertTrue(response.info()["Content-Type"].startswith(
+                "text/plain"))
+            self.assertTrue("\ntest_sent_total 1\n" in response.read())
+
+            with self.assertRaises(HTTPError) as raised:
+                urlopen(url + "/other")
+            self.assertEqual(raised.exception.code, 404)
+        finally:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    unittest_main()
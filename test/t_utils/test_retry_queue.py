@@ -0,0 +1,41 @@
+from unittest import TestCase, main as unittest_main
+
+from utils.retry_queue import RetryQueue, backoff_delay
+
+
+class TestRetryQueue(TestCase):
+
+    def test_backoff_is_capped(self):
+        for attempt in range(10):
+            delay = backoff_delay(attempt, 1, 8)
+            self.assertTrue(0 <= delay <= min(8, 2 ** attempt))
+        self.assertTrue(backoff_delay(1000, 1, 8) <= 8)
+
+    def test_items_are_merged_by_key(self):
+        queue = RetryQueue(10, lambda queued, item: queued + item, 0, 0)
+        queue.put("a", [1])
+        queue.put("b", [2])
+        queue.put("a", [3])
+        self.assertEqual(len(queue), 2)
+        self.assertEqual(queue.take(), {"a": [1, 3], "b": [2]})
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(queue.due_in(), None)
+
+    def test_bounded(self):
+        queue = RetryQueue(1, lambda queued, item: queued + item, 0, 0)
+        self.assertTrue(queue.put("a", [1]))
+        self.assertFalse(queue.put("b", [2]))
+        self.assertTrue(queue.put("a", [3]))
+        self.assertEqual(queue.take(), {"a": [1, 3]})
+
+    def test_not_taken_before_due(self):
+        queue = RetryQueue(10, lambda queued, item: queued + item, 60, 60)
+        queue.failed()
+        queue.put("a", [1])
+        self.assertTrue(queue.due_in() > 0)
+        self.assertEqual(queue.take(), dict())
+        self.assertEqual(queue.take(force=True), {"a": [1]})
+
+
+if __name__ == '__main__':
+    unittest_main()
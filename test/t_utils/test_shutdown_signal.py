@@ -0,0 +1,56 @@
+from unittest import TestCase, main as unittest_main
+import os
+import select
+
+from utils.shutdown_signal import ShutdownSignal, WakeupSignal
+
+
+def _open_fds():
+    return set(os.listdir("/proc/self/fd"))
+
+
+def _readable(fileno):
+    poller = select.poll()
+    poller.register(fileno, select.POLLIN)
+    return bool(poller.poll(0))
+
+
+class TestShutdownSignal(TestCase):
+
+    def test_close_gives_back_the_pipe(self):
+        fds = _open_fds()
+        signal = ShutdownSignal()
+        signal.fileno()
+        signal.set()
+        signal.close()
+        self.assertEqual(_open_fds(), fds)
+
+        # set for good, even for late waiters
+        self.assertTrue(signal.wait(0))
+        self.assertTrue(_readable(signal.fileno()))
+        signal.close()
+        self.assertEqual(_open_fds(), fds)
+
+
+class TestWakeupSignal(TestCase):
+
+    def test_close_gives_back_the_pipe(self):
+        fds = _open_fds()
+        signal = WakeupSignal()
+        signal.set()
+        signal.close()
+        self.assertEqual(_open_fds(), fds)
+
+        # setting a closed signal doesn't touch the old file descriptors
+        signal.clear()
+        signal.set()
+        self.assertTrue(signal.is_set())
+        self.assertTrue(_readable(signal.fileno()))
+        signal.clear()
+        self.assertFalse(_readable(signal.fileno()))
+        signal.close()
+        self.assertEqual(_open_fds(), fds)
+
+
+if __name__ == '__main__':
+    unittest_main()
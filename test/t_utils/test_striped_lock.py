@@ -0,0 +1,35 @@
+from unittest import TestCase, main as unittest_main
+from threading import Thread
+from time import sleep
+
+from utils.striped_lock import StripedLock
+
+
+class TestStripedLock(TestCase):
+
+    def test_same_key_same_lock(self):
+        locks = StripedLock(8)
+        self.assertTrue(locks.lock("abc") is locks.lock("abc"))
+        self.assertTrue(0 <= locks.index("abc") < len(locks))
+
+    def test_same_key_is_serialized(self):
+        locks = StripedLock(4)
+        counts = {"value": 0}
+
+        def worker():
+            for _ in range(200):
+                with locks.lock("md5"):
+                    value = counts["value"]
+                    sleep(0)
+                    counts["value"] = value + 1
+
+        threads = [Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counts["value"], 800)
+
+
+if __name__ == '__main__':
+    unittest_main()
@@ -0,0 +1,84 @@
+from unittest import TestCase, main as unittest_main
+import logging
+import time
+
+from utils.tracing import Tracer, monotonic, mark, finish, STAGE_RECEIVED
+
+
+class _Records(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = list()
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class TestTracer(TestCase):
+
+    def setUp(self):
+        self.records = _Records()
+        logger = logging.getLogger("utils.tracing")
+        logger.addHandler(self.records)
+        self.addCleanup(logger.removeHandler, self.records)
+
+    def test_monotonic(self):
+        first = monotonic()
+        time.sleep(0.01)
+        self.assertTrue(monotonic() - first >= 0.009)
+
+    def test_sampling(self):
+        self.assertEqual(Tracer(0, 10).start(), None)
+        self.assertNotEqual(Tracer(1, 10).start(), None)
+
+        tracer = Tracer(0.5, 10)
+        sampled = [tracer.start() for _ in range(1000)]
+        self.assertTrue(300 < len([t for t in sampled if t]) < 700)
+
+        # untraced events carry None around
+        mark(None, "stage")
+        finish(None, "stage")
+
+    def test_stages(self):
+        tracer = Tracer(1, 10)
+        trace = tracer.start("watchlist.storage.hit.process")
+        mark(trace, "cb_lookup")
+        trace.mark("cached")
+        trace.finish("posted")
+        trace.finish("posted")
+
+        self.assertEqual([stage for stage, _ in trace.stages],
+                         [STAGE_RECEIVED, "cb_lookup", "cached", "posted"])
+        self.assertEqual(tracer.traces_finished.value, 1)
+        self.assertEqual(sorted(values for values, _ in
+                                tracer.stage_latency.children()),
+                         [("cached",), ("cb_lookup",), ("posted",)])
+        self.assertEqual(self.records.messages, [])
+
+    def test_slow_trace_summary(self):
+        tracer = Tracer(1, 0.01)
+        trace = tracer.start("feed.storage.hit.process")
+        time.sleep(0.02)
+        trace.finish("fixlet_updated")
+
+        self.assertEqual(tracer.traces_slow.value, 1)
+        self.assertEqual(len(self.records.messages), 1)
+        self.assertTrue("feed.storage.hit.process" in self.records.messages[0])
+        self.assertTrue("fixlet_updated +0.0" in self.records.messages[0])
+
+        # fast ones aren't reported
+        tracer.start().finish("posted")
+        self.assertEqual(tracer.traces_slow.value, 1)
+
+    def test_slow_trace_log_interval(self):
+        # with no budget, every trace is slow, but the ones right after a
+        # logged one are only counted
+        tracer = Tracer(1, 0)
+        for _ in range(4):
+            tracer.start().finish("posted")
+        self.assertEqual(tracer.traces_slow.value, 4)
+        self.assertEqual(len(self.records.messages), 1)
+
+
+if __name__ == '__main__':
+    unittest_main()
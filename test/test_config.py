@@ -14,6 +14,9 @@ def mutate_to_test_config(
         bigfix_cache_enabled=False,
         bigfix_cache_package_interval=10,
         ssl_verification_off=True,
+        fixlet_coalesce_window=0,
+        fixlet_index_preload=False,
+        dashboard_delta_posts=False,
 ):
     """
     Whole purpose of this file is to allow for customizations of the standard
@@ -28,6 +31,12 @@ def mutate_to_test_config(
                     requests to the bigfix server.
     :param bigfix_cache_package_interval: if using the cache, how frequently
                     it should be purged.
+    :param fixlet_coalesce_window: seconds to collect banned file events
+                    for before updating fixlets, 0 updates on every event.
+    :param fixlet_index_preload: whether to index the custom site fixlets
+                    at startup.
+    :param dashboard_delta_posts: whether to only post dashboard changes.
+                    The state is kept in memory only.
     :return: the modified configuration according to the parameters
     """
     if fake_bigfix_server_enable:
@@ -43,6 +52,11 @@ def mutate_to_test_config(
 
     fletch_config.ibm_bigfix.cache_enabled = bigfix_cache_enabled
     fletch_config.ibm_bigfix.packaging_interval = bigfix_cache_package_interval
+    fletch_config.ibm_bigfix.fixlet_coalesce_window = fixlet_coalesce_window
+    fletch_config.ibm_bigfix.fixlet_index_preload = fixlet_index_preload
+    fletch_config.ibm_bigfix.dashboard_delta_posts = dashboard_delta_posts
+    fletch_config.ibm_bigfix.dashboard_state_file = None
+    fletch_config.ibm_bigfix.cache_spool_dir = None
 
     if not ssl_verification_off:
         fletch_config.ibm_bigfix.ssl_verify = False